@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -5,12 +6,22 @@ import logging
 import os
 from dotenv import load_dotenv
 
-from .routers import auth, courses, chat
-from .utils.helpers import cleanup_expired_sessions, get_active_sessions_count
-
-# Load environment variables
+# Load environment variables before importing modules that read them
 load_dotenv()
 
+from .middleware.admission import AdmissionMiddleware, get_admission_stats
+from .middleware.deadline import DeadlineMiddleware
+from .middleware.profiling import ProfilingMiddleware
+from .routers import admin, auth, calendar, courses, chat, dashboard, jobs
+from .services.chunk_store import close_chunk_stores
+from .services.course_watcher import get_watcher_stats, stop_all_watchers
+from .services.dashboard import stop_dashboard_refreshes
+from .services.jobs import job_manager
+from .services.moodle_client import get_hedge_stats, open_http_client, close_http_client
+from .services.snapshot import register_snapshot_seeds
+from .utils.helpers import cleanup_expired_sessions, get_active_sessions_count, get_session_store
+from .utils.offload import start_process_pool, stop_process_pool
+
 # Configure logging
 logging.basicConfig(
     level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper()),
@@ -18,6 +29,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Configure CORS
+cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:5173').split(',')
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the shared resources for the lifetime of the worker"""
+    logger.info("Starting Moodle AI Assistant API")
+    logger.info(f"CORS origins: {cors_origins}")
+    get_session_store()
+    await open_http_client()
+    register_snapshot_seeds()
+    await job_manager.start()
+    # Offloaded contents serialization lives in the courses router
+    await start_process_pool(courses.__name__)
+    logger.info("API is ready to accept connections from any Moodle instance")
+
+    yield
+
+    logger.info("Shutting down Moodle AI Assistant API")
+    await job_manager.stop()
+    await stop_all_watchers()
+    await stop_dashboard_refreshes()
+    await close_http_client()
+    await stop_process_pool()
+    close_chunk_stores()
+    # Clean up all sessions
+    await cleanup_expired_sessions()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Moodle AI Assistant API",
@@ -56,22 +97,35 @@ app = FastAPI(
         "name": "MIT",
         "url": "https://opensource.org/licenses/MIT",
     },
+    lifespan=lifespan,
 )
 
-# Configure CORS
-cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:5173').split(',')
+# Queue or shed Moodle-backed requests under overload; inside CORS so 503s carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+
+# Per-request deadline (X-Request-Timeout or REQUEST_TIMEOUT) for upstream calls; outside admission so queueing counts
+app.add_middleware(DeadlineMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After", "X-Contents-Version"],
 )
 
+# Opt-in request profiling (X-Profile-Request header or PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(courses.router)
 app.include_router(chat.router)
+app.include_router(calendar.router)
+app.include_router(dashboard.router)
+app.include_router(jobs.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
@@ -82,7 +136,7 @@ async def root():
         "version": "1.0.0",
         "description": "Dynamic Moodle integration that works with any university",
         "docs_url": "/docs",
-        "active_sessions": get_active_sessions_count(),
+        "active_sessions": await get_active_sessions_count(),
         "features": [
             "Dynamic Moodle authentication",
             "Course and content access",
@@ -98,7 +152,7 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "active_sessions": get_active_sessions_count(),
+        "active_sessions": await get_active_sessions_count(),
         "message": "Moodle AI Assistant API is running"
     }
 
@@ -107,16 +161,23 @@ async def health_check():
 async def api_status():
     """API status and statistics"""
     # Clean up expired sessions
-    cleaned_sessions = cleanup_expired_sessions()
+    cleaned_sessions = await cleanup_expired_sessions()
     
     return {
         "status": "operational",
-        "active_sessions": get_active_sessions_count(),
+        "active_sessions": await get_active_sessions_count(),
         "cleaned_sessions": cleaned_sessions,
+        "course_watchers": get_watcher_stats(),
+        "background_jobs": await job_manager.stats(),
+        "admission": get_admission_stats(),
+        "upstream_hedging": get_hedge_stats(),
         "endpoints": {
             "authentication": "/api/auth/*",
             "courses": "/api/courses/*", 
-            "chat": "/api/chat/*"
+            "chat": "/api/chat/*",
+            "calendar": "/api/calendar/*",
+            "dashboard": "/api/dashboard",
+            "jobs": "/api/jobs/*"
         },
         "capabilities": [
             "Multi-university Moodle support",
@@ -157,33 +218,7 @@ async def internal_error_handler(request, exc):
     )
 
 
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Starting Moodle AI Assistant API")
-    logger.info(f"CORS origins: {cors_origins}")
-    logger.info("API is ready to accept connections from any Moodle instance")
-
-
-# Shutdown event
-@app.on_event("shutdown")  
-async def shutdown_event():
-    logger.info("Shutting down Moodle AI Assistant API")
-    # Clean up all sessions
-    cleanup_expired_sessions()
-
-
 if __name__ == "__main__":
-    import uvicorn
-    
-    host = os.getenv('BACKEND_HOST', 'localhost')
-    port = int(os.getenv('BACKEND_PORT', 8000))
-    debug = os.getenv('DEBUG', 'true').lower() == 'true'
-    
-    uvicorn.run(
-        "app.main:app",
-        host=host,
-        port=port,
-        reload=debug,
-        log_level=os.getenv('LOG_LEVEL', 'info').lower()
-    )
\ No newline at end of file
+    from .server import run_server
+
+    run_server()
@@ -0,0 +1,277 @@
+"""
+Admission control and load shedding for the Moodle-backed routers.
+
+Requests to ``/api/courses``, ``/api/calendar``, ``/api/dashboard`` and
+``/api/chat`` need a slot before they run.
+The number of slots adapts to observed latency (AIMD): it grows by one per
+window of fast interactive requests and shrinks by ADMISSION_DECREASE at most
+once per round trip when they get slower than ADMISSION_TARGET_LATENCY.
+
+Requests over the limit wait in fair queues: interactive requests are served
+before bulk ones (downloads, snapshots, the calendar event stream), which may only use
+ADMISSION_BULK_SHARE of the slots, and within a class the sessions
+(X-Session-ID) take turns, so one client's burst cannot starve the others.
+When the queues are full, or a request waits longer than
+ADMISSION_QUEUE_TIMEOUT, it gets an immediate 503 with Retry-After.
+Health, auth and admin endpoints are never queued.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_INITIAL_LIMIT = int(os.getenv('ADMISSION_INITIAL_LIMIT', 32))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', 4))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', 256))
+ADMISSION_TARGET_LATENCY = float(os.getenv('ADMISSION_TARGET_LATENCY', 2.0))
+ADMISSION_DECREASE = float(os.getenv('ADMISSION_DECREASE', 0.8))
+ADMISSION_BULK_SHARE = float(os.getenv('ADMISSION_BULK_SHARE', 0.5))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2.0))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 256))
+ADMISSION_MAX_QUEUED_PER_SESSION = int(os.getenv('ADMISSION_MAX_QUEUED_PER_SESSION', 16))
+
+INTERACTIVE, BULK = 0, 1
+PRIORITY_NAMES = ('interactive', 'bulk')
+
+SESSION_HEADER = b"x-session-id"
+BULK_SUFFIXES = ('/download', '/snapshot')
+# Long-lived streams: they hold their slot for the whole stream
+BULK_PATHS = ('/api/calendar/events',)
+
+
+def classify(path: str) -> Optional[int]:
+    """Priority class of a request path, or None if it bypasses admission control"""
+    if path.startswith('/api/courses'):
+        if path.endswith(BULK_SUFFIXES) or '/files/' in path:
+            return BULK
+        return INTERACTIVE
+    if path.startswith(BULK_PATHS):
+        return BULK
+    if path.startswith(('/api/chat', '/api/calendar', '/api/dashboard')):
+        return INTERACTIVE
+    return None
+
+
+class AdmissionController:
+    """Adaptive concurrency limit with per-class, per-session fair queues"""
+
+    def __init__(self):
+        self.limit = float(ADMISSION_INITIAL_LIMIT)
+        self.inflight = 0
+        self.inflight_bulk = 0
+        # priority -> session -> waiting futures; sessions rotate round-robin
+        self.queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            INTERACTIVE: OrderedDict(),
+            BULK: OrderedDict(),
+        }
+        self.queued = 0
+        self.queued_per_session: Dict[str, int] = {}
+        self.latency_ewma = 0.0
+        self.last_decrease = 0.0
+        self.counters = {'admitted': 0, 'enqueued': 0, 'rejected': 0, 'timed_out': 0}
+
+    def _has_slot(self, priority: int) -> bool:
+        if self.inflight >= int(self.limit):
+            return False
+        if priority == BULK:
+            return self.inflight_bulk < max(1, int(self.limit * ADMISSION_BULK_SHARE))
+        return True
+
+    def _start(self, priority: int):
+        self.inflight += 1
+        if priority == BULK:
+            self.inflight_bulk += 1
+        self.counters['admitted'] += 1
+
+    def _waiting_ahead(self, priority: int) -> bool:
+        return any(self.queues[level] for level in range(priority + 1))
+
+    async def acquire(self, priority: int, session: str) -> bool:
+        """Wait for a slot; False means the request should be shed"""
+        if not self._waiting_ahead(priority) and self._has_slot(priority):
+            self._start(priority)
+            return True
+
+        if self.queued >= ADMISSION_MAX_QUEUE or \
+                self.queued_per_session.get(session, 0) >= ADMISSION_MAX_QUEUED_PER_SESSION:
+            self.counters['rejected'] += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(session, deque()).append(future)
+        self.queued += 1
+        self.queued_per_session[session] = self.queued_per_session.get(session, 0) + 1
+        self.counters['enqueued'] += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), ADMISSION_QUEUE_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            if future.done():
+                # Granted in the same tick the timeout fired
+                return True
+            self._dequeue(priority, session, future)
+            future.cancel()
+            self.counters['timed_out'] += 1
+            return False
+        except asyncio.CancelledError:
+            # Client went away while waiting; give back a slot granted meanwhile
+            if future.done() and not future.cancelled():
+                self.release(priority, 0.0)
+            else:
+                self._dequeue(priority, session, future)
+                future.cancel()
+            raise
+
+    def _dequeue(self, priority: int, session: str, future: asyncio.Future):
+        waiters = self.queues[priority].get(session)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        if not waiters:
+            del self.queues[priority][session]
+        self._queued_done(session)
+
+    def _queued_done(self, session: str):
+        self.queued -= 1
+        remaining = self.queued_per_session[session] - 1
+        if remaining:
+            self.queued_per_session[session] = remaining
+        else:
+            del self.queued_per_session[session]
+
+    def _dispatch(self):
+        """Hand free slots to waiters: by priority, then round-robin over sessions"""
+        while self.queued:
+            for priority in (INTERACTIVE, BULK):
+                sessions = self.queues[priority]
+                if sessions and self._has_slot(priority):
+                    session, waiters = next(iter(sessions.items()))
+                    future = waiters.popleft()
+                    if waiters:
+                        sessions.move_to_end(session)
+                    else:
+                        del sessions[session]
+                    self._queued_done(session)
+                    self._start(priority)
+                    future.set_result(True)
+                    break
+            else:
+                return
+
+    def release(self, priority: int, latency: float):
+        self.inflight -= 1
+        if priority == BULK:
+            self.inflight_bulk -= 1
+        self._observe(priority, latency)
+        self._dispatch()
+
+    def _observe(self, priority: int, latency: float):
+        if priority != INTERACTIVE or latency <= 0:
+            return
+        self.latency_ewma = latency if not self.latency_ewma else 0.9 * self.latency_ewma + 0.1 * latency
+
+        now = time.monotonic()
+        if latency > ADMISSION_TARGET_LATENCY:
+            # Multiplicative decrease, once per round trip
+            if now - self.last_decrease > latency:
+                self.limit = max(float(ADMISSION_MIN_LIMIT), self.limit * ADMISSION_DECREASE)
+                self.last_decrease = now
+                logger.info(f"Admission limit decreased to {int(self.limit)} (latency {latency:.2f}s)")
+        elif self.queued or self.inflight + 1 >= self.limit / 2:
+            # Additive increase: about +1 per window of limit requests, only while the limit is in use
+            self.limit = min(float(ADMISSION_MAX_LIMIT), self.limit + 1 / self.limit)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        latency = self.latency_ewma or 1.0
+        return max(1, min(30, math.ceil(latency * (self.queued + 1) / max(self.limit, 1))))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': ADMISSION_ENABLED,
+            'limit': int(self.limit),
+            'inflight': self.inflight,
+            'inflight_bulk': self.inflight_bulk,
+            'queued': {
+                PRIORITY_NAMES[priority]: sum(len(waiters) for waiters in sessions.values())
+                for priority, sessions in self.queues.items()
+            },
+            'latency_ewma_ms': round(self.latency_ewma * 1000, 1),
+            **self.counters,
+        }
+
+
+admission_controller = AdmissionController()
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    return admission_controller.stats()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that queues or sheds requests to Moodle-backed routes"""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not ADMISSION_ENABLED or scope.get('method') == 'OPTIONS':
+            await self.app(scope, receive, send)
+            return
+
+        priority = classify(scope.get('path', ''))
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+
+        session = None
+        for name, value in scope.get('headers', ()):
+            if name == SESSION_HEADER:
+                session = value.decode('latin-1')
+                break
+        if session is None:
+            client = scope.get('client')
+            session = client[0] if client else ''
+
+        if not await self.controller.acquire(priority, session):
+            await self._reject(send)
+            return
+
+        start = time.perf_counter()
+        first_chunk: Optional[float] = None
+
+        async def send_wrapper(message):
+            nonlocal first_chunk
+            if first_chunk is None and message['type'] == 'http.response.body' and message.get('more_body'):
+                first_chunk = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # A streamed response's latency is the time to its first chunk; how long
+            # the client keeps reading says nothing about how loaded we are
+            end = first_chunk if first_chunk is not None else time.perf_counter()
+            self.controller.release(priority, end - start)
+
+    async def _reject(self, send):
+        body = json.dumps({'detail': 'Server is busy, please retry shortly'}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(self.controller.retry_after()).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
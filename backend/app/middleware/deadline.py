@@ -0,0 +1,111 @@
+"""
+Per-request deadlines carried into upstream calls.
+
+Each request to a Moodle-backed router gets a deadline: ``X-Request-Timeout``
+seconds (capped at REQUEST_TIMEOUT_MAX) if the client sends one, otherwise
+REQUEST_TIMEOUT for interactive requests. Bulk requests (downloads, snapshots,
+the calendar event stream) have no default deadline. The deadline lives in a
+ContextVar, so every task spawned while handling the request inherits it, and
+upstream_timeout() turns it into the timeout of each Moodle call: no step of a
+fan-out waits longer than the client will. Time spent in the admission queue counts against it.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+from .admission import INTERACTIVE, classify
+
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 30))
+REQUEST_TIMEOUT_MAX = float(os.getenv('REQUEST_TIMEOUT_MAX', 120))
+
+TIMEOUT_HEADER = b"x-request-timeout"
+
+T = TypeVar('T')
+
+_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before an upstream call could finish"""
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left until the current request's deadline, or None without one"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def upstream_timeout(default: float) -> float:
+    """Timeout for an upstream call: default, shortened to the request's remaining time"""
+    remaining = remaining_time()
+    if remaining is None:
+        return default
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(default, remaining)
+
+
+async def within_deadline(awaitable: Awaitable[T]) -> T:
+    """
+    Await with the request's remaining time as a hard limit
+
+    httpx timeouts apply per network operation, so a response that trickles
+    in slowly could otherwise outlive the deadline.
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(remaining, 0.0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Request deadline exceeded") from None
+
+
+@contextmanager
+def deadline_scope(timeout: Optional[float]) -> Iterator[None]:
+    """Run a block with its own deadline (None: no deadline, e.g. for background work)"""
+    token = _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _requested_timeout(scope) -> Optional[float]:
+    for name, value in scope.get('headers', ()):
+        if name == TIMEOUT_HEADER:
+            try:
+                timeout = float(value)
+            except ValueError:
+                return None
+            return min(timeout, REQUEST_TIMEOUT_MAX) if timeout > 0 else None
+    return None
+
+
+class DeadlineMiddleware:
+    """ASGI middleware that sets the deadline of requests to Moodle-backed routes"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        priority = classify(scope.get('path', ''))
+        timeout = _requested_timeout(scope) if priority is not None else None
+        if timeout is None and priority == INTERACTIVE and REQUEST_TIMEOUT > 0:
+            timeout = REQUEST_TIMEOUT
+
+        if timeout is None:
+            await self.app(scope, receive, send)
+            return
+
+        with deadline_scope(timeout):
+            await self.app(scope, receive, send)
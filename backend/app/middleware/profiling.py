@@ -0,0 +1,281 @@
+"""
+On-demand per-request profiling.
+
+A request is profiled when it carries ``X-Profile-Request: <PROFILE_ADMIN_TOKEN>``
+or when it is picked by ``PROFILE_SAMPLE_RATE``. Profiled requests get a
+cProfile capture (standard pstats format) plus a phase breakdown:
+
+- upstream: waiting on Moodle
+- decode: parsing upstream JSON
+- validate: building pydantic models in the routers
+- serialize: response model validation and rendering after the endpoint returns
+
+A phase's time is the wall-clock time during which at least one operation of
+that phase was running, so concurrent upstream calls (gather, hedged reads)
+are counted once, not summed. Different phases can still overlap each other,
+so the phases may add up to more than the request took; ``other`` is the
+remainder, clamped at zero.
+
+Profiles are kept in memory by the worker process that served the request;
+with several workers, /api/admin/profiles only lists the answering worker's.
+PROFILE_DIR collects the summaries of every worker.
+
+When a request is not profiled the only cost is one ContextVar lookup per phase.
+"""
+import cProfile
+import functools
+import hmac
+import inspect
+import json
+import logging
+import marshal
+import os
+import random
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile-request"
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+
+PHASES = ('upstream', 'decode', 'validate', 'serialize')
+
+
+class RequestProfile:
+    """Timing and cProfile data collected for a single request"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        # Operations in progress per phase, and since when the phase has been busy
+        self._active: Dict[str, int] = {}
+        self._busy_since: Dict[str, float] = {}
+        self.handler_done: Optional[float] = None
+        self.response_started: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.profiler: Optional[cProfile.Profile] = None
+        self.stats: Optional[bytes] = None
+
+    def add(self, phase: str, elapsed: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+    def enter(self, phase: str):
+        active = self._active.get(phase, 0)
+        if active == 0:
+            self._busy_since[phase] = time.perf_counter()
+        self._active[phase] = active + 1
+
+    def exit(self, phase: str):
+        active = self._active[phase] - 1
+        self._active[phase] = active
+        if active == 0:
+            # Only the union of overlapping operations counts towards the phase
+            self.add(phase, time.perf_counter() - self._busy_since.pop(phase))
+
+    def summary(self) -> Dict[str, Any]:
+        end = self.response_started or time.perf_counter()
+        total = end - self.start
+        phases_ms = {name: round(value * 1000, 3) for name, value in self.phases.items()}
+        phases_ms['other'] = round(max(total - sum(self.phases.values()), 0.0) * 1000, 3)
+        return {
+            'profile_id': self.profile_id,
+            'method': self.method,
+            'path': self.path,
+            'reason': self.reason,
+            'status_code': self.status_code,
+            'started_at': self.started_at,
+            'total_ms': round(total * 1000, 3),
+            'phases_ms': phases_ms,
+            'has_stats': self.stats is not None,
+        }
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('current_profile', default=None)
+
+# Only one cProfile collector can be active per thread; concurrent profiled
+# requests fall back to the phase breakdown only.
+_profiler_busy = False
+
+# Recently completed profiles, newest last
+PROFILES: Deque[RequestProfile] = deque(maxlen=PROFILE_KEEP)
+
+
+class _Phase:
+    __slots__ = ('profile', 'name')
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.exit(self.name)
+        return False
+
+
+class _NoopPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_PHASE = _NoopPhase()
+
+
+def profile_phase(name: str):
+    """Context manager that attributes the enclosed time to a phase of the current profile"""
+    profile = _current_profile.get()
+    if profile is None:
+        return _NOOP_PHASE
+    return _Phase(profile, name)
+
+
+def _mark_handler_done():
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.handler_done = time.perf_counter()
+
+
+def _wrap_endpoint(endpoint: Callable) -> Callable:
+    """Record when the endpoint returns so serialization time can be measured"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_done()
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def sync_wrapper(*args, **kwargs):
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            _mark_handler_done()
+    return sync_wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute that marks the end of the endpoint for the serialize phase"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _wrap_endpoint(endpoint), **kwargs)
+
+
+def _should_profile(scope) -> Optional[str]:
+    if PROFILE_ADMIN_TOKEN:
+        for name, value in scope.get('headers', ()):
+            if name == PROFILE_HEADER:
+                if hmac.compare_digest(value.decode('latin-1'), PROFILE_ADMIN_TOKEN):
+                    return 'header'
+                break
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+def _finish(profile: RequestProfile):
+    global _profiler_busy
+
+    if profile.profiler is not None:
+        profile.profiler.disable()
+        profile.profiler.create_stats()
+        profile.stats = marshal.dumps(profile.profiler.stats)
+        profile.profiler = None
+        _profiler_busy = False
+
+    if profile.response_started is not None and profile.handler_done is not None:
+        profile.phases['serialize'] += max(profile.response_started - profile.handler_done, 0.0)
+
+    PROFILES.append(profile)
+
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if profile.stats is not None:
+                with open(os.path.join(PROFILE_DIR, f"{profile.profile_id}.prof"), 'wb') as f:
+                    f.write(profile.stats)
+            with open(os.path.join(PROFILE_DIR, f"{profile.profile_id}.json"), 'w') as f:
+                json.dump(profile.summary(), f)
+        except OSError as e:
+            logger.warning(f"Could not write profile {profile.profile_id}: {e}")
+
+    logger.info(f"Profiled {profile.method} {profile.path}: {profile.summary()['phases_ms']}")
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles opted-in requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        reason = _should_profile(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        global _profiler_busy
+        profile = RequestProfile(scope.get('method', ''), scope.get('path', ''), reason)
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                profile.response_started = time.perf_counter()
+                profile.status_code = message.get('status')
+                headers = list(message.get('headers', []))
+                headers.append((b'x-profile-id', profile.profile_id.encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        # cProfile sees every coroutine running on this thread while enabled,
+        # so the capture is most useful on a quiet worker or with low sampling.
+        if not _profiler_busy:
+            _profiler_busy = True
+            profile.profiler = cProfile.Profile()
+            profile.profiler.enable()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            _finish(profile)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Summaries of recently collected profiles, newest first"""
+    return [profile.summary() for profile in reversed(PROFILES)]
+
+
+def get_profile(profile_id: str) -> Optional[RequestProfile]:
+    """Find a recently collected profile by id"""
+    for profile in PROFILES:
+        if profile.profile_id == profile_id:
+            return profile
+    return None
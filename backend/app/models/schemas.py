@@ -111,4 +111,47 @@ class ChatMessage(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
-    suggestions: Optional[List[str]] = None
\ No newline at end of file
+    suggestions: Optional[List[str]] = None
+
+
+class JobCreateRequest(BaseModel):
+    kind: str
+    course_id: int
+    file_types: Optional[List[str]] = None
+    max_size: Optional[int] = None
+    include_text: bool = False
+    refresh: bool = False
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    kind: str
+    state: str
+    progress: float
+    message: Optional[str] = None
+    params: Dict[str, Any]
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    has_download: bool = False
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class Deadline(BaseModel):
+    type: str
+    id: int
+    cmid: Optional[int] = None
+    course_id: int
+    course_name: Optional[str] = None
+    name: str
+    due: int
+    opens: Optional[int] = None
+    cutoff: Optional[int] = None
+    url: str
+
+
+class DeadlinesResponse(BaseModel):
+    deadlines: List[Deadline]
+    warnings: List[str] = []
+    generated_at: int
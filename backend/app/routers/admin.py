@@ -0,0 +1,61 @@
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import Response
+from typing import Optional
+import hmac
+import logging
+
+from ..middleware.profiling import PROFILE_ADMIN_TOKEN, get_profile, list_profiles
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+
+def require_admin(admin_token: Optional[str]):
+    """Check the admin token header against PROFILE_ADMIN_TOKEN"""
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+
+    if not admin_token or not hmac.compare_digest(admin_token, PROFILE_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@router.get("/profiles")
+async def get_profiles(admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """List recently profiled requests with their phase breakdown (this worker's only)"""
+    require_admin(admin_token)
+
+    return {"profiles": list_profiles()}
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile_summary(
+    profile_id: str,
+    admin_token: Optional[str] = Header(None, alias="X-Admin-Token")
+):
+    """Get the phase breakdown of a single profiled request"""
+    require_admin(admin_token)
+
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return profile.summary()
+
+
+@router.get("/profiles/{profile_id}/stats")
+async def get_profile_stats(
+    profile_id: str,
+    admin_token: Optional[str] = Header(None, alias="X-Admin-Token")
+):
+    """Download the cProfile capture in pstats format (load with pstats or snakeviz)"""
+    require_admin(admin_token)
+
+    profile = get_profile(profile_id)
+    if not profile or profile.stats is None:
+        raise HTTPException(status_code=404, detail="Profile stats not found")
+
+    return Response(
+        content=profile.stats,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'}
+    )
@@ -2,12 +2,13 @@ from fastapi import APIRouter, HTTPException, Header
 from typing import Optional
 import logging
 
+from ..middleware.profiling import ProfiledRoute
 from ..models.schemas import MoodleLoginRequest, MoodleLoginResponse
 from ..services.moodle_client import MoodleClient
 from ..utils.helpers import create_user_session, get_user_session, delete_user_session
 
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/api/auth", tags=["authentication"])
+router = APIRouter(prefix="/api/auth", tags=["authentication"], route_class=ProfiledRoute)
 
 
 @router.post("/login", response_model=MoodleLoginResponse)
@@ -47,13 +48,6 @@ async def login(request: MoodleLoginRequest):
                 message=f"Authentication failed: {auth_result.get('error', 'Unknown error')}"
             )
         
-        # Create user session
-        session_id = create_user_session(
-            moodle_url=request.moodle_url,
-            token=auth_result['token'],
-            user_info=auth_result['user_info']
-        )
-        
         # Get additional user info from Moodle
         try:
             moodle_client = MoodleClient(request.moodle_url, auth_result['token'])
@@ -72,6 +66,13 @@ async def login(request: MoodleLoginRequest):
             logger.warning(f"Could not fetch additional user info: {e}")
             user_info = auth_result['user_info']
         
+        # Create user session (a new one per login unless SESSION_REUSE is on)
+        session_id = await create_user_session(
+            moodle_url=request.moodle_url,
+            token=auth_result['token'],
+            user_info=user_info
+        )
+        
         return MoodleLoginResponse(
             success=True,
             session_id=session_id,
@@ -93,7 +94,7 @@ async def logout(session_id: Optional[str] = Header(None, alias="X-Session-ID"))
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
-    success = delete_user_session(session_id)
+    success = await delete_user_session(session_id)
     
     if success:
         return {"success": True, "message": "Logged out successfully"}
@@ -107,7 +108,7 @@ async def validate_session(session_id: Optional[str] = Header(None, alias="X-Ses
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
-    session = get_user_session(session_id)
+    session = await get_user_session(session_id)
     
     if session:
         return {
@@ -125,7 +126,7 @@ async def get_session_info(session_id: Optional[str] = Header(None, alias="X-Ses
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
-    session = get_user_session(session_id)
+    session = await get_user_session(session_id)
     
     if not session:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
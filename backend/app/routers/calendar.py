@@ -0,0 +1,89 @@
+from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, List, Optional
+import json
+import logging
+import time
+
+from ..middleware.deadline import DeadlineExceeded
+from ..middleware.profiling import ProfiledRoute
+from ..services.calendar import CALENDAR_PAGE_SIZE, get_event_window, iter_window_pages
+from .courses import get_moodle_client_from_session
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/calendar", tags=["calendar"], route_class=ProfiledRoute)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _ndjson(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, separators=(',', ':')).encode() + b'\n'
+
+
+@router.get("/events")
+async def stream_action_events(
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    since: Optional[int] = Query(None, description="Unix time of the earliest event (default: start of today, UTC)"),
+    until: Optional[int] = Query(None, description="Unix time of the latest event"),
+    days: Optional[int] = Query(None, ge=1, le=366, description="Shorthand for until = since + days"),
+    page_size: int = Query(CALENDAR_PAGE_SIZE, ge=1, le=50, description="Events per upstream page"),
+    refresh: bool = Query(False, description="Bypass the server-side event cache")
+):
+    """
+    Stream the user's calendar action events (assignments, quizzes, ...) by time
+
+    The response is newline-delimited JSON: one ``{"page": n, "events": [...]}``
+    line per upstream page as soon as it arrives, then a final
+    ``{"done": true, ...}`` line. A failure after the first page is reported as
+    an ``{"error": ...}`` line since the status code has already been sent.
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+
+    if since is None:
+        since = int(time.time()) // 86400 * 86400
+    if days:
+        until = since + days * 86400
+
+    try:
+        moodle_client = await get_moodle_client_from_session(session_id)
+        window = get_event_window(session_id, (since, until, page_size), refresh)
+        pages = iter_window_pages(moodle_client, window)
+        # Fetch the first page up front so auth and upstream errors get a real status code
+        try:
+            first: Optional[List[Dict[str, Any]]] = await pages.__anext__()
+        except StopAsyncIteration:
+            first = None
+
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get calendar events: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve calendar events")
+
+    async def body() -> AsyncIterator[bytes]:
+        count = 0
+        page_number = 0
+        try:
+            if first is not None:
+                count += len(first)
+                yield _ndjson({'page': 0, 'events': first})
+                async for page in pages:
+                    page_number += 1
+                    count += len(page)
+                    yield _ndjson({'page': page_number, 'events': page})
+            yield _ndjson({
+                'done': True,
+                'pages': page_number + 1 if first is not None else 0,
+                'events': count,
+                'truncated': window.truncated,
+            })
+        except Exception as e:
+            logger.error(f"Calendar event stream failed after {count} events: {e}")
+            yield _ndjson({'error': 'Failed to retrieve further calendar events', 'events': count})
+        finally:
+            await pages.aclose()
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
@@ -1,12 +1,19 @@
 from fastapi import APIRouter, HTTPException, Header
+from datetime import datetime, timezone
 from typing import Optional
 import logging
+import time
 
+from ..middleware.deadline import DeadlineExceeded
+from ..middleware.profiling import ProfiledRoute
 from ..models.schemas import ChatMessage, ChatResponse
+from ..services.dashboard import STATIC_SUGGESTIONS, get_cached_dashboard
+from ..services.deadlines import get_deadlines
+from ..services.moodle_client import MoodleClient
 from ..utils.helpers import get_user_session
 
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/api/chat", tags=["chat"])
+router = APIRouter(prefix="/api/chat", tags=["chat"], route_class=ProfiledRoute)
 
 
 @router.post("/", response_model=ChatResponse)
@@ -26,7 +33,7 @@ async def chat_with_ai(
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
-    session = get_user_session(session_id)
+    session = await get_user_session(session_id)
     if not session:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     
@@ -35,7 +42,27 @@ async def chat_with_ai(
         user_message = message.message.lower()
         
         # Simple pattern matching for demonstration
-        if "courses" in user_message or "course" in user_message:
+        if "assignment" in user_message or "deadline" in user_message or " due" in user_message:
+            moodle_client = MoodleClient(session['moodle_url'], session['token'])
+            timeline = await get_deadlines(moodle_client, session_id)
+            upcoming = timeline.select(since=int(time.time()), limit=5)
+            if upcoming:
+                lines = [
+                    f"- {datetime.fromtimestamp(item['due'], timezone.utc).strftime('%a %d %b %H:%M UTC')}: "
+                    f"{item['name']} ({item['course_name'] or 'course ' + str(item['course_id'])})"
+                    for item in upcoming
+                ]
+                response_text = "Here's what's coming up next:\n" + "\n".join(lines)
+            else:
+                response_text = "You have no upcoming assignment or quiz deadlines."
+            if timeline.warnings:
+                response_text += f"\n\n(Some deadlines may be missing: {', '.join(timeline.warnings)}.)"
+            suggestions = [
+                "Show me my courses",
+                "Help me find course materials",
+                "Help me prepare for exams"
+            ]
+        elif "courses" in user_message or "course" in user_message:
             response_text = f"I can help you with your courses! You're connected to {session['moodle_url']}. Use the courses section to browse your enrolled courses and materials."
             suggestions = [
                 "Show me my courses",
@@ -87,6 +114,8 @@ What would you like to explore first?"""
             suggestions=suggestions
         )
         
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except Exception as e:
         logger.error(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail="Failed to process chat message")
@@ -98,21 +127,13 @@ async def get_chat_suggestions(session_id: Optional[str] = Header(None, alias="X
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
-    session = get_user_session(session_id)
+    session = await get_user_session(session_id)
     if not session:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     
-    # Return contextual suggestions
-    suggestions = [
-        "Show me my courses",
-        "What materials are available?",
-        "Help me organize my studies",
-        "Find recent course updates",
-        "What assignments are coming up?",
-        "Help me prepare for exams",
-        "Show me discussion forums",
-        "Find lecture recordings"
-    ]
+    # Derived from the session's dashboard once it has been built; never waits for Moodle
+    view = get_cached_dashboard(session_id)
+    suggestions = view.suggestions if view is not None else STATIC_SUGGESTIONS
     
     return {
         "suggestions": suggestions,
@@ -1,65 +1,171 @@
-from fastapi import APIRouter, HTTPException, Header, Query
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Header, Query, WebSocket
+from fastapi.responses import FileResponse, JSONResponse, Response
+from pydantic import TypeAdapter
+from starlette.background import BackgroundTask
+from typing import Any, Dict, Optional, List
+import asyncio
 import logging
+import os
+import tempfile
+import time
 
-from ..models.schemas import Course, CourseContent
+from ..middleware.deadline import DeadlineExceeded
+from ..middleware.profiling import ProfiledRoute, profile_phase
+from ..models.schemas import Course, CourseContent, DeadlinesResponse
+from ..services.chunk_store import get_chunk_store
+from ..services.course_cache import get_course_entry
+from ..services.contents_versions import build_patch, contents_version, record_version
+from ..services.course_watcher import subscribe, unsubscribe
+from ..services.deadlines import get_deadlines
+from ..services.file_index import SORT_KEYS
 from ..services.moodle_client import MoodleClient
+from ..services.snapshot import SNAPSHOT_DIR, SNAPSHOT_MEDIA_TYPE, export_snapshot, prune_snapshots, snapshot_filename
 from ..utils.helpers import get_user_session
+from ..utils.offload import MODEL_OFFLOAD_THRESHOLD, run_sized
+from ..utils.projection import paginate_sections, parse_fields, project, wants_field
 
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/api/courses", tags=["courses"])
+router = APIRouter(prefix="/api/courses", tags=["courses"], route_class=ProfiledRoute)
 
+# Idle WebSocket connections get a ping (and a session re-check) this often
+UPDATES_HEARTBEAT_SECONDS = 25
 
-def get_moodle_client_from_session(session_id: str) -> MoodleClient:
+_contents_adapter = TypeAdapter(List[CourseContent])
+
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+
+
+async def get_moodle_client_from_session(session_id: str) -> MoodleClient:
     """Get MoodleClient instance from session"""
-    session = get_user_session(session_id)
+    session = await get_user_session(session_id)
     if not session:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     
     return MoodleClient(session['moodle_url'], session['token'])
 
 
+def _to_course_content(content_data: Dict[str, Any], modules: List[Dict[str, Any]]) -> CourseContent:
+    """Map a Moodle section to our CourseContent model"""
+    return CourseContent(
+        id=content_data.get('id'),
+        name=content_data.get('name', ''),
+        visible=content_data.get('visible'),
+        summary=content_data.get('summary'),
+        summaryformat=content_data.get('summaryformat'),
+        section=content_data.get('section'),
+        hiddenbynumsections=content_data.get('hiddenbynumsections'),
+        uservisible=content_data.get('uservisible'),
+        modules=modules
+    )
+
+
+def _build_contents(contents_data: List[Dict[str, Any]]) -> List[CourseContent]:
+    """Convert Moodle sections to CourseContent models, skipping malformed ones"""
+    with profile_phase('validate'):
+        contents = []
+        for content_data in contents_data:
+            try:
+                content = _to_course_content(content_data, content_data.get('modules', []))
+                contents.append(content)
+            except Exception as e:
+                logger.warning(f"Could not parse content data: {e}")
+                continue
+    return contents
+
+
+def _serialize_contents(contents_data: List[Dict[str, Any]]) -> bytes:
+    """Build and serialize the contents response in one go (same body as the response model)"""
+    contents = _build_contents(contents_data)
+    with profile_phase('serialize'):
+        return _contents_adapter.dump_json(contents)
+
+
+def _project_contents(
+    contents_data: List[Dict[str, Any]],
+    fields: Optional[str],
+    cursor: Optional[str],
+    limit: Optional[int]
+) -> JSONResponse:
+    """Build a projected, paginated contents response without the full response model"""
+    include, exclude = parse_fields(fields)
+    with_modules = wants_field(include, exclude, 'modules')
+    page, next_cursor = paginate_sections(contents_data, cursor, limit, with_modules)
+
+    module_include = include.get('modules') if include else None
+    if module_include is True:
+        module_include = None
+    module_exclude = exclude.get('modules') if exclude else None
+
+    with profile_phase('validate'):
+        sections = []
+        for content_data, modules in page:
+            try:
+                # Normalise section fields only; modules pass through as dicts
+                content = _to_course_content(content_data, [])
+            except Exception as e:
+                logger.warning(f"Could not parse content data: {e}")
+                continue
+
+            section = project(content.model_dump(exclude={'modules'}), include, exclude)
+            if with_modules:
+                section['modules'] = project(modules, module_include, module_exclude)
+            sections.append(section)
+
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+    return JSONResponse(content=sections, headers=headers)
+
+
 @router.get("/", response_model=List[Course])
-async def get_user_courses(session_id: Optional[str] = Header(None, alias="X-Session-ID")):
+async def get_user_courses(
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    fields: Optional[str] = Query(None, description="Comma-separated course fields to return, e.g. id,fullname; prefix with - to drop")
+):
     """Get courses enrolled by current user"""
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
     try:
-        moodle_client = get_moodle_client_from_session(session_id)
+        moodle_client = await get_moodle_client_from_session(session_id)
         courses_data = await moodle_client.get_user_courses()
         
         # Convert to Course models
-        courses = []
-        for course_data in courses_data:
-            try:
-                # Map Moodle course data to our Course model
-                course = Course(
-                    id=course_data.get('id'),
-                    fullname=course_data.get('fullname', ''),
-                    shortname=course_data.get('shortname', ''),
-                    categoryid=course_data.get('categoryid', 0),
-                    summary=course_data.get('summary'),
-                    summaryformat=course_data.get('summaryformat'),
-                    format=course_data.get('format'),
-                    showgrades=course_data.get('showgrades'),
-                    newsitems=course_data.get('newsitems'),
-                    startdate=course_data.get('startdate'),
-                    enddate=course_data.get('enddate'),
-                    maxbytes=course_data.get('maxbytes'),
-                    showreports=course_data.get('showreports'),
-                    visible=course_data.get('visible'),
-                    groupmode=course_data.get('groupmode'),
-                    groupmodeforce=course_data.get('groupmodeforce'),
-                    defaultgroupingid=course_data.get('defaultgroupingid')
-                )
-                courses.append(course)
-            except Exception as e:
-                logger.warning(f"Could not parse course data: {e}")
-                continue
+        with profile_phase('validate'):
+            courses = []
+            for course_data in courses_data:
+                try:
+                    # Map Moodle course data to our Course model
+                    course = Course(
+                        id=course_data.get('id'),
+                        fullname=course_data.get('fullname', ''),
+                        shortname=course_data.get('shortname', ''),
+                        categoryid=course_data.get('categoryid', 0),
+                        summary=course_data.get('summary'),
+                        summaryformat=course_data.get('summaryformat'),
+                        format=course_data.get('format'),
+                        showgrades=course_data.get('showgrades'),
+                        newsitems=course_data.get('newsitems'),
+                        startdate=course_data.get('startdate'),
+                        enddate=course_data.get('enddate'),
+                        maxbytes=course_data.get('maxbytes'),
+                        showreports=course_data.get('showreports'),
+                        visible=course_data.get('visible'),
+                        groupmode=course_data.get('groupmode'),
+                        groupmodeforce=course_data.get('groupmodeforce'),
+                        defaultgroupingid=course_data.get('defaultgroupingid')
+                    )
+                    courses.append(course)
+                except Exception as e:
+                    logger.warning(f"Could not parse course data: {e}")
+                    continue
+        
+        if fields:
+            include, exclude = parse_fields(fields)
+            return JSONResponse(content=[project(course.model_dump(), include, exclude) for course in courses])
         
         return courses
         
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except HTTPException:
         raise
     except Exception as e:
@@ -67,6 +173,51 @@ async def get_user_courses(session_id: Optional[str] = Header(None, alias="X-Ses
         raise HTTPException(status_code=500, detail="Failed to retrieve courses")
 
 
+@router.get("/deadlines", response_model=DeadlinesResponse)
+async def get_upcoming_deadlines(
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    days: Optional[int] = Query(None, ge=1, le=366, description="Only deadlines due within this many days"),
+    include_past: bool = Query(False, description="Include deadlines that have already passed"),
+    course_id: Optional[int] = Query(None, description="Only deadlines of this course"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    refresh: bool = Query(False, description="Bypass the server-side deadlines cache")
+):
+    """
+    Get upcoming assignment and quiz deadlines across all enrolled courses
+
+    Assignments and quizzes are fetched for all courses with one upstream call
+    each and merged into a timeline sorted by due time. If one of the two
+    sources fails, the other is still returned and ``warnings`` says so.
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+
+    try:
+        moodle_client = await get_moodle_client_from_session(session_id)
+        timeline = await get_deadlines(moodle_client, session_id, refresh=refresh)
+
+        now = int(time.time())
+        deadlines = timeline.select(
+            since=None if include_past else now,
+            until=now + days * 86400 if days else None,
+            course_id=course_id,
+            limit=limit
+        )
+        return {
+            'deadlines': deadlines,
+            'warnings': timeline.warnings,
+            'generated_at': timeline.generated_at,
+        }
+
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get deadlines: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve deadlines")
+
+
 @router.get("/{course_id}", response_model=Course)
 async def get_course(
     course_id: int,
@@ -77,7 +228,7 @@ async def get_course(
         raise HTTPException(status_code=400, detail="Session ID required")
     
     try:
-        moodle_client = get_moodle_client_from_session(session_id)
+        moodle_client = await get_moodle_client_from_session(session_id)
         courses_data = await moodle_client.get_course_by_field('id', course_id)
         
         if not courses_data:
@@ -107,6 +258,8 @@ async def get_course(
         
         return course
         
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except HTTPException:
         raise
     except Exception as e:
@@ -117,38 +270,71 @@ async def get_course(
 @router.get("/{course_id}/contents", response_model=List[CourseContent])
 async def get_course_contents(
     course_id: int,
-    session_id: Optional[str] = Header(None, alias="X-Session-ID")
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, e.g. id,name or id,name,modules.name; prefix with - to drop (-modules.description)"),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size in modules (in sections when modules are not requested)"),
+    refresh: bool = Query(False, description="Bypass the server-side contents cache"),
+    since_version: Optional[str] = Query(None, description="X-Contents-Version the client already has; returns a JSON Patch from it when possible")
 ):
-    """Get contents of a specific course"""
+    """
+    Get contents of a specific course
+    
+    With fields, cursor or limit the response contains only the requested
+    fields of one page of sections; X-Next-Cursor is set while more remain.
+    
+    Full responses carry their version in X-Contents-Version. With
+    since_version the response is an RFC 6902 JSON Patch
+    (application/json-patch+json) from that version to the current one, or
+    the full contents (application/json) when that version is no longer kept.
+    """
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
     try:
-        moodle_client = get_moodle_client_from_session(session_id)
-        contents_data = await moodle_client.get_course_contents(course_id)
+        moodle_client = await get_moodle_client_from_session(session_id)
+        entry = await get_course_entry(moodle_client, course_id, refresh=refresh)
+        contents_data = entry.contents
         
-        # Convert to CourseContent models
-        contents = []
-        for content_data in contents_data:
-            try:
-                content = CourseContent(
-                    id=content_data.get('id'),
-                    name=content_data.get('name', ''),
-                    visible=content_data.get('visible'),
-                    summary=content_data.get('summary'),
-                    summaryformat=content_data.get('summaryformat'),
-                    section=content_data.get('section'),
-                    hiddenbynumsections=content_data.get('hiddenbynumsections'),
-                    uservisible=content_data.get('uservisible'),
-                    modules=content_data.get('modules', [])
+        # Large courses are validated, serialized (in an offload process) and diffed off the loop
+        module_count = sum(len(section.get('modules') or []) for section in contents_data)
+        
+        if fields or cursor or limit:
+            return await run_sized(
+                module_count, MODEL_OFFLOAD_THRESHOLD,
+                _project_contents, contents_data, fields, cursor, limit
+            )
+        
+        if entry.body is None:
+            body = await run_sized(
+                module_count, MODEL_OFFLOAD_THRESHOLD, _serialize_contents, contents_data, process=True
+            )
+            entry.version = contents_version(body)
+            entry.body = body
+            if contents_data:
+                record_version(entry.key, entry.version, body)
+        
+        # Empty contents mean Moodle refused the call, not that the course was
+        # emptied: never version them or patch towards them
+        if not contents_data:
+            return Response(content=entry.body, media_type="application/json")
+        headers = {'X-Contents-Version': entry.version}
+        
+        if since_version:
+            if since_version == entry.version:
+                patch = b'[]'
+            else:
+                patch = await run_sized(
+                    module_count, MODEL_OFFLOAD_THRESHOLD,
+                    build_patch, entry.key, since_version, entry.version, entry.body
                 )
-                contents.append(content)
-            except Exception as e:
-                logger.warning(f"Could not parse content data: {e}")
-                continue
+            if patch is not None:
+                return Response(content=patch, media_type=JSON_PATCH_MEDIA_TYPE, headers=headers)
         
-        return contents
+        return Response(content=entry.body, media_type="application/json", headers=headers)
         
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except HTTPException:
         raise
     except Exception as e:
@@ -160,39 +346,42 @@ async def get_course_contents(
 async def download_course_files(
     course_id: int,
     session_id: Optional[str] = Header(None, alias="X-Session-ID"),
-    file_type: Optional[str] = Query(None, description="Filter by file type (pdf, doc, etc.)")
+    file_type: Optional[str] = Query(None, description="Filter by file type (pdf, doc, etc.); comma-separated for several"),
+    mimetype: Optional[str] = Query(None, description="Filter by MIME type; comma-separated for several"),
+    section_id: Optional[int] = Query(None, description="Only files in this section"),
+    module_id: Optional[int] = Query(None, description="Only files in this module"),
+    min_size: Optional[int] = Query(None, ge=0, description="Minimum file size in bytes"),
+    max_size: Optional[int] = Query(None, ge=0, description="Maximum file size in bytes"),
+    modified_since: Optional[int] = Query(None, description="Only files modified at or after this Unix timestamp"),
+    sort: str = Query('position', description=f"Sort by one of: {', '.join(SORT_KEYS)}"),
+    order: str = Query('asc', pattern='^(asc|desc)$'),
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of files to return")
 ):
     """Download all files from a course or specific file types"""
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORT_KEYS)}")
+    
     try:
-        moodle_client = get_moodle_client_from_session(session_id)
-        contents_data = await moodle_client.get_course_contents(course_id)
-        
-        files_info = []
-        
-        # Extract file information from course contents
-        for section in contents_data:
-            for module in section.get('modules', []):
-                for content in module.get('contents', []):
-                    if content.get('type') == 'file':
-                        file_info = {
-                            'filename': content.get('filename'),
-                            'fileurl': content.get('fileurl'),
-                            'filesize': content.get('filesize'),
-                            'mimetype': content.get('mimetype'),
-                            'module_name': module.get('name'),
-                            'section_name': section.get('name')
-                        }
-                        
-                        # Filter by file type if specified
-                        if file_type:
-                            file_ext = content.get('filename', '').split('.')[-1].lower()
-                            if file_ext != file_type.lower():
-                                continue
-                        
-                        files_info.append(file_info)
+        moodle_client = await get_moodle_client_from_session(session_id)
+        entry = await get_course_entry(moodle_client, course_id)
+        
+        # The file index is built once per cached contents and queried here
+        files = entry.file_index.query(
+            extensions=file_type.split(',') if file_type else None,
+            mimetypes=mimetype.split(',') if mimetype else None,
+            section_id=section_id,
+            module_id=module_id,
+            min_size=min_size,
+            max_size=max_size,
+            modified_since=modified_since,
+            sort=sort,
+            descending=order == 'desc',
+            limit=limit
+        )
+        files_info = [file.to_dict() for file in files]
         
         return {
             "course_id": course_id,
@@ -201,6 +390,8 @@ async def download_course_files(
             "message": f"Found {len(files_info)} files in course"
         }
         
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except HTTPException:
         raise
     except Exception as e:
@@ -208,6 +399,124 @@ async def download_course_files(
         raise HTTPException(status_code=500, detail="Failed to retrieve course files")
 
 
+@router.get("/{course_id}/snapshot")
+async def export_course_snapshot(
+    course_id: int,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    include_text: bool = Query(False, description="Also store plain text of section summaries and module descriptions"),
+    refresh: bool = Query(False, description="Fetch fresh contents from Moodle first")
+):
+    """
+    Export a compact offline snapshot of a course
+    
+    The snapshot is a SQLite file with one compressed blob per section (loadable
+    lazily), the course file index and optionally extracted text. With
+    SNAPSHOT_DIR set it is also kept there to seed the cache after a restart,
+    and snapshots there older than SNAPSHOT_MAX_AGE are deleted.
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+    
+    try:
+        moodle_client = await get_moodle_client_from_session(session_id)
+        entry = await get_course_entry(moodle_client, course_id, refresh=refresh)
+        
+        if not entry.contents:
+            raise HTTPException(status_code=404, detail="Course contents not available")
+        
+        if SNAPSHOT_DIR:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            path = os.path.join(SNAPSHOT_DIR, snapshot_filename(moodle_client.base_url, course_id, moodle_client.token))
+            cleanup = BackgroundTask(prune_snapshots)
+        else:
+            fd, path = tempfile.mkstemp(suffix='.sqlite')
+            os.close(fd)
+            cleanup = BackgroundTask(os.remove, path)
+        
+        # Compression and SQLite writes are blocking; keep them off the event loop
+        await asyncio.to_thread(
+            export_snapshot,
+            path,
+            moodle_client.base_url,
+            course_id,
+            moodle_client.token,
+            entry.contents,
+            entry.file_index,
+            include_text
+        )
+        
+        return FileResponse(
+            path,
+            media_type=SNAPSHOT_MEDIA_TYPE,
+            filename=f"course_{course_id}.sqlite",
+            background=cleanup
+        )
+        
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to export course {course_id} snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Failed to export course snapshot")
+
+
+@router.get("/{course_id}/chunks")
+async def get_course_chunks(
+    course_id: int,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    section_id: Optional[int] = Query(None),
+    module_id: Optional[int] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Get text chunks extracted by an ``index_text`` job
+    
+    Only chunks from sections and modules visible to the current user are returned.
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+    
+    try:
+        moodle_client = await get_moodle_client_from_session(session_id)
+        entry = await get_course_entry(moodle_client, course_id)
+        
+        if not entry.contents:
+            raise HTTPException(status_code=404, detail="Course contents not available")
+        
+        visible_sections = {section.get('id') for section in entry.contents}
+        visible_modules = {
+            module.get('id') for section in entry.contents for module in section.get('modules') or []
+        }
+        # The store's lock is held by index_text writers and compaction in worker
+        # threads; waiting for it (or creating the store) must not block the loop
+        store = await asyncio.to_thread(get_chunk_store, moodle_client.base_url)
+        total, chunks = await asyncio.to_thread(
+            store.chunks,
+            course_id,
+            section_id=section_id,
+            module_id=module_id,
+            where=lambda section, module: section in visible_sections and (module is None or module in visible_modules),
+            offset=offset,
+            limit=limit
+        )
+        
+        return {
+            "course_id": course_id,
+            "total": total,
+            "chunks": chunks
+        }
+        
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get course {course_id} chunks: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve course chunks")
+
+
 @router.get("/{course_id}/files/{file_id}")
 async def download_file(
     course_id: int,
@@ -224,4 +533,72 @@ async def download_file(
         "message": "File download endpoint - implementation depends on specific Moodle file URLs",
         "course_id": course_id,
         "file_id": file_id
-    }
\ No newline at end of file
+    }
+
+
+@router.websocket("/{course_id}/updates")
+async def course_updates(
+    websocket: WebSocket,
+    course_id: int,
+    session_id: Optional[str] = Query(None, description="Session ID (browsers cannot set headers on WebSockets)")
+):
+    """
+    Push change notifications for a course
+    
+    All subscribers of a course share one upstream poller. Events look like
+    {"type": "course_updated", "course_id": ..., "timestamp": ...} and carry no
+    details of the change (the poller may have used another user's token);
+    clients should then refetch /api/courses/{course_id}/contents.
+    """
+    session_id = session_id or websocket.headers.get('x-session-id')
+    session = await get_user_session(session_id) if session_id else None
+    if not session:
+        await websocket.close(code=4401)
+        return
+    
+    moodle_client = MoodleClient(session['moodle_url'], session['token'])
+    
+    # Only users who can see the course may subscribe to it
+    try:
+        entry = await get_course_entry(moodle_client, course_id)
+    except Exception as e:
+        # Moodle unreachable: not a refusal, so tell the client to retry (1013 Try Again Later)
+        logger.warning(f"Could not check access to course {course_id} for updates: {e}")
+        await websocket.close(code=1013)
+        return
+    if not entry.contents:
+        await websocket.close(code=4403)
+        return
+    
+    await websocket.accept()
+    subscription = subscribe(moodle_client, course_id, session_id)
+    
+    async def wait_for_disconnect():
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+    
+    disconnected = asyncio.create_task(wait_for_disconnect())
+    try:
+        await websocket.send_json({"type": "subscribed", "course_id": course_id})
+        while True:
+            next_event = asyncio.create_task(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {next_event, disconnected},
+                timeout=UPDATES_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_event in done:
+                await websocket.send_json(next_event.result())
+                continue
+            next_event.cancel()
+            if disconnected in done:
+                break
+            if not await get_user_session(session_id):
+                await websocket.close(code=4401)
+                break
+            await websocket.send_json({"type": "ping"})
+    except Exception as e:
+        logger.debug(f"Course {course_id} updates connection closed: {e}")
+    finally:
+        disconnected.cancel()
+        unsubscribe(subscription)
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException, Header, Query
+from typing import Optional
+import logging
+
+from ..middleware.deadline import DeadlineExceeded
+from ..middleware.profiling import ProfiledRoute
+from ..services.dashboard import get_dashboard
+from .courses import get_moodle_client_from_session
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/dashboard", tags=["dashboard"], route_class=ProfiledRoute)
+
+
+@router.get("/")
+async def get_user_dashboard(
+    session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    refresh: bool = Query(False, description="Rebuild the dashboard instead of serving the cached view")
+):
+    """
+    Get the home screen in one call: profile, courses, recently modified
+    files, upcoming deadlines and chat suggestions
+
+    Parts that failed or timed out are listed in ``errors`` (and in ``stale``
+    when an older value is returned instead); the rest is still returned.
+    502 only when no part has a value at all, fresh or stale.
+    Repeat visits are served from a per-session view that is refreshed in
+    the background.
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+
+    try:
+        moodle_client = await get_moodle_client_from_session(session_id)
+        view = await get_dashboard(moodle_client, session_id, refresh=refresh)
+        if not view.has_data:
+            raise HTTPException(status_code=502, detail="Could not load any part of the dashboard")
+        return view.to_dict()
+
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get dashboard: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve dashboard")
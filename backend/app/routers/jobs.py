@@ -0,0 +1,113 @@
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import FileResponse
+from typing import List, Optional
+import logging
+import os
+
+from ..middleware.profiling import ProfiledRoute
+from ..models.schemas import JobCreateRequest, JobStatus
+from ..services.jobs import JOB_HANDLERS, SUCCEEDED, Job, JobLimitError, job_manager
+from ..services.snapshot import SNAPSHOT_MEDIA_TYPE
+from ..utils.helpers import get_user_session
+from .courses import get_moodle_client_from_session
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/jobs", tags=["jobs"], route_class=ProfiledRoute)
+
+
+async def _require_session(session_id: Optional[str]):
+    """Reject requests without a live session (logged out, expired or evicted)"""
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+    if not await get_user_session(session_id):
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+
+
+async def _get_session_job(job_id: str, session_id: Optional[str]) -> Job:
+    await _require_session(session_id)
+    job = await job_manager.get(job_id, session_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/", response_model=JobStatus, status_code=202)
+async def create_job(
+    request: JobCreateRequest,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID")
+):
+    """
+    Start a background job for a long course operation
+
+    Kinds: ``collect_files`` (zip of the course files, optionally filtered by
+    file_types and max_size), ``snapshot_course`` and ``index_text`` (course
+    text into the chunk store, read back from ``/api/courses/{id}/chunks``).
+    Poll ``GET /api/jobs/{id}`` for progress and fetch file results from
+    ``/api/jobs/{id}/download``.
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Session ID required")
+
+    if request.kind not in JOB_HANDLERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown job kind; expected one of: {', '.join(sorted(JOB_HANDLERS))}"
+        )
+
+    try:
+        moodle_client = await get_moodle_client_from_session(session_id)
+        params = request.model_dump(exclude={'kind'}, exclude_none=True)
+        job = await job_manager.submit(request.kind, session_id, moodle_client, params)
+        return job.to_dict()
+
+    except JobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to create {request.kind} job: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create job")
+
+
+@router.get("/", response_model=List[JobStatus])
+async def list_jobs(session_id: Optional[str] = Header(None, alias="X-Session-ID")):
+    """List the jobs of the current session"""
+    await _require_session(session_id)
+
+    return [job.to_dict() for job in await job_manager.list(session_id)]
+
+
+@router.get("/{job_id}", response_model=JobStatus)
+async def get_job(
+    job_id: str,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID")
+):
+    """Get the state and progress of a job"""
+    job = await _get_session_job(job_id, session_id)
+    return job.to_dict()
+
+
+@router.delete("/{job_id}", response_model=JobStatus)
+async def cancel_job(
+    job_id: str,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID")
+):
+    """Cancel a queued or running job"""
+    job = await _get_session_job(job_id, session_id)
+    if not await job_manager.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.state}")
+    return job.to_dict()
+
+
+@router.get("/{job_id}/download")
+async def download_job_result(
+    job_id: str,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID")
+):
+    """Download the file produced by a finished job"""
+    job = await _get_session_job(job_id, session_id)
+    if job.state != SUCCEEDED or not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=409, detail="Job has no downloadable result")
+
+    media_type = SNAPSHOT_MEDIA_TYPE if job.kind == 'snapshot_course' else 'application/zip'
+    return FileResponse(job.result_path, media_type=media_type, filename=os.path.basename(job.result_path))
@@ -0,0 +1,105 @@
+"""
+Uvicorn launcher shared by run.py and ``python -m app.main``.
+
+Development mode (the default) runs a single auto-reloading worker.
+Production mode (``--production`` or ``APP_ENV=production``) runs one worker
+per available core, uses uvloop/httptools when installed, tunes keep-alive and
+backlog, and drains in-flight requests and streams on SIGTERM before exiting.
+
+Workers are separate processes. Sessions and jobs move to SQLite stores when
+there is more than one, and a cassette recording (MOODLE_RECORD) gets one file
+per worker; caches, watchers, admission limits and profiles stay per worker
+(see the README).
+"""
+import importlib.util
+import logging
+import os
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def is_production() -> bool:
+    """Whether APP_ENV selects production mode"""
+    return os.getenv('APP_ENV', 'development').lower() in ('production', 'prod')
+
+
+def _has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def default_workers() -> int:
+    """Number of cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def per_worker_path(path: str) -> str:
+    """Insert a {pid} placeholder before the extensions: moodle.jsonl.gz -> moodle.{pid}.jsonl.gz"""
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, f"{stem}.{{pid}}{dot}{extensions}")
+
+
+def build_uvicorn_config(production: bool) -> Dict[str, Any]:
+    """Keyword arguments for uvicorn.run"""
+    host = os.getenv('BACKEND_HOST', 'localhost')
+    port = int(os.getenv('BACKEND_PORT', 8000))
+    log_level = os.getenv('LOG_LEVEL', 'info').lower()
+
+    if not production:
+        debug = os.getenv('DEBUG', 'true').lower() == 'true'
+        return {
+            'host': host,
+            'port': port,
+            'reload': debug,
+            'log_level': log_level,
+            'access_log': True,
+        }
+
+    workers = int(os.getenv('WEB_CONCURRENCY', 0)) or default_workers()
+    return {
+        'host': host,
+        'port': port,
+        'reload': False,
+        'workers': workers,
+        'loop': 'uvloop' if _has_module('uvloop') else 'asyncio',
+        'http': 'httptools' if _has_module('httptools') else 'h11',
+        # Longer than typical load balancer idle timeouts so the proxy closes first
+        'timeout_keep_alive': int(os.getenv('KEEP_ALIVE_TIMEOUT', 75)),
+        'backlog': int(os.getenv('BACKLOG', 4096)),
+        # On SIGTERM stop accepting, let in-flight requests and streams finish
+        'timeout_graceful_shutdown': int(os.getenv('GRACEFUL_SHUTDOWN_TIMEOUT', 30)),
+        'limit_max_requests': int(os.getenv('MAX_REQUESTS', 0)) or None,
+        'proxy_headers': True,
+        'forwarded_allow_ips': os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+        'log_level': log_level,
+        'access_log': os.getenv('ACCESS_LOG', 'false').lower() == 'true',
+    }
+
+
+def run_server(production: Optional[bool] = None):
+    """Start uvicorn in development or production mode"""
+    import uvicorn
+
+    if production is None:
+        production = is_production()
+
+    config = build_uvicorn_config(production)
+
+    # Worker processes do not share memory; sessions and jobs must live in a shared store
+    if config.get('workers', 1) > 1:
+        for name in ('SESSION_STORE', 'JOB_STORE'):
+            if name not in os.environ:
+                os.environ[name] = 'sqlite'
+                logger.info(f"Multiple workers: {name}=sqlite")
+
+        # Several processes appending to one gzip file would corrupt it
+        record = os.getenv('MOODLE_RECORD')
+        if record and '{pid}' not in record:
+            os.environ['MOODLE_RECORD'] = per_worker_path(record)
+            logger.info(f"Multiple workers: recording to {os.environ['MOODLE_RECORD']}")
+
+    uvicorn.run("app.main:app", **config)
@@ -0,0 +1,142 @@
+"""
+Calendar action events (the Moodle timeline), fetched page by page.
+
+core_calendar_get_action_events_by_timesort returns at most ``limitnum``
+events per call and is paged with the id of the last event seen
+(``aftereventid``). iter_window_pages follows that cursor lazily, so callers
+can stream the first page while later ones are still being fetched.
+
+Fetched pages are kept per session and time window (at most
+CALENDAR_CACHE_MAX_WINDOWS windows per session, CALENDAR_CACHE_MAX_SESSIONS
+sessions). A repeated request replays the cached pages and only goes upstream
+for pages that were never fetched, e.g. after an earlier client disconnected.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from ..utils.helpers import on_session_end
+from .moodle_client import MoodleClient
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_PAGE_SIZE = int(os.getenv('CALENDAR_PAGE_SIZE', 50))
+CALENDAR_MAX_PAGES = int(os.getenv('CALENDAR_MAX_PAGES', 40))
+CALENDAR_CACHE_TTL = float(os.getenv('CALENDAR_CACHE_TTL', 120))
+CALENDAR_CACHE_MAX_WINDOWS = int(os.getenv('CALENDAR_CACHE_MAX_WINDOWS', 8))
+CALENDAR_CACHE_MAX_SESSIONS = int(os.getenv('CALENDAR_CACHE_MAX_SESSIONS', 1000))
+
+WindowKey = Tuple[Optional[int], Optional[int], int]
+
+
+class EventWindow:
+    """Pages fetched so far for one (from, to, page size) window"""
+
+    def __init__(self, key: WindowKey):
+        self.key = key
+        self.pages: List[List[Dict[str, Any]]] = []
+        self.last_event_id: Optional[int] = None
+        self.complete = False
+        self.truncated = False
+        self.fetched_at = time.monotonic()
+        # Serialises upstream fetches when several streams read the same window
+        self.lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.fetched_at < CALENDAR_CACHE_TTL
+
+
+CALENDAR_CACHE: "OrderedDict[str, OrderedDict[WindowKey, EventWindow]]" = OrderedDict()
+
+
+def _slim_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the fields a timeline needs; descriptions and full course records are dropped"""
+    course = event.get('course') or {}
+    action = event.get('action') or {}
+    return {
+        'id': event.get('id'),
+        'name': event.get('name'),
+        'modulename': event.get('modulename'),
+        'instance': event.get('instance'),
+        'eventtype': event.get('eventtype'),
+        'timestart': event.get('timestart'),
+        'timesort': event.get('timesort'),
+        'timeduration': event.get('timeduration'),
+        'overdue': event.get('overdue'),
+        'url': event.get('url'),
+        'course': {
+            'id': course.get('id'),
+            'fullname': course.get('fullname'),
+            'shortname': course.get('shortname'),
+        } if course else None,
+        'action': {
+            'name': action.get('name'),
+            'url': action.get('url'),
+            'itemcount': action.get('itemcount'),
+            'actionable': action.get('actionable'),
+        } if action else None,
+    }
+
+
+def get_event_window(session_id: str, key: WindowKey, refresh: bool = False) -> EventWindow:
+    """Get the session's cached window for key, starting a new one if missing or stale"""
+    windows = CALENDAR_CACHE.get(session_id)
+    if windows is None:
+        windows = CALENDAR_CACHE[session_id] = OrderedDict()
+        while len(CALENDAR_CACHE) > CALENDAR_CACHE_MAX_SESSIONS:
+            CALENDAR_CACHE.popitem(last=False)
+    CALENDAR_CACHE.move_to_end(session_id)
+
+    window = windows.get(key)
+    if window is None or refresh or not window.is_fresh():
+        window = windows[key] = EventWindow(key)
+        while len(windows) > CALENDAR_CACHE_MAX_WINDOWS:
+            windows.popitem(last=False)
+    windows.move_to_end(key)
+    return window
+
+
+@on_session_end
+def forget_event_windows(session_id: str):
+    """Drop an ended session's cached windows"""
+    CALENDAR_CACHE.pop(session_id, None)
+
+
+async def _fetch_next_page(client: MoodleClient, window: EventWindow):
+    timesort_from, timesort_to, page_size = window.key
+    result = await client.get_action_events_by_timesort(
+        timesort_from, timesort_to, window.last_event_id, page_size
+    )
+    events = result.get('events') or []
+    if events:
+        window.pages.append([_slim_event(event) for event in events])
+        window.last_event_id = result.get('lastid') or events[-1].get('id')
+    if len(events) < page_size:
+        window.complete = True
+    elif len(window.pages) >= CALENDAR_MAX_PAGES:
+        window.complete = window.truncated = True
+        logger.info(f"Calendar window {window.key} truncated after {CALENDAR_MAX_PAGES} pages")
+
+
+async def iter_window_pages(client: MoodleClient, window: EventWindow) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Yield the pages of a window, fetching missing ones from Moodle
+
+    Cached pages are yielded immediately; the next page is only requested
+    once the consumer has taken the previous one.
+    """
+    index = 0
+    while True:
+        while index < len(window.pages):
+            yield window.pages[index]
+            index += 1
+        if window.complete:
+            return
+        async with window.lock:
+            # Another stream may have fetched this page while we waited
+            if index < len(window.pages) or window.complete:
+                continue
+            await _fetch_next_page(client, window)
@@ -0,0 +1,353 @@
+"""
+Record and replay Moodle traffic as compact cassettes.
+
+With ``MOODLE_RECORD=<path>`` the shared upstream client records every
+web-service call, token request and file fetch into a gzip-compressed JSON
+Lines cassette. With ``MOODLE_REPLAY=<path>`` it serves responses from a
+cassette instead of talking to Moodle, sleeping for the recorded upstream
+time multiplied by ``MOODLE_REPLAY_TIME_SCALE`` (1 = original timing, 0 = as
+fast as possible).
+
+Recordings are scrubbed before they are written:
+
+- tokens (``wstoken``, ``token`` query parameters and response fields) and
+  login credentials are removed
+- personal fields (names, emails, usernames, picture URLs, ...) and email
+  addresses in text are replaced by pseudonyms of the same length, so
+  payload sizes stay realistic
+- the Moodle origin is replaced by ``REPLAY_ORIGIN``
+- file contents are stored as their size only, unless
+  ``MOODLE_RECORD_FILE_BODIES=true``
+
+Responses stream through to the caller as they arrive; scrubbing and the
+compressed writes happen in a single writer thread once a body has ended.
+
+Each line is one exchange::
+
+    {"t": 1.52, "method": "POST", "path": "/webservice/rest/server.php",
+     "wsfunction": "core_course_get_contents", "params": {"courseid": "42"},
+     "status": 200, "content_type": "application/json", "elapsed_ms": 840.2,
+     "body_encoding": "json", "body": "[...]"}
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MOODLE_RECORD = os.getenv('MOODLE_RECORD', '')
+MOODLE_RECORD_FILE_BODIES = os.getenv('MOODLE_RECORD_FILE_BODIES', 'false').lower() == 'true'
+MOODLE_REPLAY = os.getenv('MOODLE_REPLAY', '')
+MOODLE_REPLAY_TIME_SCALE = float(os.getenv('MOODLE_REPLAY_TIME_SCALE', 1.0))
+
+REPLAY_ORIGIN = 'https://moodle.example'
+REDACTED = 'REDACTED'
+
+SECRET_PARAMS = {'wstoken', 'token', 'password', 'username', 'privatetoken'}
+IGNORED_PARAMS = {'wstoken', 'token', 'moodlewsrestformat', 'service'}
+SECRET_FIELDS = {'token', 'privatetoken', 'wstoken'}
+PERSONAL_FIELDS = {
+    'username', 'fullname', 'firstname', 'lastname', 'email', 'idnumber', 'phone1', 'phone2',
+    'address', 'city', 'institution', 'department', 'lastip', 'userpictureurl',
+    'profileimageurl', 'profileimageurlsmall', 'author', 'userfullname',
+}
+TOKEN_QUERY_RE = re.compile(r'([?&](?:wstoken|token)=)[^&"\s]*')
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+
+
+def pseudonym(value: str) -> str:
+    """Deterministic replacement with the same length as value"""
+    digest = hashlib.sha256(value.encode()).hexdigest()
+    return (digest * (len(value) // len(digest) + 1))[:len(value)]
+
+
+class Scrubber:
+    """Removes secrets and personal data from one Moodle site's traffic"""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.secrets: set = set()
+
+    def text(self, value: str) -> str:
+        value = TOKEN_QUERY_RE.sub(rf'\g<1>{REDACTED}', value)
+        for secret in self.secrets:
+            value = value.replace(secret, REDACTED)
+        value = EMAIL_RE.sub(lambda match: pseudonym(match.group(0)), value)
+        return value.replace(self.origin, REPLAY_ORIGIN)
+
+    def value(self, value: Any, key: Optional[str] = None) -> Any:
+        if isinstance(value, dict):
+            # Courses and categories have a fullname too, but it is not personal
+            course_like = 'shortname' in value
+            return {
+                k: self.value(v, None if course_like and k == 'fullname' else k)
+                for k, v in value.items()
+            }
+        if isinstance(value, list):
+            return [self.value(item, key) for item in value]
+        if isinstance(value, str):
+            if key in SECRET_FIELDS:
+                return REDACTED
+            if key in PERSONAL_FIELDS:
+                return pseudonym(value)
+            return self.text(value)
+        return value
+
+
+def request_params(request: httpx.Request) -> Dict[str, str]:
+    """Form and query parameters of a request"""
+    params = dict(parse_qsl(request.url.query.decode(), keep_blank_values=True))
+    if request.method == 'POST' and request.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+        params.update(parse_qsl(request.content.decode(), keep_blank_values=True))
+    return params
+
+
+def match_key(path: str, params: Dict[str, str]) -> Tuple[str, str]:
+    """Replay lookup key: path plus the parameters that select the response"""
+    selected = {k: v for k, v in params.items() if k not in IGNORED_PARAMS and k not in SECRET_PARAMS}
+    return path, urlencode(sorted(selected.items()))
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes a response body through, reporting it once it has been read to the end"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, keep_body: bool, on_end: Callable[[bytes, int], None]):
+        self.stream = stream
+        self.keep_body = keep_body
+        self.on_end = on_end
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            if self.keep_body:
+                self.chunks.append(chunk)
+            yield chunk
+        # Bodies abandoned half way are not recorded
+        self.on_end(b''.join(self.chunks), self.size)
+        self.chunks = []
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Passes requests to an inner transport and appends each exchange to a cassette"""
+
+    FLUSH_EVERY = 20
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, path: str, record_file_bodies: bool = MOODLE_RECORD_FILE_BODIES):
+        self.inner = inner
+        self.path = path
+        self.record_file_bodies = record_file_bodies
+        self.started = time.monotonic()
+        self.scrubbers: Dict[str, Scrubber] = {}
+        self.pending = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        # One writer keeps lines in completion order and owns the file and scrubbers
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cassette')
+        self.closed = False
+        logger.info(f"Recording Moodle traffic to {path}")
+
+    def _scrubber(self, request: httpx.Request) -> Scrubber:
+        origin = f"{request.url.scheme}://{request.url.netloc.decode()}"
+        scrubber = self.scrubbers.get(origin)
+        if scrubber is None:
+            scrubber = self.scrubbers[origin] = Scrubber(origin)
+        return scrubber
+
+    def _is_text(self, request: httpx.Request, content_type: str) -> bool:
+        return '/pluginfile.php' not in request.url.path and (
+            content_type == 'application/json' or content_type.startswith('text/')
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        response = await self.inner.handle_async_request(request)
+        content_type = response.headers.get('content-type', '').split(';')[0]
+
+        def on_end(body: bytes, size: int):
+            if self.closed:
+                return
+            elapsed = time.monotonic() - start
+            self.writer.submit(self._record, request, response.status_code, response.headers,
+                               body, size, start, elapsed)
+
+        keep_body = self.record_file_bodies or self._is_text(request, content_type)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, keep_body, on_end),
+            extensions=response.extensions,
+        )
+
+    def _record(self, request: httpx.Request, status: int, headers: httpx.Headers, body: bytes,
+                size: int, start: float, elapsed: float):
+        try:
+            self._write(request, status, headers, body, size, start, elapsed)
+        except Exception as e:
+            logger.warning(f"Could not record {request.url.path}: {e}")
+
+    def _write(self, request: httpx.Request, status: int, headers: httpx.Headers, body: bytes,
+               size: int, start: float, elapsed: float):
+        scrubber = self._scrubber(request)
+        params = request_params(request)
+        for name in ('wstoken', 'token'):
+            if params.get(name):
+                scrubber.secrets.add(params[name])
+
+        content_type = headers.get('content-type', '').split(';')[0]
+        if body and headers.get('content-encoding'):
+            # The stream carries the body as sent on the wire
+            body = httpx.Response(status, headers=headers, content=body).read()
+        if self._is_text(request, content_type):
+            text = body.decode('utf-8', errors='replace')
+            try:
+                data = json.loads(text)
+            except ValueError:
+                encoding, recorded = 'text', scrubber.text(text)
+            else:
+                if isinstance(data, dict) and data.get('token'):
+                    scrubber.secrets.add(data['token'])
+                encoding = 'json'
+                recorded = json.dumps(scrubber.value(data), separators=(',', ':'))
+        elif self.record_file_bodies:
+            encoding, recorded = 'base64', base64.b64encode(body).decode()
+        else:
+            encoding, recorded = 'size', size
+
+        entry = {
+            't': round(start - self.started, 4),
+            'method': request.method,
+            'path': request.url.path,
+            'wsfunction': params.get('wsfunction'),
+            'params': {k: (REDACTED if k in SECRET_PARAMS else scrubber.text(v)) for k, v in params.items()
+                       if k not in ('moodlewsrestformat',)},
+            'status': status,
+            'content_type': content_type,
+            'elapsed_ms': round(elapsed * 1000, 2),
+            'body_encoding': encoding,
+            'body': recorded,
+        }
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.pending += 1
+        if self.pending >= self.FLUSH_EVERY:
+            self.file.flush()
+            self.pending = 0
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        # Let queued recordings finish, then close the file in the writer thread
+        await asyncio.get_running_loop().run_in_executor(self.writer, self.file.close)
+        await asyncio.to_thread(self.writer.shutdown)
+        await self.inner.aclose()
+
+
+def load_cassette(path: str) -> List[Dict[str, Any]]:
+    """Read every exchange of a cassette, in recorded order"""
+    entries = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Serves recorded exchanges instead of contacting Moodle"""
+
+    def __init__(self, entries: List[Dict[str, Any]], time_scale: float = MOODLE_REPLAY_TIME_SCALE):
+        self.time_scale = time_scale
+        self.exact: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.by_function: Dict[Tuple[str, Optional[str]], List[Dict[str, Any]]] = {}
+        self.cursors: Dict[Any, int] = {}
+        self.misses = 0
+        for entry in entries:
+            params = {k: v for k, v in entry['params'].items() if v != REDACTED}
+            self.exact.setdefault((entry['method'], *match_key(entry['path'], params)), []).append(entry)
+            self.by_function.setdefault((entry['method'], entry['path'], entry.get('wsfunction')), []).append(entry)
+
+    @classmethod
+    def from_file(cls, path: str, time_scale: float = MOODLE_REPLAY_TIME_SCALE) -> "ReplayTransport":
+        entries = load_cassette(path)
+        logger.info(f"Replaying {len(entries)} recorded Moodle exchanges from {path}")
+        return cls(entries, time_scale)
+
+    def _next(self, key: Any, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Repeated identical calls cycle through their recordings in order
+        index = self.cursors.get(key, 0)
+        self.cursors[key] = index + 1
+        return candidates[index % len(candidates)]
+
+    def _find(self, request: httpx.Request, params: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        key = (request.method, *match_key(request.url.path, params))
+        if key in self.exact:
+            return self._next(key, self.exact[key])
+        # Same function with other arguments (e.g. another course ID)
+        key = (request.method, request.url.path, params.get('wsfunction'))
+        if key in self.by_function:
+            return self._next(key, self.by_function[key])
+        return None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        params = request_params(request)
+        entry = self._find(request, params)
+
+        if entry is None:
+            self.misses += 1
+            if request.url.path.endswith('/login/token.php') and request.method == 'GET':
+                return httpx.Response(200, json={'error': 'Web service not specified'}, request=request)
+            return httpx.Response(200, json={
+                'exception': 'replay_exception',
+                'errorcode': 'replaymissing',
+                'message': f"No recording for {params.get('wsfunction') or request.url.path}",
+            }, request=request)
+
+        if self.time_scale > 0:
+            await asyncio.sleep(entry['elapsed_ms'] / 1000 * self.time_scale)
+
+        encoding = entry['body_encoding']
+        if encoding == 'size':
+            content = bytes(entry['body'])
+        elif encoding == 'base64':
+            content = base64.b64decode(entry['body'])
+        else:
+            content = entry['body'].encode('utf-8')
+            if encoding == 'json' and request.url.path.endswith('/login/token.php'):
+                # Distinct users get distinct tokens so sessions stay separate
+                data = json.loads(content)
+                if data.get('token') == REDACTED:
+                    data['token'] = f"replay-{pseudonym(params.get('username', ''))[:16]}"
+                    content = json.dumps(data).encode()
+
+        headers = {'content-type': entry.get('content_type') or 'application/octet-stream'}
+        return httpx.Response(entry['status'], headers=headers, content=content, request=request)
+
+
+def build_transport(limits: httpx.Limits) -> Optional[httpx.AsyncBaseTransport]:
+    """Transport for the shared client according to MOODLE_REPLAY / MOODLE_RECORD"""
+    if MOODLE_REPLAY:
+        return ReplayTransport.from_file(MOODLE_REPLAY)
+    if MOODLE_RECORD:
+        # {pid} gives every worker process its own file (set by production mode)
+        path = MOODLE_RECORD.replace('{pid}', str(os.getpid()))
+        return RecordingTransport(httpx.AsyncHTTPTransport(limits=limits), path)
+    return None
@@ -0,0 +1,426 @@
+"""
+Append-only, memory-mapped store for text chunks extracted from courses.
+
+One store per Moodle site lives in its own directory:
+
+- ``chunks.idx``: a header followed by fixed-width records of eight native
+  int64 values (offset, length, course, section, module, file, version, flags)
+- ``chunks-<generation>.dat``: the UTF-8 text of every chunk, back to back
+- ``store.lock``: flock()ed by writers
+
+Both data files are mapped read-only with mmap and the index is viewed as an
+int64 array through ``memoryview.cast``, so metadata and text are read
+straight from the shared page cache; several worker processes can open the
+same store without each holding a copy. Writers append under the lock and
+flip the superseded flag of older versions of a document in place; within a
+process an RLock keeps readers off maps that a writer thread is replacing.
+Compaction rewrites the live records into the next generation's files and
+swaps the index atomically; readers notice the new index inode and reopen.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_DIR = os.getenv('CHUNK_STORE_DIR', 'chunks')
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 1000))
+# Compact once this fraction of the records is superseded
+CHUNK_COMPACT_RATIO = float(os.getenv('CHUNK_COMPACT_RATIO', 0.5))
+
+INDEX_MAGIC = 0x4B4E4843444F4F4D  # "MOODCHNK"
+FORMAT_VERSION = 1
+FIELDS = ('offset', 'length', 'course_id', 'section_id', 'module_id', 'file_id', 'version', 'flags')
+RECORD = struct.Struct(f"={len(FIELDS)}q")
+HEADER = struct.Struct("=8q")
+WIDTH = len(FIELDS)
+HEADER_WORDS = HEADER.size // 8
+OFFSET, LENGTH, COURSE, SECTION, MODULE, FILE, VERSION, FLAGS = range(WIDTH)
+
+SUPERSEDED = 1
+KINDS = ('section_summary', 'module_description', 'file')
+
+
+def file_key(fileurl: str) -> int:
+    """Stable positive 63-bit ID for a Moodle file URL (query string ignored)"""
+    digest = hashlib.blake2b(fileurl.split('?', 1)[0].encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') & 0x7FFFFFFFFFFFFFFF
+
+
+def split_text(text: str, size: int = CHUNK_SIZE) -> List[str]:
+    """Split text into chunks of at most size characters on paragraph and word boundaries"""
+    chunks: List[str] = []
+    current = ''
+    for paragraph in (part.strip() for part in text.split('\n\n')):
+        if not paragraph:
+            continue
+        while len(paragraph) > size:
+            cut = paragraph.rfind(' ', 0, size)
+            if cut <= 0:
+                cut = size
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(paragraph[:cut].rstrip())
+            paragraph = paragraph[cut:].lstrip()
+        if current and len(current) + 2 + len(paragraph) > size:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ChunkStore:
+    """One site's chunk store; safe to share between processes"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'chunks.idx')
+        self.lock_path = os.path.join(directory, 'store.lock')
+        self._index_fd: Optional[int] = None
+        self._blob_fd: Optional[int] = None
+        self._index_map: Optional[mmap.mmap] = None
+        self._blob_map: Optional[mmap.mmap] = None
+        self._words: Optional[memoryview] = None
+        self._inode = None
+        self.generation = 0
+        self.count = 0
+        # Record numbers per course, rebuilt from the index on open
+        self.by_course: Dict[int, array] = {}
+        self._mutex = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < HEADER.size:
+                self._write_index(self.index_path, 0, [])
+                open(self._blob_path(0), 'ab').close()
+        self._open()
+
+    def _blob_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"chunks-{generation}.dat")
+
+    @contextmanager
+    def _locked(self):
+        with self._mutex:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _write_index(path: str, generation: int, records: Sequence[Tuple[int, ...]]):
+        with open(path, 'wb') as handle:
+            handle.write(HEADER.pack(INDEX_MAGIC, FORMAT_VERSION, generation, 0, 0, 0, 0, 0))
+            for record in records:
+                handle.write(RECORD.pack(*record))
+
+    def _open(self):
+        while True:
+            index_fd = os.open(self.index_path, os.O_RDWR)
+            header = HEADER.unpack(os.pread(index_fd, HEADER.size, 0))
+            if header[0] != INDEX_MAGIC or header[1] != FORMAT_VERSION:
+                os.close(index_fd)
+                raise ValueError(f"Unsupported chunk index {self.index_path}")
+            try:
+                blob_fd = os.open(self._blob_path(header[2]), os.O_RDWR)
+            except FileNotFoundError:
+                # Compaction replaced the index between our two opens
+                os.close(index_fd)
+                continue
+            break
+
+        self._index_fd, self._blob_fd = index_fd, blob_fd
+        self._inode = os.fstat(index_fd).st_ino
+        self.generation = header[2]
+        self.count = 0
+        self.by_course = {}
+        self._map()
+
+    def _map(self):
+        """(Re)map both files at their current size and index any new records"""
+        self._unmap()
+        index_size = os.fstat(self._index_fd).st_size
+        self._index_map = mmap.mmap(self._index_fd, index_size, access=mmap.ACCESS_READ)
+        self._words = memoryview(self._index_map).cast('q')
+        blob_size = os.fstat(self._blob_fd).st_size
+        if blob_size:
+            self._blob_map = mmap.mmap(self._blob_fd, blob_size, access=mmap.ACCESS_READ)
+
+        count = (index_size - HEADER.size) // RECORD.size
+        words = self._words
+        for record in range(self.count, count):
+            course_id = words[HEADER_WORDS + record * WIDTH + COURSE]
+            positions = self.by_course.get(course_id)
+            if positions is None:
+                positions = self.by_course[course_id] = array('I')
+            positions.append(record)
+        self.count = count
+
+    def _unmap(self):
+        if self._words is not None:
+            self._words.release()
+            self._words = None
+        for name in ('_index_map', '_blob_map'):
+            mapped = getattr(self, name)
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # A caller still holds a view from read_bytes(); the map goes with it
+                    pass
+                setattr(self, name, None)
+
+    def _close_files(self):
+        self._unmap()
+        for fd in (self._index_fd, self._blob_fd):
+            if fd is not None:
+                os.close(fd)
+        self._index_fd = self._blob_fd = None
+
+    def close(self):
+        self._close_files()
+
+    def refresh(self):
+        """Pick up records appended or compacted by other processes"""
+        with self._mutex:
+            try:
+                inode = os.stat(self.index_path).st_ino
+            except FileNotFoundError:
+                return
+            if inode != self._inode:
+                self._close_files()
+                self._open()
+            elif os.fstat(self._index_fd).st_size != len(self._index_map):
+                self._map()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, number: int) -> Tuple[int, ...]:
+        start = HEADER_WORDS + number * WIDTH
+        return tuple(self._words[start:start + WIDTH])
+
+    def read_bytes(self, number: int) -> memoryview:
+        """Zero-copy view of a chunk's UTF-8 bytes; release() it when done"""
+        with self._mutex:
+            start = HEADER_WORDS + number * WIDTH
+            offset, length = self._words[start + OFFSET], self._words[start + LENGTH]
+            if self._blob_map is None or offset + length > len(self._blob_map):
+                self._map()
+            return memoryview(self._blob_map)[offset:offset + length]
+
+    def read_text(self, number: int) -> str:
+        with self._mutex:
+            view = self.read_bytes(number)
+            try:
+                return str(view, 'utf-8')
+            finally:
+                view.release()
+
+    def _find(
+        self,
+        course_id: int,
+        section_id: int,
+        module_id: int,
+        file_id: int,
+        kind: str,
+        live_only: bool = True
+    ) -> Iterator[int]:
+        """Records of one document: same course, section, module, file and kind"""
+        kind_number = KINDS.index(kind)
+        words = self._words
+        for number in self.by_course.get(course_id, ()):
+            start = HEADER_WORDS + number * WIDTH
+            if live_only and words[start + FLAGS] & SUPERSEDED:
+                continue
+            if (words[start + SECTION] == section_id and words[start + MODULE] == module_id
+                    and words[start + FILE] == file_id and words[start + FLAGS] >> 1 == kind_number):
+                yield number
+
+    def has_version(
+        self,
+        course_id: int,
+        section_id: int,
+        module_id: int,
+        file_id: int,
+        kind: str,
+        version: int
+    ) -> bool:
+        """Whether this version of a document is already stored"""
+        with self._mutex:
+            self.refresh()
+            return any(
+                self._words[HEADER_WORDS + number * WIDTH + VERSION] == version
+                for number in self._find(course_id, section_id, module_id, file_id, kind)
+            )
+
+    def append_document(
+        self,
+        course_id: int,
+        section_id: int,
+        module_id: int,
+        file_id: int,
+        version: int,
+        kind: str,
+        chunks: Sequence[str]
+    ) -> int:
+        """Store the chunks of one document version, superseding older versions"""
+        kind_flags = KINDS.index(kind) << 1
+        with self._locked():
+            self.refresh()
+            for number in list(self._find(course_id, section_id, module_id, file_id, kind)):
+                position = HEADER.size + number * RECORD.size + FLAGS * 8
+                flags = self._words[HEADER_WORDS + number * WIDTH + FLAGS]
+                os.pwrite(self._index_fd, struct.pack('=q', flags | SUPERSEDED), position)
+
+            encoded = [chunk.encode('utf-8') for chunk in chunks]
+            offset = os.fstat(self._blob_fd).st_size
+            # Text first, so a record never points past the end of the blob.
+            # Explicit offsets rather than O_APPEND: Linux pwrite() ignores the
+            # offset on O_APPEND descriptors, which would break the flag updates.
+            os.pwrite(self._blob_fd, b''.join(encoded), offset)
+            records = bytearray()
+            for data in encoded:
+                records += RECORD.pack(offset, len(data), course_id, section_id, module_id, file_id, version, kind_flags)
+                offset += len(data)
+            os.pwrite(self._index_fd, bytes(records), os.fstat(self._index_fd).st_size)
+            self._map()
+        return len(encoded)
+
+    def chunks(
+        self,
+        course_id: int,
+        section_id: Optional[int] = None,
+        module_id: Optional[int] = None,
+        where: Optional[Callable[[int, Optional[int]], bool]] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        include_superseded: bool = False
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Count the matching chunks of a course and return one page of them
+
+        ``where(section_id, module_id)`` can filter further (e.g. by visibility);
+        text is only decoded for chunks on the returned page.
+        """
+        total = 0
+        results = []
+        with self._mutex:
+            self.refresh()
+            for number in self.by_course.get(course_id, ()):
+                record = self.record(number)
+                if not include_superseded and record[FLAGS] & SUPERSEDED:
+                    continue
+                if section_id is not None and record[SECTION] != section_id:
+                    continue
+                if module_id is not None and record[MODULE] != module_id:
+                    continue
+                if where is not None and not where(record[SECTION], record[MODULE] or None):
+                    continue
+                total += 1
+                if total <= offset or (limit is not None and len(results) >= limit):
+                    continue
+                results.append({
+                    'chunk_id': number,
+                    'course_id': record[COURSE],
+                    'section_id': record[SECTION],
+                    'module_id': record[MODULE] or None,
+                    'file_id': record[FILE] or None,
+                    'version': record[VERSION],
+                    'kind': KINDS[record[FLAGS] >> 1],
+                    'text': self.read_text(number),
+                })
+        return total, results
+
+    def superseded_count(self) -> int:
+        with self._mutex:
+            flags = self._words[HEADER_WORDS + FLAGS::WIDTH]
+            return sum(1 for value in flags if value & SUPERSEDED)
+
+    def compact(self) -> int:
+        """Drop superseded records and their text; returns the number removed"""
+        with self._locked():
+            self.refresh()
+            generation = self.generation + 1
+            blob_path = self._blob_path(generation)
+            live = []
+            offset = 0
+            with open(blob_path, 'wb') as blob:
+                for number in range(self.count):
+                    record = list(self.record(number))
+                    if record[FLAGS] & SUPERSEDED:
+                        continue
+                    view = self.read_bytes(number)
+                    blob.write(view)
+                    view.release()
+                    record[OFFSET] = offset
+                    offset += record[LENGTH]
+                    live.append(record)
+
+            tmp_path = f"{self.index_path}.tmp"
+            self._write_index(tmp_path, generation, live)
+            old_blob = self._blob_path(self.generation)
+            removed = self.count - len(live)
+            os.replace(tmp_path, self.index_path)
+            # Readers that still map the old blob keep it alive until they reopen
+            os.remove(old_blob)
+            self._close_files()
+            self._open()
+
+        logger.info(f"Compacted chunk store {self.directory}: removed {removed} superseded chunks")
+        return removed
+
+    def maybe_compact(self) -> int:
+        self.refresh()
+        if self.count and self.superseded_count() / self.count >= CHUNK_COMPACT_RATIO:
+            return self.compact()
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._mutex:
+            self.refresh()
+            return {
+                'chunks': self.count,
+                'superseded': self.superseded_count(),
+                'courses': len(self.by_course),
+                'text_bytes': len(self._blob_map) if self._blob_map is not None else 0,
+                'generation': self.generation,
+            }
+
+
+CHUNK_STORES: Dict[str, ChunkStore] = {}
+# Stores are opened from job threads as well as the event loop
+_chunk_stores_lock = threading.Lock()
+
+
+def get_chunk_store(base_url: str) -> ChunkStore:
+    """The chunk store of a Moodle site, opened once per process"""
+    with _chunk_stores_lock:
+        store = CHUNK_STORES.get(base_url)
+        if store is None:
+            host = hashlib.sha1(base_url.encode()).hexdigest()[:12]
+            store = CHUNK_STORES[base_url] = ChunkStore(os.path.join(CHUNK_STORE_DIR, host))
+        return store
+
+
+def close_chunk_stores():
+    with _chunk_stores_lock:
+        for store in CHUNK_STORES.values():
+            store.close()
+        CHUNK_STORES.clear()
@@ -0,0 +1,92 @@
+"""
+Recent versions of each course's normalised contents, for delta sync.
+
+The version of a contents body is a hash of its serialized bytes, so it is the
+same in every worker and for every user who sees identical contents. The last
+CONTENTS_VERSIONS_KEEP bodies of each (moodle_url, course_id, token) are kept
+zlib-compressed; a client that sends one of them as ``since_version`` gets a
+JSON Patch to the current version instead of the whole tree. Patches are
+cached per version pair until the older version is evicted.
+"""
+import hashlib
+import json
+import logging
+import os
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from ..utils.json_patch import diff
+from ..utils.offload import json_loads
+from .course_cache import CourseKey
+
+logger = logging.getLogger(__name__)
+
+CONTENTS_VERSIONS_KEEP = int(os.getenv('CONTENTS_VERSIONS_KEEP', 5))
+CONTENTS_VERSIONS_MAX_COURSES = int(os.getenv('CONTENTS_VERSIONS_MAX_COURSES', 500))
+
+
+def contents_version(body: bytes) -> str:
+    """Version id of a serialized contents body"""
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
+
+
+class VersionHistory:
+    """Compressed recent bodies of one course view, oldest first"""
+
+    def __init__(self):
+        self.bodies: "OrderedDict[str, bytes]" = OrderedDict()
+        self.patches: Dict[tuple, bytes] = {}
+
+    def add(self, version: str, body: bytes):
+        if version in self.bodies:
+            self.bodies.move_to_end(version)
+            return
+        self.bodies[version] = zlib.compress(body, 1)
+        while len(self.bodies) > CONTENTS_VERSIONS_KEEP:
+            evicted, _ = self.bodies.popitem(last=False)
+            self.patches = {pair: patch for pair, patch in self.patches.items() if evicted not in pair}
+
+    def body(self, version: str) -> Optional[bytes]:
+        compressed = self.bodies.get(version)
+        return zlib.decompress(compressed) if compressed is not None else None
+
+
+CONTENTS_VERSIONS: "OrderedDict[CourseKey, VersionHistory]" = OrderedDict()
+
+
+def record_version(key: CourseKey, version: str, body: bytes):
+    """Remember body as a version of the course view key"""
+    history = CONTENTS_VERSIONS.get(key)
+    if history is None:
+        history = CONTENTS_VERSIONS[key] = VersionHistory()
+        while len(CONTENTS_VERSIONS) > CONTENTS_VERSIONS_MAX_COURSES:
+            CONTENTS_VERSIONS.popitem(last=False)
+    CONTENTS_VERSIONS.move_to_end(key)
+    history.add(version, body)
+
+
+def build_patch(key: CourseKey, since_version: str, version: str, body: bytes) -> Optional[bytes]:
+    """
+    Serialized JSON Patch from since_version to the current body
+
+    Returns None when since_version is no longer known or the patch would not
+    be smaller than the body itself; the caller then sends the full body.
+    CPU-heavy for large courses, so callers run it off the event loop.
+    """
+    history = CONTENTS_VERSIONS.get(key)
+    if history is None:
+        return None
+
+    pair = (since_version, version)
+    patch = history.patches.get(pair)
+    if patch is None:
+        old_body = history.body(since_version)
+        if old_body is None:
+            return None
+        operations = diff(json_loads(old_body), json_loads(body))
+        patch = json.dumps(operations, separators=(',', ':'), ensure_ascii=False).encode()
+        history.patches[pair] = patch
+        logger.debug(f"Contents patch {since_version}..{version}: {len(operations)} ops, {len(patch)} bytes")
+
+    return patch if len(patch) < len(body) else None
@@ -0,0 +1,132 @@
+"""
+Short-lived cache of course contents and their derived file index.
+
+Entries are keyed by (moodle_url, course_id, token) because Moodle filters
+contents by the user's permissions. Derived data (the file index) hangs off the
+entry, so invalidating a course drops everything built from its contents.
+On a cold miss, a matching snapshot from SNAPSHOT_DIR answers first; it is
+read in a worker thread and ages from the snapshot's creation time, so an old
+one is refreshed right away.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..utils.single_flight import SingleFlight
+from .file_index import FileIndex
+from .moodle_client import MoodleClient
+from .snapshot import SNAPSHOT_SEEDS, take_snapshot_seed
+
+logger = logging.getLogger(__name__)
+
+COURSE_CACHE_TTL = float(os.getenv('COURSE_CACHE_TTL', 60))
+COURSE_CACHE_MAX_ENTRIES = int(os.getenv('COURSE_CACHE_MAX_ENTRIES', 500))
+
+CourseKey = Tuple[str, int, str]
+
+
+class CourseEntry:
+    """Contents of one course as seen by one token, plus derived indexes"""
+
+    def __init__(
+        self,
+        key: CourseKey,
+        contents: List[Dict[str, Any]],
+        file_index: Optional[FileIndex] = None,
+        age: float = 0.0
+    ):
+        self.key = key
+        self.contents = contents
+        # A seeded entry is as old as its snapshot, not as old as the cache entry
+        self.fetched_at = time.monotonic() - max(age, 0.0)
+        self._file_index = file_index
+        # Serialized contents response and its version, filled in by the contents route
+        self.body: Optional[bytes] = None
+        self.version: Optional[str] = None
+
+    @property
+    def file_index(self) -> FileIndex:
+        if self._file_index is None:
+            self._file_index = FileIndex.from_contents(self.contents)
+        return self._file_index
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.fetched_at < COURSE_CACHE_TTL
+
+
+COURSE_CACHE: "OrderedDict[CourseKey, CourseEntry]" = OrderedDict()
+_inflight = SingleFlight('course contents')
+
+
+def course_key(client: MoodleClient, course_id: int) -> CourseKey:
+    return (client.base_url, course_id, client.token)
+
+
+def put_course_entry(entry: CourseEntry):
+    """Store an entry, evicting the least recently used beyond the size limit"""
+    COURSE_CACHE[entry.key] = entry
+    COURSE_CACHE.move_to_end(entry.key)
+    while len(COURSE_CACHE) > COURSE_CACHE_MAX_ENTRIES:
+        COURSE_CACHE.popitem(last=False)
+
+
+def _load_seed(key: CourseKey) -> Optional[CourseEntry]:
+    """Entry decoded from the seed snapshot for key, if any (blocking)"""
+    base_url, course_id, token = key
+    snapshot = take_snapshot_seed(base_url, course_id, token)
+    if snapshot is None:
+        return None
+    try:
+        # The stored index rows save rebuilding the index from the sections
+        entry = CourseEntry(key, snapshot.contents(), snapshot.file_index(), snapshot.age())
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        logger.warning(f"Could not read snapshot {snapshot.path}: {e}")
+        return None
+    logger.info(f"Seeded course {course_id} from snapshot {snapshot.path}")
+    return entry
+
+
+async def get_course_entry(client: MoodleClient, course_id: int, refresh: bool = False) -> CourseEntry:
+    """Get cached course contents, fetching from Moodle once per key when stale"""
+    key = course_key(client, course_id)
+
+    entry = COURSE_CACHE.get(key)
+    if entry and not refresh and entry.is_fresh():
+        COURSE_CACHE.move_to_end(key)
+        return entry
+
+    async def fetch() -> CourseEntry:
+        contents = await client.get_course_contents(course_id)
+        entry = CourseEntry(key, contents)
+        # [] means Moodle refused the call (e.g. access just revoked); don't pin that
+        if contents:
+            put_course_entry(entry)
+        return entry
+
+    if entry is None and not refresh and key not in _inflight:
+        entry = await asyncio.to_thread(_load_seed, key) if SNAPSHOT_SEEDS else None
+        if entry is not None:
+            put_course_entry(entry)
+            if not entry.is_fresh():
+                # Answer from the snapshot now, but don't keep serving it past the TTL
+                _inflight.start(key, fetch)
+            return entry
+
+    # Concurrent misses for the same key share one upstream call
+    return await _inflight.run(key, fetch)
+
+
+def invalidate_course(moodle_url: str, course_id: int) -> int:
+    """Drop cached contents and derived indexes of a course for every user"""
+    base_url = moodle_url.rstrip('/')
+    keys = [key for key in COURSE_CACHE if key[0] == base_url and key[1] == course_id]
+    for key in keys:
+        del COURSE_CACHE[key]
+    if keys:
+        logger.info(f"Invalidated {len(keys)} cached views of course {course_id} on {base_url}")
+    return len(keys)
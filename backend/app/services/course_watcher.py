@@ -0,0 +1,189 @@
+"""
+Course change notifications with one upstream poller per (Moodle URL, course).
+
+Every WebSocket subscriber of a course shares the same watcher task, so the
+upstream polling cost grows with the number of watched courses, not with the
+number of connected clients. Watchers use core_course_get_updates_since and
+fall back to a digest of the contents tree when that function is unavailable.
+The poll interval starts at WATCH_MIN_INTERVAL, backs off while nothing
+changes and snaps back after a change.
+
+Change checks run with whichever subscriber's token still works, so events
+only say that the course changed, never what changed: the changed instances
+may include modules hidden from the other subscribers. Each client refetches
+the contents with its own session.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .course_cache import invalidate_course
+from .moodle_client import MoodleAPIError, MoodleClient
+
+logger = logging.getLogger(__name__)
+
+WATCH_MIN_INTERVAL = float(os.getenv('WATCH_MIN_INTERVAL', 15))
+WATCH_MAX_INTERVAL = float(os.getenv('WATCH_MAX_INTERVAL', 300))
+WATCH_BACKOFF = 1.5
+SUBSCRIBER_QUEUE_SIZE = 32
+
+WatchKey = Tuple[str, int]
+
+
+class Subscription:
+    """One connected client's view of a course watcher"""
+
+    def __init__(self, key: WatchKey, client: MoodleClient, session_id: str):
+        self.key = key
+        self.client = client
+        self.session_id = session_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event: Dict[str, Any]):
+        # A slow client loses its oldest events rather than blocking the watcher
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+def contents_digest(contents: List[Dict[str, Any]]) -> str:
+    """Digest of the parts of a contents tree that matter for change detection"""
+    parts = []
+    for section in contents:
+        parts.append(('s', section.get('id'), section.get('name'), section.get('visible'), section.get('summary')))
+        for module in section.get('modules') or []:
+            parts.append(('m', module.get('id'), module.get('name'), module.get('visible'),
+                          [(c.get('filename'), c.get('timemodified')) for c in module.get('contents') or []]))
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class CourseWatcher:
+    """Polls one course on behalf of all of its subscribers"""
+
+    def __init__(self, key: WatchKey):
+        self.key = key
+        self.subscribers: Set[Subscription] = set()
+        self.interval = WATCH_MIN_INTERVAL
+        self.since = int(time.time())
+        self.digest: Optional[str] = None
+        self.use_updates_since = True
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def publish(self, event: Dict[str, Any]):
+        for subscription in list(self.subscribers):
+            subscription.deliver(event)
+
+    async def check(self, client: MoodleClient) -> bool:
+        """Whether the course changed since the last check"""
+        course_id = self.key[1]
+
+        if self.use_updates_since:
+            checked_at = int(time.time())
+            try:
+                result = await client.get_course_updates_since(course_id, self.since)
+            except MoodleAPIError as e:
+                # Function disabled for the mobile service or not permitted
+                logger.info(f"updates_since unavailable for {self.key} ({e.errorcode}), using contents digest")
+                self.use_updates_since = False
+            else:
+                self.since = checked_at
+                return bool(result.get('instances'))
+
+        contents = await client.get_course_contents(course_id)
+        if not contents:
+            raise Exception("Empty contents while checking for changes")
+        digest = contents_digest(contents)
+        previous, self.digest = self.digest, digest
+        return previous is not None and previous != digest
+
+    async def poll_once(self):
+        # Any subscriber's credentials will do; skip ones that stopped working
+        for subscription in list(self.subscribers):
+            try:
+                changed = await self.check(subscription.client)
+                break
+            except Exception as e:
+                logger.warning(f"Change check for {self.key} failed with one subscriber: {e}")
+        else:
+            self.interval = min(self.interval * WATCH_BACKOFF, WATCH_MAX_INTERVAL)
+            return
+
+        if not changed:
+            self.interval = min(self.interval * WATCH_BACKOFF, WATCH_MAX_INTERVAL)
+            return
+
+        moodle_url, course_id = self.key
+        invalidate_course(moodle_url, course_id)
+        self.interval = WATCH_MIN_INTERVAL
+        self.publish({
+            'type': 'course_updated',
+            'course_id': course_id,
+            'timestamp': int(time.time()),
+        })
+
+    async def run(self):
+        while self.subscribers:
+            await asyncio.sleep(self.interval)
+            if not self.subscribers:
+                break
+            await self.poll_once()
+
+
+WATCHERS: Dict[WatchKey, CourseWatcher] = {}
+
+
+def subscribe(client: MoodleClient, course_id: int, session_id: str) -> Subscription:
+    """Attach a subscriber to the course watcher, starting it if needed"""
+    key = (client.base_url, course_id)
+    watcher = WATCHERS.get(key)
+    if watcher is None:
+        watcher = WATCHERS[key] = CourseWatcher(key)
+        logger.info(f"Started watcher for course {course_id} on {client.base_url}")
+    subscription = Subscription(key, client, session_id)
+    watcher.subscribers.add(subscription)
+    if watcher.task is None or watcher.task.done():
+        watcher.start()
+    return subscription
+
+
+def unsubscribe(subscription: Subscription):
+    """Detach a subscriber; the watcher stops with its last subscriber"""
+    watcher = WATCHERS.get(subscription.key)
+    if watcher is None:
+        return
+    watcher.subscribers.discard(subscription)
+    if not watcher.subscribers:
+        del WATCHERS[subscription.key]
+        if watcher.task:
+            watcher.task.cancel()
+        logger.info(f"Stopped watcher for course {subscription.key[1]} on {subscription.key[0]}")
+
+
+async def stop_all_watchers():
+    """Cancel every watcher (application shutdown)"""
+    watchers = list(WATCHERS.values())
+    WATCHERS.clear()
+    for watcher in watchers:
+        await watcher.stop()
+
+
+def get_watcher_stats() -> Dict[str, Any]:
+    return {
+        'watched_courses': len(WATCHERS),
+        'subscribers': sum(len(watcher.subscribers) for watcher in WATCHERS.values()),
+    }
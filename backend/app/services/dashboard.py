@@ -0,0 +1,253 @@
+"""
+Per-session dashboard: profile, courses, recent files, deadlines, suggestions.
+
+The parts are fetched concurrently and each one has to finish within
+DASHBOARD_PART_TIMEOUT of the start of the build; a part that fails or times
+out is reported in ``errors`` while the others are still returned, and the
+value from the previous build is kept (listed in ``stale``) where there is one.
+
+Built views are kept per session. Within DASHBOARD_TTL a view is served as is;
+after that it is still served instantly while a background task rebuilds it,
+and only views older than DASHBOARD_MAX_AGE make the request wait for a rebuild.
+Builds run detached from the requests waiting for them (SingleFlight), so a
+request that gives up, or whose deadline passes, never cancels a build; past
+its deadline a request gets the previous view if there is one.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from ..middleware.deadline import DeadlineExceeded
+from ..utils.helpers import on_session_end
+from ..utils.single_flight import SingleFlight
+from .course_cache import get_course_entry
+from .deadlines import get_deadlines
+from .moodle_client import MoodleClient
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_TTL = float(os.getenv('DASHBOARD_TTL', 60))
+DASHBOARD_MAX_AGE = float(os.getenv('DASHBOARD_MAX_AGE', 900))
+DASHBOARD_PART_TIMEOUT = float(os.getenv('DASHBOARD_PART_TIMEOUT', 5.0))
+DASHBOARD_MAX_ENTRIES = int(os.getenv('DASHBOARD_MAX_ENTRIES', 2000))
+DASHBOARD_RECENT_COURSES = int(os.getenv('DASHBOARD_RECENT_COURSES', 3))
+DASHBOARD_RECENT_ITEMS = int(os.getenv('DASHBOARD_RECENT_ITEMS', 10))
+DASHBOARD_DEADLINE_ITEMS = 5
+
+PARTS = ('profile', 'courses', 'recent', 'deadlines')
+
+STATIC_SUGGESTIONS = [
+    "Show me my courses",
+    "What materials are available?",
+    "Help me organize my studies",
+    "Find recent course updates",
+    "What assignments are coming up?",
+    "Help me prepare for exams",
+    "Show me discussion forums",
+    "Find lecture recordings"
+]
+
+
+class DashboardView:
+    """One materialized dashboard of a session"""
+
+    def __init__(self, parts: Dict[str, Any], errors: Dict[str, str], stale: List[str]):
+        self.parts = parts
+        self.errors = errors
+        self.stale = stale
+        self.suggestions = build_suggestions(parts)
+        self.built_at = time.monotonic()
+        self.generated_at = int(time.time())
+
+    @property
+    def has_data(self) -> bool:
+        """Whether any part has a value, fresh or stale"""
+        return any(value is not None for value in self.parts.values())
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.built_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.parts,
+            'suggestions': self.suggestions,
+            'errors': self.errors,
+            'stale': self.stale,
+            'generated_at': self.generated_at,
+            'age_seconds': round(self.age, 1),
+        }
+
+
+DASHBOARD_CACHE: "OrderedDict[str, DashboardView]" = OrderedDict()
+_inflight = SingleFlight('dashboard')
+
+
+def _slim_profile(site_info: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'userid': site_info.get('userid'),
+        'username': site_info.get('username'),
+        'fullname': site_info.get('fullname'),
+        'userpictureurl': site_info.get('userpictureurl'),
+        'sitename': site_info.get('sitename'),
+    }
+
+
+def _slim_course(course: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': course.get('id'),
+        'fullname': course.get('fullname'),
+        'shortname': course.get('shortname'),
+        'progress': course.get('progress'),
+        'lastaccess': course.get('lastaccess'),
+    }
+
+
+def build_suggestions(parts: Dict[str, Any]) -> List[str]:
+    """Chat suggestions derived from the dashboard data, padded with the static ones"""
+    suggestions = []
+    deadlines = parts.get('deadlines') or []
+    if deadlines:
+        suggestions.append(f"When is {deadlines[0]['name']} due?")
+        suggestions.append("What assignments are due?")
+    recent = parts.get('recent') or []
+    if recent:
+        suggestions.append(f"What's new in {recent[0]['course_name']}?")
+    courses = parts.get('courses') or []
+    for course in courses[:2]:
+        suggestions.append(f"Help me find materials for {course['fullname']}")
+    for suggestion in STATIC_SUGGESTIONS:
+        if len(suggestions) >= 6:
+            break
+        if suggestion not in suggestions:
+            suggestions.append(suggestion)
+    return suggestions
+
+
+async def _build_view(client: MoodleClient, session_id: str, previous: Optional[DashboardView]) -> DashboardView:
+    async def profile():
+        return _slim_profile(await client.get_user_info())
+
+    async def courses():
+        try:
+            userid = (await profile_task)['userid']
+        except Exception:
+            # A failed profile should not take the other parts down with it:
+            # use the last known user id, or let get_user_courses look it up
+            userid = (previous.parts.get('profile') or {}).get('userid') if previous else None
+        result = await client.get_user_courses(userid)
+        if not result:
+            # get_user_courses reports upstream errors as an empty list
+            raise Exception("No courses returned")
+        return sorted(result, key=lambda course: course.get('lastaccess') or 0, reverse=True)
+
+    async def recent():
+        recent_courses = (await courses_task)[:DASHBOARD_RECENT_COURSES]
+        entries = await asyncio.gather(
+            *(get_course_entry(client, course['id']) for course in recent_courses),
+            return_exceptions=True
+        )
+        items = []
+        for course, entry in zip(recent_courses, entries):
+            if isinstance(entry, BaseException):
+                logger.warning(f"Dashboard could not load course {course['id']}: {entry}")
+                continue
+            for file in entry.file_index.query(sort='timemodified', descending=True, limit=DASHBOARD_RECENT_ITEMS):
+                items.append({**file.to_dict(), 'course_id': course['id'], 'course_name': course.get('fullname')})
+        items.sort(key=lambda item: item['timemodified'], reverse=True)
+        return items[:DASHBOARD_RECENT_ITEMS]
+
+    async def deadlines():
+        timeline = await get_deadlines(client, session_id, courses=await courses_task)
+        return timeline.select(since=int(time.time()), limit=DASHBOARD_DEADLINE_ITEMS)
+
+    profile_task = asyncio.create_task(profile())
+    courses_task = asyncio.create_task(courses())
+    tasks: Dict[str, asyncio.Task] = {
+        'profile': profile_task,
+        'courses': courses_task,
+        'recent': asyncio.create_task(recent()),
+        'deadlines': asyncio.create_task(deadlines()),
+    }
+
+    # Every part has to finish by the same deadline; parts that depend on another
+    # (recent and deadlines on courses) wait for it within it. Cancelling a part
+    # that waits on a shared course or deadlines fetch only stops the wait
+    try:
+        done, pending = await asyncio.wait(tasks.values(), timeout=DASHBOARD_PART_TIMEOUT)
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    parts: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    stale: List[str] = []
+    for name, task in tasks.items():
+        if task in done and task.exception() is None:
+            value = task.result()
+            parts[name] = [_slim_course(course) for course in value] if name == 'courses' else value
+            continue
+        errors[name] = 'timed out' if task in pending else 'unavailable'
+        if task in done:
+            logger.warning(f"Dashboard part {name} failed: {task.exception()}")
+        if previous is not None and previous.parts.get(name) is not None:
+            parts[name] = previous.parts[name]
+            stale.append(name)
+        else:
+            parts[name] = None
+
+    return DashboardView(parts, errors, stale)
+
+
+async def _rebuild(client: MoodleClient, session_id: str) -> DashboardView:
+    """Build a new view and store it (run once per session at a time via _inflight)"""
+    view = await _build_view(client, session_id, DASHBOARD_CACHE.get(session_id))
+    # A view with nothing fresh in it is served but not kept as the new baseline
+    if len(view.errors) < len(PARTS):
+        DASHBOARD_CACHE[session_id] = view
+        DASHBOARD_CACHE.move_to_end(session_id)
+        while len(DASHBOARD_CACHE) > DASHBOARD_MAX_ENTRIES:
+            DASHBOARD_CACHE.popitem(last=False)
+    return view
+
+
+async def get_dashboard(client: MoodleClient, session_id: str, refresh: bool = False) -> DashboardView:
+    """Serve the session's materialized dashboard, rebuilding it when needed"""
+    view = DASHBOARD_CACHE.get(session_id)
+    if view is None or refresh or view.age >= DASHBOARD_MAX_AGE:
+        try:
+            return await _inflight.run(session_id, lambda: _rebuild(client, session_id))
+        except DeadlineExceeded:
+            if view is None:
+                raise
+            logger.warning("Dashboard rebuild outlived the request deadline; serving the previous view")
+            return view
+
+    DASHBOARD_CACHE.move_to_end(session_id)
+    if view.age >= DASHBOARD_TTL:
+        # Served as is while the rebuild runs in the background
+        _inflight.start(session_id, lambda: _rebuild(client, session_id))
+    return view
+
+
+def get_cached_dashboard(session_id: str) -> Optional[DashboardView]:
+    """The session's last built dashboard, if any (never triggers a build)"""
+    return DASHBOARD_CACHE.get(session_id)
+
+
+@on_session_end
+def forget_dashboard(session_id: str):
+    """Drop an ended session's dashboard and stop its rebuild"""
+    DASHBOARD_CACHE.pop(session_id, None)
+    _inflight.cancel(session_id)
+
+
+async def stop_dashboard_refreshes():
+    """Cancel dashboard builds still running (called on shutdown)"""
+    await _inflight.cancel_all()
@@ -0,0 +1,174 @@
+"""
+Upcoming deadlines across all of a user's courses.
+
+Assignments and quizzes are fetched for every enrolled course with one
+batched upstream call each (``courseids[0]=...&courseids[1]=...``), merged into
+one timeline sorted by due time and cached per session for DEADLINES_CACHE_TTL.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from ..utils.helpers import on_session_end
+from ..utils.single_flight import SingleFlight
+from .moodle_client import MoodleClient
+
+logger = logging.getLogger(__name__)
+
+DEADLINES_CACHE_TTL = float(os.getenv('DEADLINES_CACHE_TTL', 300))
+DEADLINES_CACHE_MAX_ENTRIES = int(os.getenv('DEADLINES_CACHE_MAX_ENTRIES', 2000))
+
+
+class DeadlineTimeline:
+    """Time-sorted deadlines of one session, plus warnings about missing sources"""
+
+    def __init__(self, items: List[Dict[str, Any]], warnings: List[str]):
+        self.items = items
+        self.warnings = warnings
+        self.fetched_at = time.monotonic()
+        self.generated_at = int(time.time())
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.fetched_at < DEADLINES_CACHE_TTL
+
+    def select(
+        self,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        course_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        items = []
+        for item in self.items:
+            if since is not None and item['due'] < since:
+                continue
+            if until is not None and item['due'] > until:
+                break
+            if course_id is not None and item['course_id'] != course_id:
+                continue
+            items.append(item)
+            if limit is not None and len(items) >= limit:
+                break
+        return items
+
+
+DEADLINES_CACHE: "OrderedDict[str, DeadlineTimeline]" = OrderedDict()
+_inflight = SingleFlight('deadlines')
+
+
+def _assignment_items(result: Dict[str, Any], base_url: str, names: Dict[int, str]) -> List[Dict[str, Any]]:
+    items = []
+    for course in result.get('courses') or []:
+        for assignment in course.get('assignments') or []:
+            due = assignment.get('duedate') or 0
+            if not due:
+                continue
+            course_id = assignment.get('course') or course.get('id')
+            items.append({
+                'type': 'assignment',
+                'id': assignment.get('id'),
+                'cmid': assignment.get('cmid'),
+                'course_id': course_id,
+                'course_name': names.get(course_id) or course.get('fullname'),
+                'name': assignment.get('name'),
+                'due': due,
+                'opens': assignment.get('allowsubmissionsfromdate') or None,
+                'cutoff': assignment.get('cutoffdate') or None,
+                'url': f"{base_url}/mod/assign/view.php?id={assignment.get('cmid')}",
+            })
+    return items
+
+
+def _quiz_items(result: Dict[str, Any], base_url: str, names: Dict[int, str]) -> List[Dict[str, Any]]:
+    items = []
+    for quiz in result.get('quizzes') or []:
+        due = quiz.get('timeclose') or 0
+        if not due:
+            continue
+        items.append({
+            'type': 'quiz',
+            'id': quiz.get('id'),
+            'cmid': quiz.get('coursemodule'),
+            'course_id': quiz.get('course'),
+            'course_name': names.get(quiz.get('course')),
+            'name': quiz.get('name'),
+            'due': due,
+            'opens': quiz.get('timeopen') or None,
+            'cutoff': None,
+            'url': f"{base_url}/mod/quiz/view.php?id={quiz.get('coursemodule')}",
+        })
+    return items
+
+
+async def _fetch_timeline(client: MoodleClient, courses: Optional[List[Dict[str, Any]]]) -> DeadlineTimeline:
+    if courses is None:
+        # An empty timeline must mean no courses, not a failed course lookup
+        courses = await client.get_user_courses(raise_errors=True)
+    names = {course.get('id'): course.get('fullname') for course in courses}
+    if not names:
+        return DeadlineTimeline([], [])
+
+    course_ids = sorted(names)
+    assignments, quizzes = await asyncio.gather(
+        client.get_assignments(course_ids),
+        client.get_quizzes(course_ids),
+        return_exceptions=True
+    )
+
+    items: List[Dict[str, Any]] = []
+    warnings: List[str] = []
+    for source, result, build in (
+        ('assignments', assignments, _assignment_items),
+        ('quizzes', quizzes, _quiz_items),
+    ):
+        if isinstance(result, BaseException):
+            logger.warning(f"Could not fetch {source} for deadlines: {result}")
+            warnings.append(f"{source} unavailable")
+        else:
+            items.extend(build(result, client.base_url, names))
+
+    if len(warnings) == 2:
+        raise Exception("Neither assignments nor quizzes could be fetched")
+
+    items.sort(key=lambda item: (item['due'], item['course_id'] or 0, item['name'] or ''))
+    return DeadlineTimeline(items, warnings)
+
+
+async def get_deadlines(
+    client: MoodleClient,
+    session_id: str,
+    refresh: bool = False,
+    courses: Optional[List[Dict[str, Any]]] = None
+) -> DeadlineTimeline:
+    """
+    Get the session's cached deadline timeline, rebuilding it once when stale
+
+    Callers that already have the user's course list can pass it as courses
+    to save the upstream lookup.
+    """
+    timeline = DEADLINES_CACHE.get(session_id)
+    if timeline and not refresh and timeline.is_fresh():
+        DEADLINES_CACHE.move_to_end(session_id)
+        return timeline
+
+    async def rebuild() -> DeadlineTimeline:
+        timeline = await _fetch_timeline(client, courses)
+        # Partial results (upstream trouble) are served but not cached
+        if not timeline.warnings:
+            DEADLINES_CACHE[session_id] = timeline
+            DEADLINES_CACHE.move_to_end(session_id)
+            while len(DEADLINES_CACHE) > DEADLINES_CACHE_MAX_ENTRIES:
+                DEADLINES_CACHE.popitem(last=False)
+        return timeline
+
+    return await _inflight.run(session_id, rebuild)
+
+
+@on_session_end
+def forget_deadlines(session_id: str):
+    """Drop an ended session's timeline and stop its rebuild"""
+    DEADLINES_CACHE.pop(session_id, None)
+    _inflight.cancel(session_id)
@@ -0,0 +1,178 @@
+"""
+Per-course file index built from core_course_get_contents.
+
+Entries are bucketed by extension, MIME type, section and module and kept in
+size and timemodified order, so a query starts from its most selective filter
+and only touches candidates that can be in the result.
+"""
+import heapq
+import os
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+
+class FileEntry:
+    """A file content item of a course module"""
+
+    __slots__ = (
+        'position', 'filename', 'fileurl', 'filesize', 'mimetype', 'timemodified', 'extension',
+        'section_id', 'section_name', 'module_id', 'module_name',
+    )
+
+    def __init__(self, position: int, content: Dict[str, Any], module: Dict[str, Any], section: Dict[str, Any]):
+        filename = content.get('filename') or ''
+        self.position = position
+        self.filename = filename
+        self.fileurl = content.get('fileurl')
+        self.filesize = content.get('filesize') or 0
+        self.mimetype = content.get('mimetype')
+        self.timemodified = content.get('timemodified') or 0
+        self.extension = os.path.splitext(filename)[1][1:].lower()
+        self.section_id = section.get('id')
+        self.section_name = section.get('name')
+        self.module_id = module.get('id')
+        self.module_name = module.get('name')
+
+    @classmethod
+    def from_dict(cls, position: int, data: Dict[str, Any]) -> "FileEntry":
+        """Rebuild an entry from to_dict() output (e.g. a stored snapshot)"""
+        entry = cls.__new__(cls)
+        entry.position = position
+        for name in cls.__slots__[1:]:
+            setattr(entry, name, data.get(name))
+        # Stored rows can hold NULLs; keep the same defaults as __init__ so sorting works
+        entry.filename = entry.filename or ''
+        entry.filesize = entry.filesize or 0
+        entry.timemodified = entry.timemodified or 0
+        entry.extension = entry.extension or ''
+        return entry
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'filename': self.filename,
+            'fileurl': self.fileurl,
+            'filesize': self.filesize,
+            'mimetype': self.mimetype,
+            'timemodified': self.timemodified,
+            'extension': self.extension,
+            'module_id': self.module_id,
+            'module_name': self.module_name,
+            'section_id': self.section_id,
+            'section_name': self.section_name,
+        }
+
+
+SORT_KEYS = ('position', 'filename', 'filesize', 'timemodified')
+
+
+class FileIndex:
+    """Files of one course with secondary indexes for filtered queries"""
+
+    def __init__(self, entries: List[FileEntry]):
+        self.entries = entries
+        self.by_extension: Dict[str, List[int]] = {}
+        self.by_mimetype: Dict[str, List[int]] = {}
+        self.by_section: Dict[Any, List[int]] = {}
+        self.by_module: Dict[Any, List[int]] = {}
+
+        for entry in entries:
+            self.by_extension.setdefault(entry.extension, []).append(entry.position)
+            self.by_mimetype.setdefault(entry.mimetype, []).append(entry.position)
+            self.by_section.setdefault(entry.section_id, []).append(entry.position)
+            self.by_module.setdefault(entry.module_id, []).append(entry.position)
+
+        self.size_order = sorted(range(len(entries)), key=lambda i: entries[i].filesize)
+        self.sizes = [entries[i].filesize for i in self.size_order]
+        self.time_order = sorted(range(len(entries)), key=lambda i: entries[i].timemodified)
+        self.times = [entries[i].timemodified for i in self.time_order]
+
+    @classmethod
+    def from_contents(cls, contents: Iterable[Dict[str, Any]]) -> "FileIndex":
+        entries: List[FileEntry] = []
+        for section in contents:
+            for module in section.get('modules') or []:
+                for content in module.get('contents') or []:
+                    if content.get('type') == 'file':
+                        entries.append(FileEntry(len(entries), content, module, section))
+        return cls(entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _union(buckets: Dict[Any, List[int]], keys: Sequence[Any]) -> List[int]:
+        lists = [buckets[key] for key in set(keys) if key in buckets]
+        if len(lists) == 1:
+            return lists[0]
+        return list(heapq.merge(*lists))
+
+    def query(
+        self,
+        extensions: Optional[Sequence[str]] = None,
+        mimetypes: Optional[Sequence[str]] = None,
+        section_id: Optional[int] = None,
+        module_id: Optional[int] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        modified_since: Optional[int] = None,
+        sort: str = 'position',
+        descending: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[FileEntry]:
+        """Return files matching every given filter, sorted by ``sort``"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+
+        extensions = [ext.lower().lstrip('.') for ext in extensions] if extensions else None
+
+        # Candidate lists in course order (position) or in their own sorted order
+        candidates = []
+        if extensions is not None:
+            candidates.append((self._union(self.by_extension, extensions), 'position'))
+        if mimetypes:
+            candidates.append((self._union(self.by_mimetype, mimetypes), 'position'))
+        if section_id is not None:
+            candidates.append((self.by_section.get(section_id, []), 'position'))
+        if module_id is not None:
+            candidates.append((self.by_module.get(module_id, []), 'position'))
+        if min_size is not None or max_size is not None:
+            lo = bisect_left(self.sizes, min_size) if min_size is not None else 0
+            hi = bisect_right(self.sizes, max_size) if max_size is not None else len(self.sizes)
+            candidates.append((self.size_order[lo:hi], 'filesize'))
+        if modified_since is not None:
+            lo = bisect_left(self.times, modified_since)
+            candidates.append((self.time_order[lo:], 'timemodified'))
+
+        if candidates:
+            positions, order = min(candidates, key=lambda candidate: len(candidate[0]))
+        else:
+            positions, order = range(len(self.entries)), 'position'
+
+        extension_set = set(extensions) if extensions is not None else None
+        mimetype_set = set(mimetypes) if mimetypes else None
+        results = []
+        for position in positions:
+            entry = self.entries[position]
+            if extension_set is not None and entry.extension not in extension_set:
+                continue
+            if mimetype_set is not None and entry.mimetype not in mimetype_set:
+                continue
+            if section_id is not None and entry.section_id != section_id:
+                continue
+            if module_id is not None and entry.module_id != module_id:
+                continue
+            if min_size is not None and entry.filesize < min_size:
+                continue
+            if max_size is not None and entry.filesize > max_size:
+                continue
+            if modified_since is not None and entry.timemodified < modified_since:
+                continue
+            results.append(entry)
+
+        if order != sort:
+            results.sort(key=lambda entry: getattr(entry, sort))
+        if descending:
+            results.reverse()
+        if limit is not None:
+            results = results[:limit]
+        return results
@@ -0,0 +1,662 @@
+"""
+In-process background jobs for long course operations.
+
+Jobs run on a fixed pool of worker tasks (JOB_WORKERS, the global concurrency
+limit). A session may have at most JOB_MAX_PER_SESSION jobs running and
+JOB_MAX_QUEUED_PER_SESSION waiting; workers skip over queued jobs whose session
+is at its limit, so one session's backlog does not block others. Finished jobs
+and their result files are kept for JOB_RESULT_TTL seconds.
+
+With several worker processes (JOB_STORE=sqlite, selected automatically by
+production mode) job state is also written to a SQLite file and result files
+live in the shared JOB_DIR, so any worker can report on, cancel and serve a
+job. A job still runs in the worker that accepted it, and the running limit
+per session applies per worker. Progress reaches the other workers every
+JOB_SYNC_INTERVAL, as do cancel requests. Store calls run on one dedicated
+thread, in order, so a writer in another process never blocks the event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from ..utils.helpers import html_to_text, on_session_end
+from .chunk_store import file_key, get_chunk_store, split_text
+from .course_cache import get_course_entry
+from .moodle_client import MoodleClient
+from .snapshot import export_snapshot
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_MAX_PER_SESSION = int(os.getenv('JOB_MAX_PER_SESSION', 2))
+JOB_MAX_QUEUED_PER_SESSION = int(os.getenv('JOB_MAX_QUEUED_PER_SESSION', 10))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', 3600))
+JOB_DIR = os.path.join(os.getenv('UPLOAD_DIR', 'downloads'), 'jobs')
+# memory: jobs are visible to the worker that runs them only; sqlite: to every worker
+JOB_STORE = os.getenv('JOB_STORE', 'memory').lower()
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', 'jobs.db')
+# How often a worker publishes the progress of its jobs and picks up cancel requests
+JOB_SYNC_INTERVAL = 1.0
+# Unfinished jobs of a worker that has not reported for this long are marked failed
+JOB_LOST_AFTER = 30.0
+
+
+def parse_size(value: str) -> int:
+    """Parse sizes like '100MB' or '512k' into bytes"""
+    value = value.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+MAX_FILE_SIZE = parse_size(os.getenv('MAX_FILE_SIZE', '100MB'))
+
+# Course files whose text is extracted by index_text jobs
+TEXT_EXTENSIONS = ('txt', 'md', 'csv', 'html', 'htm')
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobLimitError(Exception):
+    """The session already has too many jobs waiting"""
+
+
+class Job:
+    """A unit of background work owned by one session"""
+
+    def __init__(self, kind: str, session_id: str, client: Optional[MoodleClient], params: Dict[str, Any]):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.client = client
+        self.params = params
+        self.state = QUEUED
+        self.progress = 0.0
+        self.message: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.result_path: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        """Read-only view of a stored job (one that may run in another worker)"""
+        job = cls(record['kind'], record['session_id'], None, record['params'])
+        for name, value in record.items():
+            setattr(job, name, value)
+        return job
+
+    @property
+    def workdir(self) -> str:
+        return os.path.join(JOB_DIR, self.job_id)
+
+    def report(self, done: float, total: float, message: Optional[str] = None):
+        """Update progress as a fraction of total"""
+        self.progress = round(min(done / total, 1.0) * 100, 1) if total else 100.0
+        if message is not None:
+            self.message = message
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'state': self.state,
+            'progress': self.progress,
+            'message': self.message,
+            'params': self.params,
+            'result': self.result,
+            'error': self.error,
+            'has_download': self.result_path is not None and self.state == SUCCEEDED,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+JobHandler = Callable[[Job], Awaitable[Optional[Dict[str, Any]]]]
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    """Register an async handler for a job kind"""
+    def register(handler: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+class SqliteJobStore:
+    """Job state shared between worker processes through a SQLite file"""
+
+    _FIELDS = ('job_id', 'kind', 'session_id', 'params', 'state', 'progress', 'message', 'result',
+               'error', 'result_path', 'created_at', 'started_at', 'finished_at')
+    _JSON_FIELDS = ('params', 'result')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " session_id TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " progress REAL NOT NULL,"
+            " message TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " result_path TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " owner TEXT NOT NULL,"
+            " heartbeat REAL NOT NULL,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, heartbeat)")
+
+    def _row_to_record(self, row) -> Dict[str, Any]:
+        record = dict(zip(self._FIELDS, row))
+        for name in self._JSON_FIELDS:
+            if record[name] is not None:
+                record[name] = json.loads(record[name])
+        return record
+
+    def save(self, job: Job, owner: str):
+        values = [getattr(job, name) for name in self._FIELDS]
+        for index, name in enumerate(self._FIELDS):
+            if name in self._JSON_FIELDS and values[index] is not None:
+                values[index] = json.dumps(values[index])
+        updates = ', '.join(f"{name} = excluded.{name}" for name in self._FIELDS[4:])
+        with self.lock:
+            self.conn.execute(
+                f"INSERT INTO jobs ({', '.join(self._FIELDS)}, owner, heartbeat)"
+                f" VALUES ({', '.join('?' * len(self._FIELDS))}, ?, ?)"
+                f" ON CONFLICT (job_id) DO UPDATE SET {updates}, heartbeat = excluded.heartbeat",
+                (*values, owner, time.time())
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(self._FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return Job.from_record(self._row_to_record(row)) if row else None
+
+    def list(self, session_id: str) -> List[Job]:
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self._FIELDS)} FROM jobs WHERE session_id = ? ORDER BY created_at",
+                (session_id,)
+            ).fetchall()
+        return [Job.from_record(self._row_to_record(row)) for row in rows]
+
+    def queued_count(self, session_id: str) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE session_id = ? AND state = ?", (session_id, QUEUED)
+            ).fetchone()[0]
+
+    def request_cancel(self, job_id: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND state IN (?, ?)",
+                (job_id, QUEUED, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def cancel_requests(self, owner: str) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job_id FROM jobs WHERE owner = ? AND cancel_requested = 1 AND state IN (?, ?)",
+                (owner, QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def fail_lost(self, owner: str, before: float) -> int:
+        """Fail unfinished jobs of other workers that stopped reporting before the given time"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ?"
+                " WHERE state IN (?, ?) AND owner != ? AND heartbeat < ?",
+                (FAILED, "The worker running this job stopped", time.time(), QUEUED, RUNNING, owner, before)
+            )
+        return cursor.rowcount
+
+    def expire(self, cutoff: float) -> List[str]:
+        """Delete finished jobs older than cutoff, returning their ids"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job_id FROM jobs WHERE finished_at < ? AND state IN (?, ?, ?)", (cutoff, *FINISHED_STATES)
+            ).fetchall()
+            self.conn.executemany("DELETE FROM jobs WHERE job_id = ?", rows)
+        return [row[0] for row in rows]
+
+    def drop_session(self, session_id: str) -> List[str]:
+        """Request cancellation of a session's unfinished jobs and delete its finished ones"""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE session_id = ? AND state IN (?, ?)",
+                (session_id, QUEUED, RUNNING)
+            )
+            rows = self.conn.execute(
+                "SELECT job_id FROM jobs WHERE session_id = ? AND state IN (?, ?, ?)",
+                (session_id, *FINISHED_STATES)
+            ).fetchall()
+            self.conn.executemany("DELETE FROM jobs WHERE job_id = ?", rows)
+        return [row[0] for row in rows]
+
+    def count_by_state(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class JobManager:
+    """Queue, worker pool and retention of background jobs"""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.worker_count = workers
+        self.jobs: Dict[str, Job] = {}
+        self.pending: Deque[Job] = deque()
+        self.running_per_session: Dict[str, int] = {}
+        self.condition: Optional[asyncio.Condition] = None
+        self.workers: List[asyncio.Task] = []
+        # Shared state for multi-worker deployments (JOB_STORE=sqlite)
+        self.store: Optional[SqliteJobStore] = None
+        # One thread for every store call: writes stay in order and off the event loop
+        self.store_executor: Optional[ThreadPoolExecutor] = None
+        self.owner = uuid.uuid4().hex
+        self.sync_task: Optional[asyncio.Task] = None
+        self.stopping = False
+
+    async def start(self):
+        self.condition = asyncio.Condition()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        if JOB_STORE == 'sqlite':
+            self.store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-store')
+            self.store = await self._store_call(SqliteJobStore, JOB_DB_PATH)
+            self.sync_task = asyncio.create_task(self._sync())
+            logger.info(f"Sharing job state through {JOB_DB_PATH}")
+        logger.info(f"Started {self.worker_count} job workers")
+
+    async def stop(self):
+        self.stopping = True
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+        while self.pending:
+            self._finish(self.pending.popleft(), CANCELLED)
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.store is not None:
+            # Runs after the final saves queued by _finish
+            await self._store_call(self.store.close)
+            self.store = None
+            self.store_executor.shutdown(wait=False)
+            self.store_executor = None
+
+    async def _store_call(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, func, *args)
+
+    def _save(self, job: Job):
+        """Queue a write of the job's state; the store thread applies writes in order"""
+        if self.store is not None:
+            self.store_executor.submit(self.store.save, job, self.owner).add_done_callback(
+                lambda future: self._saved(job, future)
+            )
+
+    @staticmethod
+    def _saved(job: Job, future: Future):
+        error = future.exception()
+        if error is not None:
+            logger.warning(f"Could not store the state of job {job.job_id}: {error}")
+
+    async def submit(self, kind: str, session_id: str, client: MoodleClient, params: Dict[str, Any]) -> Job:
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        await self.prune()
+
+        if self.store is not None:
+            queued = await self._store_call(self.store.queued_count, session_id)
+        else:
+            queued = sum(1 for job in self.pending if job.session_id == session_id)
+        if queued >= JOB_MAX_QUEUED_PER_SESSION:
+            raise JobLimitError(f"At most {JOB_MAX_QUEUED_PER_SESSION} queued jobs per session")
+
+        job = Job(kind, session_id, client, params)
+        self.jobs[job.job_id] = job
+        self.pending.append(job)
+        self._save(job)
+        await self._notify()
+        logger.info(f"Queued {kind} job {job.job_id}")
+        return job
+
+    async def get(self, job_id: str, session_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = await self._store_call(self.store.get, job_id)
+        if job is None or job.session_id != session_id:
+            return None
+        return job
+
+    async def list(self, session_id: str) -> List[Job]:
+        await self.prune()
+        if self.store is None:
+            return [job for job in self.jobs.values() if job.session_id == session_id]
+        # Jobs running here are more current than their stored copy
+        stored = await self._store_call(self.store.list, session_id)
+        return [self.jobs.get(job.job_id, job) for job in stored]
+
+    async def cancel(self, job: Job) -> bool:
+        if job.job_id not in self.jobs:
+            # Runs in another worker, which picks the request up on its next sync
+            if self.store is None:
+                return False
+            return await self._store_call(self.store.request_cancel, job.job_id)
+        if job.state == QUEUED:
+            self.pending.remove(job)
+            self._finish(job, CANCELLED)
+            return True
+        if job.state == RUNNING and job.task is not None:
+            job.task.cancel()
+            return True
+        return False
+
+    async def prune(self):
+        """Drop finished jobs (and their files) older than JOB_RESULT_TTL"""
+        cutoff = time.time() - JOB_RESULT_TTL
+        expired = [job.job_id for job in self.jobs.values()
+                   if job.state in FINISHED_STATES and job.finished_at and job.finished_at < cutoff]
+        if self.store is not None:
+            # Result files are in the shared JOB_DIR, so any worker can remove them
+            expired.extend(await self._store_call(self.store.expire, cutoff))
+        expired = set(expired)
+        for job_id in expired:
+            self.jobs.pop(job_id, None)
+        if expired:
+            await asyncio.to_thread(_remove_workdirs, expired)
+
+    async def drop_session(self, session_id: str):
+        """Cancel a session's unfinished jobs and drop its finished ones (and their files)"""
+        dropped = []
+        for job in [job for job in self.jobs.values() if job.session_id == session_id]:
+            if job.state in FINISHED_STATES:
+                dropped.append(self.jobs.pop(job.job_id).job_id)
+            else:
+                # Cancelled jobs leave no files and are pruned like any other
+                await self.cancel(job)
+        if self.store is not None:
+            dropped.extend(await self._store_call(self.store.drop_session, session_id))
+        if dropped:
+            await asyncio.to_thread(_remove_workdirs, set(dropped))
+
+    async def _sync(self):
+        """Publish progress of this worker's jobs, apply cancel requests, fail lost jobs"""
+        while True:
+            await asyncio.sleep(JOB_SYNC_INTERVAL)
+            try:
+                for job in list(self.jobs.values()):
+                    if job.state in (QUEUED, RUNNING):
+                        self._save(job)
+                for job_id in await self._store_call(self.store.cancel_requests, self.owner):
+                    job = self.jobs.get(job_id)
+                    if job is not None:
+                        await self.cancel(job)
+                lost = await self._store_call(self.store.fail_lost, self.owner, time.time() - JOB_LOST_AFTER)
+                if lost:
+                    logger.warning(f"Marked {lost} jobs of a stopped worker as failed")
+            except sqlite3.Error as e:
+                logger.warning(f"Could not sync job state: {e}")
+
+    async def _notify(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+    def _next_runnable(self) -> Optional[Job]:
+        for job in self.pending:
+            if self.running_per_session.get(job.session_id, 0) < JOB_MAX_PER_SESSION:
+                self.pending.remove(job)
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self.condition:
+                job = self._next_runnable()
+                while job is None:
+                    await self.condition.wait()
+                    job = self._next_runnable()
+                self.running_per_session[job.session_id] = self.running_per_session.get(job.session_id, 0) + 1
+
+            try:
+                await self._run(job)
+            finally:
+                remaining = self.running_per_session[job.session_id] - 1
+                if remaining:
+                    self.running_per_session[job.session_id] = remaining
+                else:
+                    del self.running_per_session[job.session_id]
+                await self._notify()
+
+    async def _run(self, job: Job):
+        job.state = RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        job.task = asyncio.create_task(JOB_HANDLERS[job.kind](job))
+        try:
+            job.result = await job.task
+            job.progress = 100.0
+            self._finish(job, SUCCEEDED)
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED)
+            # Re-raise only if the worker itself is being cancelled
+            if self.stopping or not job.task.cancelled():
+                raise
+        except Exception as e:
+            logger.error(f"Job {job.job_id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            self._finish(job, FAILED)
+        finally:
+            job.task = None
+
+    def _finish(self, job: Job, state: str):
+        job.state = state
+        job.finished_at = time.time()
+        if state != SUCCEEDED:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+            job.result_path = None
+        self._save(job)
+        logger.info(f"Job {job.job_id} ({job.kind}) {state}")
+
+    async def stats(self) -> Dict[str, Any]:
+        states: Dict[str, int] = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        stats: Dict[str, Any] = {'workers': self.worker_count, 'jobs': states}
+        if self.store is not None:
+            stats['all_workers'] = await self._store_call(self.store.count_by_state)
+        return stats
+
+
+job_manager = JobManager()
+on_session_end(job_manager.drop_session)
+
+
+def _remove_workdirs(job_ids):
+    for job_id in job_ids:
+        shutil.rmtree(os.path.join(JOB_DIR, job_id), ignore_errors=True)
+
+
+def _read_text(path: str) -> str:
+    """Text of a downloaded file, removing the file"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+    finally:
+        os.remove(path)
+
+
+@job_handler('collect_files')
+async def collect_course_files(job: Job) -> Dict[str, Any]:
+    """Download the (filtered) files of a course into one zip archive"""
+    course_id = job.params['course_id']
+    file_types = job.params.get('file_types')
+    entry = await get_course_entry(job.client, course_id)
+    files = entry.file_index.query(extensions=file_types or None, max_size=job.params.get('max_size'))
+
+    os.makedirs(job.workdir, exist_ok=True)
+    archive_path = os.path.join(job.workdir, f"course_{course_id}_files.zip")
+    part_path = os.path.join(job.workdir, 'download.part')
+    total_bytes = sum(file.filesize for file in files) or len(files)
+    done_bytes = 0
+    collected, skipped = [], []
+
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED) as archive:
+        used_names = set()
+        for file in files:
+            job.report(done_bytes, total_bytes, f"Downloading {file.filename}")
+            if not file.fileurl or file.filesize > MAX_FILE_SIZE:
+                skipped.append(file.filename)
+                done_bytes += file.filesize or 1
+                continue
+            try:
+                # Streamed to disk, then copied into the archive: never a whole file in memory
+                await job.client.download_to(file.fileurl, part_path, max_bytes=MAX_FILE_SIZE)
+            except Exception as e:
+                logger.warning(f"Job {job.job_id}: could not download {file.filename}: {e}")
+                skipped.append(file.filename)
+                done_bytes += file.filesize or 1
+                continue
+
+            name = f"{file.section_name or 'section'}/{file.filename}"
+            if name in used_names:
+                name = f"{file.section_name or 'section'}/{file.module_id}_{file.filename}"
+            used_names.add(name)
+            await asyncio.to_thread(archive.write, part_path, name)
+            os.remove(part_path)
+            collected.append(name)
+            done_bytes += file.filesize or 1
+
+    job.result_path = archive_path
+    job.report(1, 1, f"Collected {len(collected)} files")
+    return {
+        'course_id': course_id,
+        'files_count': len(collected),
+        'skipped': skipped,
+        'archive_bytes': os.path.getsize(archive_path),
+    }
+
+
+@job_handler('snapshot_course')
+async def snapshot_course(job: Job) -> Dict[str, Any]:
+    """Export a course snapshot as a background job"""
+    course_id = job.params['course_id']
+    job.report(0, 2, "Fetching course contents")
+    entry = await get_course_entry(job.client, course_id, refresh=job.params.get('refresh', False))
+    if not entry.contents:
+        raise Exception("Course contents not available")
+
+    job.report(1, 2, "Writing snapshot")
+    os.makedirs(job.workdir, exist_ok=True)
+    path = os.path.join(job.workdir, f"course_{course_id}.sqlite")
+    await asyncio.to_thread(
+        export_snapshot, path, job.client.base_url, course_id, job.client.token,
+        entry.contents, entry.file_index, job.params.get('include_text', False)
+    )
+    job.result_path = path
+    return {'course_id': course_id, 'sections': len(entry.contents), 'snapshot_bytes': os.path.getsize(path)}
+
+
+@job_handler('index_text')
+async def index_course_text(job: Job) -> Dict[str, Any]:
+    """Extract course text into the chunk store, skipping unchanged documents"""
+    course_id = job.params['course_id']
+    entry = await get_course_entry(job.client, course_id, refresh=job.params.get('refresh', False))
+    if not entry.contents:
+        raise Exception("Course contents not available")
+    store = await asyncio.to_thread(get_chunk_store, job.client.base_url)
+    os.makedirs(job.workdir, exist_ok=True)
+    part_path = os.path.join(job.workdir, 'download.part')
+
+    # (section_id, module_id, file_id, version, kind, text or file entry)
+    documents = []
+    for section in entry.contents:
+        text = html_to_text(section.get('summary'))
+        if text:
+            documents.append((section.get('id'), 0, 0, zlib.crc32(text.encode()), 'section_summary', text))
+        for module in section.get('modules') or []:
+            text = html_to_text(module.get('description'))
+            if text:
+                documents.append((section.get('id'), module.get('id'), 0, zlib.crc32(text.encode()),
+                                  'module_description', text))
+    for file in entry.file_index.query(extensions=TEXT_EXTENSIONS, max_size=MAX_FILE_SIZE):
+        if file.fileurl:
+            documents.append((file.section_id, file.module_id, file_key(file.fileurl), file.timemodified, 'file', file))
+
+    added_chunks = indexed = unchanged = failed = 0
+    for done, (section_id, module_id, file_id, version, kind, source) in enumerate(documents):
+        job.report(done, len(documents))
+        if await asyncio.to_thread(store.has_version, course_id, section_id, module_id, file_id, kind, version):
+            unchanged += 1
+            continue
+
+        if kind == 'file':
+            job.message = f"Extracting {source.filename}"
+            try:
+                await job.client.download_to(source.fileurl, part_path, max_bytes=MAX_FILE_SIZE)
+                text = await asyncio.to_thread(_read_text, part_path)
+            except Exception as e:
+                logger.warning(f"Job {job.job_id}: could not download {source.filename}: {e}")
+                failed += 1
+                continue
+            text = text.replace('\r\n', '\n')
+            if source.extension in ('html', 'htm'):
+                text = html_to_text(text)
+        else:
+            text = source
+
+        chunks = split_text(text)
+        added_chunks += await asyncio.to_thread(
+            store.append_document, course_id, section_id, module_id, file_id, version, kind, chunks
+        )
+        indexed += 1
+
+    compacted = await asyncio.to_thread(store.maybe_compact)
+    job.report(1, 1, f"Indexed {indexed} documents")
+    return {
+        'course_id': course_id,
+        'documents_indexed': indexed,
+        'documents_unchanged': unchanged,
+        'documents_failed': failed,
+        'chunks_added': added_chunks,
+        'chunks_compacted': compacted,
+    }
@@ -1,11 +1,185 @@
+import aiofiles
 import httpx
 import asyncio
-from typing import Dict, List, Optional, Any
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Any, Sequence, Tuple
 from urllib.parse import urljoin, urlparse
 import logging
 
+from ..middleware.deadline import DeadlineExceeded, remaining_time, upstream_timeout, within_deadline
+from ..middleware.profiling import profile_phase
+from ..utils.offload import decode_json
+from .cassette import build_transport
+
 logger = logging.getLogger(__name__)
 
+class MoodleAPIError(Exception):
+    """Error reported by the Moodle web service itself (not a transport failure)"""
+
+    def __init__(self, message: str, errorcode: Optional[str] = None):
+        super().__init__(f"Moodle API Error: {message}")
+        self.errorcode = errorcode
+
+
+# Connection pool shared by all MoodleClient calls, owned by the app lifespan
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+async def open_http_client() -> httpx.AsyncClient:
+    """Create the shared upstream connection pool"""
+    global _http_client
+    if _http_client is None:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv('MOODLE_MAX_CONNECTIONS', 100)),
+            max_keepalive_connections=int(os.getenv('MOODLE_MAX_KEEPALIVE', 20)),
+            keepalive_expiry=30.0
+        )
+        # MOODLE_RECORD / MOODLE_REPLAY swap in a recording or replaying transport
+        _http_client = httpx.AsyncClient(timeout=30.0, limits=limits, transport=build_transport(limits))
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared upstream connection pool"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+@asynccontextmanager
+async def http_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Yield the shared client, or a short-lived one outside the app lifespan"""
+    if _http_client is not None:
+        yield _http_client
+    else:
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            yield client
+
+
+# Read size for streamed file downloads
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+# Hedged reads: a read still running after the observed p95 latency of its host
+# and function gets one backup request; hedges are capped at HEDGE_BUDGET_RATIO
+# of reads (token bucket, bursts up to HEDGE_BUDGET_BURST)
+HEDGE_ENABLED = os.getenv('MOODLE_HEDGE_ENABLED', 'true').lower() == 'true'
+HEDGE_BUDGET_RATIO = float(os.getenv('MOODLE_HEDGE_BUDGET_RATIO', 0.05))
+HEDGE_BUDGET_BURST = float(os.getenv('MOODLE_HEDGE_BUDGET_BURST', 10))
+HEDGE_MIN_SAMPLES = int(os.getenv('MOODLE_HEDGE_MIN_SAMPLES', 20))
+HEDGE_MIN_DELAY = float(os.getenv('MOODLE_HEDGE_MIN_DELAY', 0.05))
+LATENCY_WINDOW = 200
+LATENCY_MAX_TRACKERS = 1000
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies for one host and function"""
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._p95: Optional[float] = None
+        self._stale = 0
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+        self._stale += 1
+
+    def p95(self) -> Optional[float]:
+        """p95 latency, or None until HEDGE_MIN_SAMPLES calls have been seen"""
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        # Re-sorting the window on every call is wasteful; refresh every 10 samples
+        if self._p95 is None or self._stale >= 10:
+            ordered = sorted(self.samples)
+            self._p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            self._stale = 0
+        return self._p95
+
+
+class HedgeBudget:
+    """Token bucket: every read earns HEDGE_BUDGET_RATIO tokens, a hedge costs one"""
+
+    def __init__(self):
+        self.tokens = HEDGE_BUDGET_BURST
+
+    def earn(self):
+        self.tokens = min(HEDGE_BUDGET_BURST, self.tokens + HEDGE_BUDGET_RATIO)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+_latency_trackers: "OrderedDict[Tuple[str, str], LatencyTracker]" = OrderedDict()
+_hedge_budget = HedgeBudget()
+_hedge_counters = {'reads': 0, 'hedged': 0, 'backup_won': 0, 'budget_denied': 0}
+
+
+def _latency_tracker(host: str, function: str) -> LatencyTracker:
+    key = (host, function)
+    tracker = _latency_trackers.get(key)
+    if tracker is None:
+        tracker = _latency_trackers[key] = LatencyTracker()
+        while len(_latency_trackers) > LATENCY_MAX_TRACKERS:
+            _latency_trackers.popitem(last=False)
+    return tracker
+
+
+def is_idempotent_read(function: str) -> bool:
+    """Moodle names its read-only web-service functions *_get_*"""
+    return '_get_' in function
+
+
+def get_hedge_stats() -> Dict[str, Any]:
+    return {
+        'enabled': HEDGE_ENABLED,
+        'budget_tokens': round(_hedge_budget.tokens, 2),
+        **_hedge_counters,
+    }
+
+
+async def _first_success(tasks: Sequence["asyncio.Task[httpx.Response]"]) -> "asyncio.Task[httpx.Response]":
+    """The first task to succeed, or the first to fail if none does"""
+    pending = set(tasks)
+    failed = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                return task
+            failed = failed or task
+    return failed
+
+
+def encode_params(params: Dict[str, Any], prefix: str = '') -> Dict[str, str]:
+    """
+    Flatten nested parameters into Moodle's PHP-style form fields
+
+    ``{'courseids': [3, 5], 'options': [{'name': 'x', 'value': True}]}`` becomes
+    ``courseids[0]=3, courseids[1]=5, options[0][name]=x, options[0][value]=1``.
+    None values are left out.
+    """
+    fields: Dict[str, str] = {}
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            fields.update(encode_params(value, name))
+        elif isinstance(value, (list, tuple)):
+            fields.update(encode_params(dict(enumerate(value)), name))
+        elif isinstance(value, bool):
+            fields[name] = '1' if value else '0'
+        else:
+            fields[name] = str(value)
+    return fields
+
 
 class MoodleClient:
     """Dynamic Moodle client that works with any Moodle instance"""
@@ -19,17 +193,17 @@ class MoodleClient:
     async def validate_moodle_instance(moodle_url: str) -> bool:
         """Check if the URL is a valid Moodle instance"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
+            async with http_client() as client:
                 # Try to access the login token endpoint
                 token_url = f"{moodle_url.rstrip('/')}/login/token.php"
-                response = await client.get(token_url)
+                response = await client.get(token_url, timeout=upstream_timeout(10.0))
                 
                 # Moodle should return some response (even error) for token endpoint
                 if response.status_code == 200:
                     return True
                     
                 # Also try the main page to see if it's Moodle
-                main_response = await client.get(moodle_url)
+                main_response = await client.get(moodle_url, timeout=upstream_timeout(10.0))
                 content = main_response.text.lower()
                 
                 return 'moodle' in content or 'moodleform' in content
@@ -44,14 +218,14 @@ class MoodleClient:
         try:
             token_url = f"{moodle_url.rstrip('/')}/login/token.php"
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with http_client() as client:
                 data = {
                     'username': username,
                     'password': password,
                     'service': 'moodle_mobile_app'
                 }
                 
-                response = await client.post(token_url, data=data)
+                response = await client.post(token_url, data=data, timeout=upstream_timeout(30.0))
                 response.raise_for_status()
                 
                 result = response.json()
@@ -93,24 +267,70 @@ class MoodleClient:
                 'errorcode': 'connection_error'
             }
     
+    async def _attempt(self, client: httpx.AsyncClient, data: Dict[str, str]) -> httpx.Response:
+        response = await within_deadline(
+            client.post(self.webservice_url, data=data, timeout=upstream_timeout(30.0))
+        )
+        response.raise_for_status()
+        return response
+    
+    async def _post(self, client: httpx.AsyncClient, function: str, data: Dict[str, str]) -> httpx.Response:
+        """POST to the web service; slow idempotent reads get one hedged backup request"""
+        if not HEDGE_ENABLED or not is_idempotent_read(function):
+            return await self._attempt(client, data)
+        
+        tracker = _latency_tracker(self.base_url, function)
+        _hedge_counters['reads'] += 1
+        _hedge_budget.earn()
+        p95 = tracker.p95()
+        
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(self._attempt(client, data))]
+        try:
+            if p95 is not None:
+                delay = max(p95, HEDGE_MIN_DELAY)
+                remaining = remaining_time()
+                # No point in a backup that could not answer before the deadline
+                if remaining is None or delay < remaining:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done:
+                        if _hedge_budget.try_spend():
+                            _hedge_counters['hedged'] += 1
+                            tasks.append(asyncio.ensure_future(self._attempt(client, data)))
+                        else:
+                            _hedge_counters['budget_denied'] += 1
+            winner = await _first_success(tasks)
+            response = winner.result()
+            if winner is not tasks[0]:
+                _hedge_counters['backup_won'] += 1
+            # Time until the first answer; when the backup won this is a lower bound for the primary
+            tracker.observe(time.perf_counter() - start)
+            return response
+        finally:
+            # Cancel the loser (or everything, if we were cancelled ourselves)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
     async def _make_request(self, function: str, **params) -> Dict[str, Any]:
         """Make a request to Moodle Web Service API"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with http_client() as client:
                 data = {
                     'wstoken': self.token,
                     'wsfunction': function,
                     'moodlewsrestformat': 'json',
-                    **params
+                    **encode_params(params)
                 }
                 
-                response = await client.post(self.webservice_url, data=data)
-                response.raise_for_status()
+                with profile_phase('upstream'):
+                    response = await self._post(client, function, data)
                 
-                result = response.json()
+                with profile_phase('decode'):
+                    result = await decode_json(response.content)
                 
                 if isinstance(result, dict) and 'exception' in result:
-                    raise Exception(f"Moodle API Error: {result.get('message', 'Unknown error')}")
+                    raise MoodleAPIError(result.get('message', 'Unknown error'), result.get('errorcode'))
                 
                 return result
                 
@@ -122,12 +342,18 @@ class MoodleClient:
         """Get current user information"""
         return await self._make_request('core_webservice_get_site_info')
     
-    async def get_user_courses(self) -> List[Dict[str, Any]]:
-        """Get courses enrolled by current user"""
+    async def get_user_courses(self, userid: Optional[int] = None, raise_errors: bool = False) -> List[Dict[str, Any]]:
+        """
+        Get courses enrolled by current user (pass userid to skip the site info lookup)
+
+        Failures are logged and returned as [] unless raise_errors is set, for
+        callers that must not mistake an outage for having no courses.
+        """
         try:
-            # First get user info to get userid
-            site_info = await self.get_user_info()
-            userid = site_info.get('userid')
+            if not userid:
+                # First get user info to get userid
+                site_info = await self.get_user_info()
+                userid = site_info.get('userid')
             
             if not userid:
                 raise Exception("Could not get user ID")
@@ -136,20 +362,61 @@ class MoodleClient:
             result = await self._make_request('core_enrol_get_users_courses', userid=userid)
             return result if isinstance(result, list) else []
             
+        except DeadlineExceeded:
+            # Out of time is not "no courses": let the route answer 504
+            raise
         except Exception as e:
             logger.error(f"Failed to get user courses: {e}")
+            if raise_errors:
+                raise
             return []
     
     async def get_course_contents(self, course_id: int) -> List[Dict[str, Any]]:
-        """Get contents of a specific course"""
+        """
+        Get contents of a specific course
+
+        Returns [] when Moodle refuses the call (no access, unknown course);
+        transport failures and an expired request deadline are raised, so an
+        outage is never mistaken for an empty course.
+        """
         try:
             result = await self._make_request('core_course_get_contents', courseid=course_id)
             return result if isinstance(result, list) else []
             
-        except Exception as e:
+        except MoodleAPIError as e:
             logger.error(f"Failed to get course contents for course {course_id}: {e}")
             return []
     
+    async def get_assignments(self, course_ids: Sequence[int]) -> Dict[str, Any]:
+        """Get the assignments of several courses in one call (raises on failure)"""
+        return await self._make_request('mod_assign_get_assignments', courseids=list(course_ids))
+    
+    async def get_quizzes(self, course_ids: Sequence[int]) -> Dict[str, Any]:
+        """Get the quizzes of several courses in one call (raises on failure)"""
+        return await self._make_request('mod_quiz_get_quizzes_by_courses', courseids=list(course_ids))
+    
+    async def get_action_events_by_timesort(
+        self,
+        timesort_from: Optional[int] = None,
+        timesort_to: Optional[int] = None,
+        after_event_id: Optional[int] = None,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """Get one page of the user's calendar action events ordered by time (raises on failure)"""
+        result = await self._make_request(
+            'core_calendar_get_action_events_by_timesort',
+            timesortfrom=timesort_from,
+            timesortto=timesort_to,
+            aftereventid=after_event_id,
+            limitnum=limit
+        )
+        return result if isinstance(result, dict) else {'events': []}
+    
+    async def get_course_updates_since(self, course_id: int, since: int) -> Dict[str, Any]:
+        """Get module updates in a course since a Unix timestamp (raises on failure)"""
+        result = await self._make_request('core_course_get_updates_since', courseid=course_id, since=since)
+        return result if isinstance(result, dict) else {'instances': [], 'warnings': []}
+    
     async def get_course_by_field(self, field: str = 'id', value: Any = None) -> List[Dict[str, Any]]:
         """Get course information by field"""
         try:
@@ -164,22 +431,57 @@ class MoodleClient:
             
             return result if isinstance(result, list) else []
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Failed to get course by {field}={value}: {e}")
             return []
     
+    def _file_download_url(self, file_url: str) -> str:
+        # Add token to file URL
+        separator = '&' if '?' in file_url else '?'
+        return f"{file_url}{separator}token={self.token}"
+    
     async def download_file(self, file_url: str) -> bytes:
-        """Download a file from Moodle"""
+        """Download a file from Moodle into memory (use download_to for large files)"""
         try:
-            # Add token to file URL
-            separator = '&' if '?' in file_url else '?'
-            download_url = f"{file_url}{separator}token={self.token}"
-            
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.get(download_url)
+            async with http_client() as client:
+                response = await within_deadline(
+                    client.get(self._file_download_url(file_url), timeout=upstream_timeout(60.0))
+                )
                 response.raise_for_status()
                 return response.content
                 
         except Exception as e:
             logger.error(f"Failed to download file {file_url}: {e}")
+            raise
+    
+    async def download_to(self, file_url: str, path: str, max_bytes: Optional[int] = None) -> int:
+        """
+        Stream a file from Moodle to path, returning its size
+
+        Only one chunk is held in memory at a time. Files over max_bytes are
+        abandoned (ValueError); a partial file is removed on any failure.
+        """
+        async def stream(client: httpx.AsyncClient) -> int:
+            size = 0
+            request = client.stream('GET', self._file_download_url(file_url), timeout=upstream_timeout(60.0))
+            async with request as response:
+                response.raise_for_status()
+                async with aiofiles.open(path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if max_bytes is not None and size > max_bytes:
+                            raise ValueError(f"File is larger than {max_bytes} bytes")
+                        await f.write(chunk)
+            return size
+        
+        try:
+            async with http_client() as client:
+                return await within_deadline(stream(client))
+        except BaseException as e:
+            if os.path.exists(path):
+                os.remove(path)
+            if isinstance(e, Exception):
+                logger.error(f"Failed to download file {file_url}: {e}")
             raise
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Compact offline snapshots of a course.
+
+A snapshot is a single SQLite file holding:
+
+- meta: format version, Moodle URL, course ID, token fingerprint, creation time
+- sections: one zlib-compressed JSON blob per section, in course order
+- files: the course file index, queryable without decoding any section
+- texts (optional): plain text extracted from section summaries and module descriptions
+
+Snapshots written to SNAPSHOT_DIR are registered at startup and seed the
+course cache on the first request for that course and user, instead of
+re-fetching from Moodle (opened and decoded in a worker thread); files older than SNAPSHOT_MAX_AGE are deleted at
+startup and after each export. They are keyed by a SHA-256 fingerprint of the
+token, never the token itself, so a user only ever sees their own view.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ..utils.helpers import html_to_text
+from .file_index import FileEntry, FileIndex
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '')
+# Snapshots older than this are not used to seed the cache and are removed from SNAPSHOT_DIR
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', 24 * 3600))
+SNAPSHOT_MEDIA_TYPE = 'application/vnd.sqlite3'
+
+FILE_COLUMNS = (
+    'filename', 'fileurl', 'filesize', 'mimetype', 'timemodified', 'extension',
+    'section_id', 'section_name', 'module_id', 'module_name',
+)
+
+SeedKey = Tuple[str, int, str]
+
+
+def token_fingerprint(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def snapshot_filename(base_url: str, course_id: int, token: str) -> str:
+    host = hashlib.sha1(base_url.encode()).hexdigest()[:12]
+    return f"course_{host}_{course_id}_{token_fingerprint(token)[:16]}.sqlite"
+
+
+def _extract_texts(contents: List[Dict[str, Any]]) -> Iterator[Tuple[Any, Any, str, str]]:
+    for section in contents:
+        text = html_to_text(section.get('summary'))
+        if text:
+            yield section.get('id'), None, 'section_summary', text
+        for module in section.get('modules') or []:
+            text = html_to_text(module.get('description'))
+            if text:
+                yield section.get('id'), module.get('id'), 'module_description', text
+
+
+def export_snapshot(
+    path: str,
+    base_url: str,
+    course_id: int,
+    token: str,
+    contents: List[Dict[str, Any]],
+    file_index: FileIndex,
+    include_text: bool = False
+):
+    """Write a course snapshot to path (atomically replaced)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.sqlite.tmp', dir=directory)
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(
+                "PRAGMA journal_mode=OFF;"
+                "PRAGMA page_size=4096;"
+                "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+                "CREATE TABLE sections (position INTEGER PRIMARY KEY, section_id INTEGER, name TEXT, data BLOB NOT NULL);"
+                f"CREATE TABLE files (position INTEGER PRIMARY KEY, {', '.join(FILE_COLUMNS)});"
+                "CREATE INDEX files_extension ON files (extension);"
+                "CREATE TABLE texts (section_id INTEGER, module_id INTEGER, kind TEXT, text TEXT NOT NULL);"
+            )
+            meta = {
+                'format_version': SNAPSHOT_FORMAT_VERSION,
+                'moodle_url': base_url,
+                'course_id': course_id,
+                'token_sha256': token_fingerprint(token),
+                'created_at': time.time(),
+                'section_count': len(contents),
+                'file_count': len(file_index),
+                'has_text': include_text,
+            }
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [(key, json.dumps(value)) for key, value in meta.items()])
+            conn.executemany(
+                "INSERT INTO sections VALUES (?, ?, ?, ?)",
+                (
+                    (position, section.get('id'), section.get('name'),
+                     zlib.compress(json.dumps(section, separators=(',', ':')).encode(), 6))
+                    for position, section in enumerate(contents)
+                )
+            )
+            conn.executemany(
+                f"INSERT INTO files VALUES (?, {', '.join('?' for _ in FILE_COLUMNS)})",
+                (
+                    (entry.position, *(getattr(entry, column) for column in FILE_COLUMNS))
+                    for entry in file_index.entries
+                )
+            )
+            if include_text:
+                conn.executemany("INSERT INTO texts VALUES (?, ?, ?, ?)", _extract_texts(contents))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CourseSnapshot:
+    """Read-only view of a snapshot file
+
+    Reads block on SQLite and zlib, so callers on the event loop run them in
+    a thread. No connection is held between reads: seeded entries can sit in the course
+    cache for a long time, and a connection per read is cheap for a local file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            self.meta = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+        if self.meta.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format in {path}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @property
+    def seed_key(self) -> SeedKey:
+        return (self.meta['moodle_url'], self.meta['course_id'], self.meta['token_sha256'])
+
+    def age(self) -> float:
+        return time.time() - self.meta['created_at']
+
+    def contents(self) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            return [
+                json.loads(zlib.decompress(row[0]))
+                for row in conn.execute("SELECT data FROM sections ORDER BY position")
+            ]
+
+    def file_index(self) -> FileIndex:
+        with self._connect() as conn:
+            rows = list(conn.execute(f"SELECT position, {', '.join(FILE_COLUMNS)} FROM files ORDER BY position"))
+        return FileIndex([
+            FileEntry.from_dict(position, dict(zip(FILE_COLUMNS, values)))
+            for position, *values in rows
+        ])
+
+    def texts(self) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            return [
+                {'section_id': section_id, 'module_id': module_id, 'kind': kind, 'text': text}
+                for section_id, module_id, kind, text in conn.execute("SELECT * FROM texts")
+            ]
+
+
+# Snapshot files available to seed the course cache, by (moodle_url, course_id, token fingerprint)
+SNAPSHOT_SEEDS: Dict[SeedKey, str] = {}
+
+
+def prune_snapshots(directory: str = SNAPSHOT_DIR, max_age: float = SNAPSHOT_MAX_AGE) -> int:
+    """Delete snapshot files (and leftover temp files) older than max_age"""
+    if not directory or not os.path.isdir(directory):
+        return 0
+
+    removed = 0
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        if not name.endswith(('.sqlite', '.sqlite.tmp')):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            # Snapshots are written once and atomically replaced, so mtime is their creation time
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not prune snapshot {path}: {e}")
+
+    if removed:
+        logger.info(f"Removed {removed} expired course snapshots from {directory}")
+    return removed
+
+
+def register_snapshot_seeds(directory: str = SNAPSHOT_DIR) -> int:
+    """Prune expired snapshots, then register every remaining one in directory as a cache seed"""
+    if not directory or not os.path.isdir(directory):
+        return 0
+
+    prune_snapshots(directory)
+    registered = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.sqlite'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            snapshot = CourseSnapshot(path)
+        except (sqlite3.Error, ValueError, KeyError) as e:
+            logger.warning(f"Skipping unreadable snapshot {path}: {e}")
+            continue
+        if snapshot.age() <= SNAPSHOT_MAX_AGE:
+            SNAPSHOT_SEEDS[snapshot.seed_key] = path
+            registered += 1
+
+    logger.info(f"Registered {registered} course snapshots from {directory}")
+    return registered
+
+
+def take_snapshot_seed(base_url: str, course_id: int, token: str) -> Optional[CourseSnapshot]:
+    """Open and consume the seed snapshot for a user's view of a course, if any"""
+    path = SNAPSHOT_SEEDS.pop((base_url, course_id, token_fingerprint(token)), None)
+    if not path:
+        return None
+    try:
+        snapshot = CourseSnapshot(path)
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        logger.warning(f"Could not open snapshot {path}: {e}")
+        return None
+    if snapshot.age() > SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot
@@ -1,13 +1,259 @@
+import asyncio
 import uuid
 import hashlib
+import html
+import inspect
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 import logging
 
 logger = logging.getLogger(__name__)
 
-# In-memory session storage (for production, use Redis or database)
-USER_SESSIONS: Dict[str, Dict[str, Any]] = {}
+SESSION_LIFETIME = timedelta(hours=24)
+# How often last_accessed is written back to a shared store
+SESSION_TOUCH_INTERVAL = timedelta(seconds=30)
+# Limits on live sessions; the least recently used ones are evicted first
+MAX_SESSIONS_PER_USER = int(os.getenv('MAX_SESSIONS_PER_USER', 5))
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', 10000))
+# Reuse the existing session when the same user logs in again with the same token.
+# Off by default: Moodle issues one token per user and service, so with reuse every
+# device of a user shares one session and logging out on one logs out all of them.
+SESSION_REUSE = os.getenv('SESSION_REUSE', 'false').lower() == 'true'
+
+# In-memory session storage in least-recently-used order (for production, use Redis or database)
+USER_SESSIONS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# (moodle host, userid) -> that user's session IDs in least-recently-used order
+USER_SESSION_INDEX: Dict[str, "OrderedDict[str, None]"] = {}
+
+
+SessionHook = Callable[[str], Union[None, Awaitable[None]]]
+# Called with the ID of every session that ends here (logout, eviction, expiry)
+SESSION_END_HOOKS: List[SessionHook] = []
+
+
+def on_session_end(hook: SessionHook) -> SessionHook:
+    """Register a hook that drops per-session state when a session ends"""
+    SESSION_END_HOOKS.append(hook)
+    return hook
+
+
+async def _session_ended(session_ids: List[str]):
+    for session_id in session_ids:
+        for hook in SESSION_END_HOOKS:
+            try:
+                result = hook(session_id)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"Cleanup of session {session_id} failed in {hook.__qualname__}: {e}")
+
+
+def session_user_key(moodle_url: str, user_info: Dict[str, Any]) -> Optional[str]:
+    """Key identifying a Moodle user across sessions, if the user ID is known"""
+    userid = user_info.get('userid')
+    if userid is None:
+        return None
+    return f"{moodle_url.rstrip('/').lower()}|{userid}"
+
+
+class MemorySessionStore:
+    """Sessions kept in this process only (single worker / development)"""
+
+    def __init__(self, sessions: "OrderedDict[str, Dict[str, Any]]", index: Dict[str, "OrderedDict[str, None]"]):
+        self.sessions = sessions
+        self.index = index
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.sessions.get(session_id)
+
+    def put(self, session: Dict[str, Any]):
+        session_id = session['session_id']
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        user_key = session.get('user_key')
+        if user_key:
+            user_sessions = self.index.setdefault(user_key, OrderedDict())
+            user_sessions[session_id] = None
+            user_sessions.move_to_end(session_id)
+
+    def touch(self, session: Dict[str, Any], now: datetime):
+        session['last_accessed'] = now
+        session_id = session['session_id']
+        self.sessions.move_to_end(session_id)
+        user_sessions = self.index.get(session.get('user_key'))
+        if user_sessions is not None and session_id in user_sessions:
+            user_sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        user_key = session.get('user_key')
+        user_sessions = self.index.get(user_key)
+        if user_sessions is not None:
+            user_sessions.pop(session_id, None)
+            if not user_sessions:
+                del self.index[user_key]
+        return True
+
+    def user_sessions(self, user_key: str) -> List[Dict[str, Any]]:
+        """Sessions of one user, least recently used first"""
+        return [self.sessions[sid] for sid in self.index.get(user_key, ())]
+
+    def least_recently_used(self, limit: int) -> List[str]:
+        ids = []
+        for session_id in self.sessions:
+            if len(ids) >= limit:
+                break
+            ids.append(session_id)
+        return ids
+
+    def expired(self, cutoff: datetime) -> List[str]:
+        return [sid for sid, session in self.sessions.items() if session['created_at'] < cutoff]
+
+    def count(self) -> int:
+        return len(self.sessions)
+
+
+class SqliteSessionStore:
+    """Sessions shared between worker processes through a SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " moodle_url TEXT NOT NULL,"
+            " token TEXT NOT NULL,"
+            " user_info TEXT NOT NULL,"
+            " created_at TEXT NOT NULL,"
+            " last_accessed TEXT NOT NULL,"
+            " user_key TEXT)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")]
+        if 'user_key' not in columns:
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN user_key TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (last_accessed)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_key, last_accessed)")
+
+    _COLUMNS = "session_id, moodle_url, token, user_info, created_at, last_accessed, user_key"
+
+    @staticmethod
+    def _row_to_session(row) -> Dict[str, Any]:
+        return {
+            'session_id': row[0],
+            'moodle_url': row[1],
+            'token': row[2],
+            'user_info': json.loads(row[3]),
+            'created_at': datetime.fromisoformat(row[4]),
+            'last_accessed': datetime.fromisoformat(row[5]),
+            'user_key': row[6],
+        }
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {self._COLUMNS} FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        return self._row_to_session(row) if row else None
+
+    def put(self, session: Dict[str, Any]):
+        with self.lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO sessions ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    session['session_id'],
+                    session['moodle_url'],
+                    session['token'],
+                    json.dumps(session['user_info']),
+                    session['created_at'].isoformat(),
+                    session['last_accessed'].isoformat(),
+                    session.get('user_key'),
+                )
+            )
+
+    def touch(self, session: Dict[str, Any], now: datetime):
+        # Avoid a write on every request; last_accessed is informational
+        if now - session['last_accessed'] < SESSION_TOUCH_INTERVAL:
+            return
+        session['last_accessed'] = now
+        with self.lock:
+            self.conn.execute(
+                "UPDATE sessions SET last_accessed = ? WHERE session_id = ?",
+                (now.isoformat(), session['session_id'])
+            )
+
+    def delete(self, session_id: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def user_sessions(self, user_key: str) -> List[Dict[str, Any]]:
+        """Sessions of one user, least recently used first"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {self._COLUMNS} FROM sessions WHERE user_key = ? ORDER BY last_accessed",
+                (user_key,)
+            ).fetchall()
+        return [self._row_to_session(row) for row in rows]
+
+    def least_recently_used(self, limit: int) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT session_id FROM sessions ORDER BY last_accessed LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def expired(self, cutoff: datetime) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT session_id FROM sessions WHERE created_at < ?", (cutoff.isoformat(),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+_session_store = None
+
+
+def get_session_store():
+    """Get the configured session store (SESSION_STORE=memory|sqlite)"""
+    global _session_store
+    if _session_store is None:
+        backend = os.getenv('SESSION_STORE', 'memory').lower()
+        if backend == 'sqlite':
+            path = os.getenv('SESSION_DB_PATH', 'sessions.db')
+            _session_store = SqliteSessionStore(path)
+            logger.info(f"Using SQLite session store at {path}")
+        else:
+            _session_store = MemorySessionStore(USER_SESSIONS, USER_SESSION_INDEX)
+    return _session_store
+
+
+async def _in_store_thread(func, *args, **kwargs):
+    """Run a session store operation, off the event loop when the store blocks
+
+    SQLite calls can wait up to the busy timeout for a writer in another
+    worker process; the in-memory store is only ever touched from the loop.
+    """
+    if isinstance(get_session_store(), SqliteSessionStore):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return func(*args, **kwargs)
 
 
 def generate_session_id() -> str:
@@ -15,73 +261,145 @@ def generate_session_id() -> str:
     return str(uuid.uuid4())
 
 
-def create_user_session(moodle_url: str, token: str, user_info: Dict[str, Any]) -> str:
-    """Create a new user session"""
+def _evict_sessions(store, session_ids: List[str], reason: str) -> List[str]:
+    evicted = []
+    for session_id in session_ids:
+        if store.delete(session_id):
+            logger.info(f"Evicted session {session_id} ({reason})")
+            evicted.append(session_id)
+    return evicted
+
+
+async def create_user_session(moodle_url: str, token: str, user_info: Dict[str, Any]) -> str:
+    """
+    Create a user session, or reuse the user's existing one
+
+    Sessions are indexed by (Moodle host, userid). Every login gets its own
+    session unless SESSION_REUSE is on, in which case a repeated login with
+    the same token reuses the live one. The user's least recently used
+    sessions beyond MAX_SESSIONS_PER_USER are evicted, as are the oldest
+    sessions globally beyond MAX_SESSIONS, together with their cached state.
+    """
+    session_id, evicted = await _in_store_thread(_create_user_session, moodle_url, token, user_info)
+    await _session_ended(evicted)
+    return session_id
+
+
+def _create_user_session(moodle_url: str, token: str, user_info: Dict[str, Any]) -> Tuple[str, List[str]]:
+    store = get_session_store()
+    user_key = session_user_key(moodle_url, user_info)
+    now = datetime.utcnow()
+
+    user_sessions = store.user_sessions(user_key) if user_key else []
+
+    if SESSION_REUSE:
+        for session in reversed(user_sessions):
+            if session['token'] == token and now - session['created_at'] <= SESSION_LIFETIME:
+                session['user_info'] = user_info
+                session['last_accessed'] = now
+                store.put(session)
+                logger.info(f"Reused session {session['session_id']} for user {user_info.get('username')}")
+                return session['session_id'], []
+
     session_id = generate_session_id()
-    
+
     session_data = {
         'session_id': session_id,
         'moodle_url': moodle_url,
         'token': token,
         'user_info': user_info,
-        'created_at': datetime.utcnow(),
-        'last_accessed': datetime.utcnow()
+        'created_at': now,
+        'last_accessed': now,
+        'user_key': user_key
     }
-    
-    USER_SESSIONS[session_id] = session_data
+
+    # Make room before inserting so the new session is never the one evicted
+    evicted = []
+    if user_key and len(user_sessions) >= MAX_SESSIONS_PER_USER:
+        excess = len(user_sessions) - MAX_SESSIONS_PER_USER + 1
+        evicted += _evict_sessions(store, [s['session_id'] for s in user_sessions[:excess]], "per-user limit")
+
+    total = store.count()
+    if total >= MAX_SESSIONS:
+        evicted += _evict_sessions(store, store.least_recently_used(total - MAX_SESSIONS + 1), "global limit")
+
+    store.put(session_data)
     logger.info(f"Created session {session_id} for user {user_info.get('username')}")
-    
-    return session_id
+
+    return session_id, evicted
 
 
-def get_user_session(session_id: str) -> Optional[Dict[str, Any]]:
+async def get_user_session(session_id: str) -> Optional[Dict[str, Any]]:
     """Get user session by session ID"""
-    if session_id in USER_SESSIONS:
-        session = USER_SESSIONS[session_id]
-        
-        # Update last accessed time
-        session['last_accessed'] = datetime.utcnow()
-        
+    session, expired = await _in_store_thread(_get_user_session, session_id)
+    if expired:
+        await _session_ended([session_id])
+    return session
+
+
+def _get_user_session(session_id: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """The live session, and whether it was found expired (and deleted)"""
+    store = get_session_store()
+    session = store.get(session_id)
+    if session:
+        now = datetime.utcnow()
+
         # Check if session is expired (24 hours)
-        if datetime.utcnow() - session['created_at'] > timedelta(hours=24):
-            del USER_SESSIONS[session_id]
-            return None
-            
-        return session
-    
-    return None
+        if now - session['created_at'] > SESSION_LIFETIME:
+            return None, store.delete(session_id)
 
+        # Update last accessed time
+        store.touch(session, now)
 
-def delete_user_session(session_id: str) -> bool:
+        return session, False
+
+    return None, False
+
+
+async def delete_user_session(session_id: str) -> bool:
     """Delete a user session"""
-    if session_id in USER_SESSIONS:
-        del USER_SESSIONS[session_id]
+    if await _in_store_thread(get_session_store().delete, session_id):
         logger.info(f"Deleted session {session_id}")
+        await _session_ended([session_id])
         return True
     return False
 
 
-def cleanup_expired_sessions():
+async def cleanup_expired_sessions() -> int:
     """Clean up expired sessions (call periodically)"""
+    expired_sessions = await _in_store_thread(_cleanup_expired_sessions)
+    await _session_ended(expired_sessions)
+    return len(expired_sessions)
+
+
+def _cleanup_expired_sessions() -> List[str]:
+    store = get_session_store()
     expired_sessions = []
-    current_time = datetime.utcnow()
-    
-    for session_id, session_data in USER_SESSIONS.items():
-        if current_time - session_data['created_at'] > timedelta(hours=24):
+
+    for session_id in store.expired(datetime.utcnow() - SESSION_LIFETIME):
+        if store.delete(session_id):
+            logger.info(f"Cleaned up expired session {session_id}")
             expired_sessions.append(session_id)
-    
-    for session_id in expired_sessions:
-        del USER_SESSIONS[session_id]
-        logger.info(f"Cleaned up expired session {session_id}")
-    
-    return len(expired_sessions)
+
+    return expired_sessions
 
 
-def get_active_sessions_count() -> int:
+async def get_active_sessions_count() -> int:
     """Get count of active sessions"""
-    return len(USER_SESSIONS)
+    return await _in_store_thread(get_session_store().count)
 
 
-def validate_session_token(session_id: str) -> bool:
+async def validate_session_token(session_id: str) -> bool:
     """Validate if session exists and is active"""
-    return get_user_session(session_id) is not None
\ No newline at end of file
+    return await get_user_session(session_id) is not None
+
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def html_to_text(value: Optional[str]) -> str:
+    """Plain text of a Moodle HTML field (summaries, descriptions)"""
+    if not value:
+        return ''
+    return _SPACE_RE.sub(' ', html.unescape(_TAG_RE.sub(' ', value))).strip()
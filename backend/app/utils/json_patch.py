@@ -0,0 +1,99 @@
+"""
+JSON Patch (RFC 6902) generation for course contents.
+
+diff(old, new) returns the operations that turn ``old`` into ``new``. Lists of
+objects with an ``id`` (sections, modules, files with ids) are matched by id,
+so inserting or reordering a module produces one ``add`` or ``move`` instead
+of rewriting every following index. Other lists are compared after trimming
+their common prefix and suffix.
+"""
+from typing import Any, Dict, List
+
+Operation = Dict[str, Any]
+
+
+def escape(token: str) -> str:
+    """Escape a key for use in a JSON pointer (RFC 6901)"""
+    return token.replace('~', '~0').replace('/', '~1')
+
+
+def _has_ids(values: List[Any]) -> bool:
+    if not values or not all(isinstance(value, dict) and 'id' in value for value in values):
+        return False
+    ids = [value['id'] for value in values]
+    return len(set(ids)) == len(ids)
+
+
+def _diff_dicts(old: Dict[str, Any], new: Dict[str, Any], path: str, ops: List[Operation]):
+    for key in old:
+        if key not in new:
+            ops.append({'op': 'remove', 'path': f"{path}/{escape(key)}"})
+    for key, value in new.items():
+        child = f"{path}/{escape(key)}"
+        if key not in old:
+            ops.append({'op': 'add', 'path': child, 'value': value})
+        else:
+            _diff(old[key], value, child, ops)
+
+
+def _diff_lists_by_id(old: List[Dict[str, Any]], new: List[Dict[str, Any]], path: str, ops: List[Operation]):
+    new_ids = {value['id'] for value in new}
+    # Remove from the end so earlier indexes stay valid
+    for index in range(len(old) - 1, -1, -1):
+        if old[index]['id'] not in new_ids:
+            ops.append({'op': 'remove', 'path': f"{path}/{index}"})
+    current = [value for value in old if value['id'] in new_ids]
+
+    for index, value in enumerate(new):
+        if index < len(current) and current[index]['id'] == value['id']:
+            _diff(current[index], value, f"{path}/{index}", ops)
+            continue
+        found = next((j for j in range(index + 1, len(current)) if current[j]['id'] == value['id']), None)
+        if found is None:
+            ops.append({'op': 'add', 'path': f"{path}/{index}", 'value': value})
+            current.insert(index, value)
+        else:
+            ops.append({'op': 'move', 'from': f"{path}/{found}", 'path': f"{path}/{index}"})
+            current.insert(index, current.pop(found))
+            _diff(current[index], value, f"{path}/{index}", ops)
+
+
+def _diff_lists(old: List[Any], new: List[Any], path: str, ops: List[Operation]):
+    if _has_ids(old) and _has_ids(new):
+        _diff_lists_by_id(old, new, path, ops)
+        return
+
+    start = 0
+    while start < len(old) and start < len(new) and old[start] == new[start]:
+        start += 1
+    old_end, new_end = len(old), len(new)
+    while old_end > start and new_end > start and old[old_end - 1] == new[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+
+    # Pair up the changed middle, then remove or add the rest
+    common = min(old_end, new_end) - start
+    for offset in range(common):
+        _diff(old[start + offset], new[start + offset], f"{path}/{start + offset}", ops)
+    for index in range(old_end - 1, start + common - 1, -1):
+        ops.append({'op': 'remove', 'path': f"{path}/{index}"})
+    for index in range(start + common, new_end):
+        ops.append({'op': 'add', 'path': f"{path}/{index}", 'value': new[index]})
+
+
+def _diff(old: Any, new: Any, path: str, ops: List[Operation]):
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        _diff_dicts(old, new, path, ops)
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_lists(old, new, path, ops)
+    else:
+        ops.append({'op': 'replace', 'path': path, 'value': new})
+
+
+def diff(old: Any, new: Any) -> List[Operation]:
+    """Return the JSON Patch operations that transform old into new"""
+    ops: List[Operation] = []
+    _diff(old, new, '', ops)
+    return ops
@@ -0,0 +1,114 @@
+"""
+Size-aware offloading of CPU-heavy work off the event loop.
+
+Decoding a multi-megabyte Moodle response or building models for thousands of
+modules takes tens of milliseconds, during which no other request of the
+worker makes progress. Work above a size threshold runs elsewhere:
+
+- JSON decoding runs in the default thread pool. The parser holds the GIL, so
+  this shortens the stalls rather than removing them (the loop runs between
+  the switch intervals of the worker thread), but the decoded objects are
+  needed in this process and sending them back from another process costs
+  about as much as parsing them here.
+- Pure functions with a small result (serializing a large course into the
+  response body) run in a pool of OFFLOAD_PROCESSES worker processes, which
+  do not hold this process's GIL at all; only pickling the arguments competes
+  with the loop. Without the pool they run in a thread.
+
+orjson is used for decoding when it is installed; it is optional.
+"""
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Bytes of JSON above which decoding runs in a worker thread
+JSON_OFFLOAD_THRESHOLD = int(os.getenv('JSON_OFFLOAD_THRESHOLD', 256 * 1024))
+# Course modules above which response models are built in a worker thread
+MODEL_OFFLOAD_THRESHOLD = int(os.getenv('MODEL_OFFLOAD_THRESHOLD', 500))
+# Worker processes per app worker for run_sized(..., process=True); 0 keeps that work in threads
+OFFLOAD_PROCESSES = int(os.getenv('OFFLOAD_PROCESSES', 1))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def json_loads(data: bytes) -> Any:
+    """Decode JSON with the fastest available parser"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+async def decode_json(data: bytes) -> Any:
+    """Decode JSON inline when small, in a worker thread when large"""
+    if len(data) < JSON_OFFLOAD_THRESHOLD:
+        return json_loads(data)
+    return await asyncio.to_thread(json_loads, data)
+
+
+def _preload(modules: tuple):
+    for name in modules:
+        importlib.import_module(name)
+
+
+async def start_process_pool(*preload: str):
+    """Start the offload processes, importing the given modules in them up front"""
+    global _process_pool
+    if OFFLOAD_PROCESSES <= 0 or _process_pool is not None:
+        return
+    # spawn: forking a process that runs threads and an event loop is unsafe
+    pool = ProcessPoolExecutor(OFFLOAD_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        await asyncio.gather(*(
+            asyncio.wrap_future(pool.submit(_preload, preload)) for _ in range(OFFLOAD_PROCESSES)
+        ))
+    except Exception as e:
+        # e.g. a main module the children cannot re-import; threads still work
+        logger.warning(f"Could not start offload processes, using threads instead: {e}")
+        await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+        return
+    _process_pool = pool
+    logger.info(f"Started {OFFLOAD_PROCESSES} offload processes")
+
+
+async def stop_process_pool():
+    global _process_pool
+    pool, _process_pool = _process_pool, None
+    if pool is not None:
+        await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+
+
+async def run_sized(size: int, threshold: int, func: Callable[..., T], *args: Any, process: bool = False) -> T:
+    """
+    Run func inline when size is below threshold, otherwise in a worker thread
+
+    With process=True, func runs in an offload process when the pool is
+    running; func must be a module-level function and its arguments and
+    result picklable.
+    """
+    global _process_pool
+    if size < threshold:
+        return func(*args)
+    pool = _process_pool if process else None
+    if pool is not None:
+        try:
+            return await asyncio.wrap_future(pool.submit(func, *args))
+        except BrokenProcessPool:
+            logger.warning("Offload process died; restarting the pool")
+            if _process_pool is pool:
+                _process_pool = ProcessPoolExecutor(OFFLOAD_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return await asyncio.to_thread(func, *args)
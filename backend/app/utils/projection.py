@@ -0,0 +1,131 @@
+"""
+Field projection and cursor pagination for course responses.
+
+``fields`` is a comma-separated list of dotted paths. Plain paths select fields,
+paths prefixed with ``-`` drop them:
+
+    fields=id,name                          section names only
+    fields=id,name,modules.id,modules.name  sections with slim modules
+    fields=-summary,-modules.description    everything except HTML bodies
+"""
+import base64
+import binascii
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+# field name -> True (whole value) or a nested tree for dicts / lists of dicts
+FieldTree = Dict[str, Any]
+
+
+def parse_fields(fields: Optional[str]) -> Tuple[Optional[FieldTree], Optional[FieldTree]]:
+    """Parse a fields parameter into (include, exclude) trees"""
+    if not fields:
+        return None, None
+
+    include: FieldTree = {}
+    exclude: FieldTree = {}
+    for raw in fields.split(','):
+        raw = raw.strip()
+        if not raw:
+            continue
+        target = exclude if raw.startswith('-') else include
+        path = raw.lstrip('-').split('.')
+        node = target
+        for part in path[:-1]:
+            child = node.get(part)
+            if child is True:
+                # The whole parent is already selected
+                break
+            if child is None:
+                child = node[part] = {}
+            node = child
+        else:
+            node[path[-1]] = True
+
+    return include or None, exclude or None
+
+
+def project(value: Any, include: Optional[FieldTree], exclude: Optional[FieldTree]) -> Any:
+    """Apply include/exclude trees to a dict, or to every dict in a list"""
+    if isinstance(value, list):
+        return [project(item, include, exclude) for item in value]
+    if not isinstance(value, dict) or (include is None and exclude is None):
+        return value
+
+    keys = value.keys() if include is None else [key for key in include if key in value]
+    result = {}
+    for key in keys:
+        sub_exclude = exclude.get(key) if exclude else None
+        if sub_exclude is True:
+            continue
+        sub_include = include.get(key) if include else None
+        if sub_include is True:
+            sub_include = None
+        result[key] = project(value[key], sub_include, sub_exclude)
+    return result
+
+
+def wants_field(include: Optional[FieldTree], exclude: Optional[FieldTree], name: str) -> bool:
+    """Whether a top-level field survives the projection"""
+    if exclude and exclude.get(name) is True:
+        return False
+    return include is None or name in include
+
+
+def encode_cursor(section_index: int, module_index: int) -> str:
+    return base64.urlsafe_b64encode(f"{section_index}:{module_index}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Tuple[int, int]:
+    """Decode a pagination cursor into (section index, module index)"""
+    if not cursor:
+        return 0, 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        section_index, module_index = base64.urlsafe_b64decode(padded).decode().split(':')
+        position = int(section_index), int(module_index)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if position[0] < 0 or position[1] < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+
+def paginate_sections(
+    sections: List[Dict[str, Any]],
+    cursor: Optional[str],
+    limit: Optional[int],
+    with_modules: bool
+) -> Tuple[List[Tuple[Dict[str, Any], List[Dict[str, Any]]]], Optional[str]]:
+    """
+    Slice course sections into a page of at most ``limit`` items.
+
+    With modules each module counts as one item and a section may be split
+    across pages; without modules each section counts as one item. Returns
+    (section, modules on this page) pairs and the cursor of the next page.
+    """
+    section_index, module_index = decode_cursor(cursor)
+    budget = limit if limit else float('inf')
+    page = []
+
+    while section_index < len(sections) and budget > 0:
+        section = sections[section_index]
+        if not with_modules:
+            page.append((section, []))
+            budget -= 1
+            section_index += 1
+            continue
+
+        modules = section.get('modules') or []
+        end = len(modules) if budget == float('inf') else module_index + int(budget)
+        taken = modules[module_index:end]
+        page.append((section, taken))
+        budget -= max(len(taken), 1)
+        module_index += len(taken)
+        if module_index >= len(modules):
+            section_index += 1
+            module_index = 0
+
+    next_cursor = encode_cursor(section_index, module_index) if section_index < len(sections) else None
+    return page, next_cursor
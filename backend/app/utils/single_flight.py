@@ -0,0 +1,76 @@
+"""
+Single-flight execution: concurrent callers asking for the same key share one
+run of the work.
+
+The work runs in its own task, detached from whichever request started it:
+a caller that is cancelled (client gone, dashboard part timed out) stops
+waiting, but the shared run carries on for everyone else and its result still
+reaches the caches. The run has no request deadline of its own; each caller
+waits for it only until its own deadline (within_deadline), so a short
+deadline of one request never fails the others.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from ..middleware.deadline import deadline_scope, within_deadline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """One in-flight run per key, shared by all concurrent callers"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def start(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> "asyncio.Task[T]":
+        """The shared run for key, starting work() if none is in flight"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._detached(work))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return task
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        """Await the shared run for key, starting work() if none is in flight"""
+        task = self.start(key, work)
+        # shield: cancelling (or timing out) this caller must not cancel the shared run
+        return await within_deadline(asyncio.shield(task))
+
+    @staticmethod
+    async def _detached(work: Callable[[], Awaitable[T]]) -> T:
+        with deadline_scope(None):
+            return await work()
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Retrieve the outcome so a failure nobody waited on isn't logged as unhandled
+        if not task.cancelled() and task.exception() is not None:
+            # Keys can contain tokens, so they are not logged
+            logger.debug(f"Shared {self.name} run failed: {task.exception()}")
+
+    def cancel(self, key: Hashable):
+        """Cancel the run for key, if one is in flight"""
+        task = self._tasks.get(key)
+        if task is not None:
+            task.cancel()
+
+    async def cancel_all(self):
+        """Cancel every run still in flight (called on shutdown)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
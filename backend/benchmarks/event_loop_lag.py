@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Event-loop lag benchmark for large upstream payloads.
+
+Runs the app against the fake Moodle server with everything on the event
+loop (``before``: stdlib json, no offloading), with all offloading in threads
+(``threads``: OFFLOAD_PROCESSES=0) and with the default size-aware offloading
+(``after``: decoding in threads, serialization in an offload process), and
+drives a mix of small requests
+(course list, cached course contents) and large ones (the LARGE_COURSE_ID
+contents, refetched from Moodle every time). A probe task inside the app
+process sleeps for 1 ms in a loop; how much later than requested it wakes up
+is the event-loop lag every other request of the worker sees.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.event_loop_lag
+    python -m benchmarks.event_loop_lag --duration 20 --large-ratio 0.2 --output lag.json
+
+The report lists lag percentiles and per-kind request latencies for each mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from .fake_moodle import LARGE_COURSE_ID
+from .run_benchmark import BACKEND_DIR, free_port, percentile, start_server, wait_ready
+
+PROBE_INTERVAL = 0.001
+
+MODES = {
+    'before': {'JSON_OFFLOAD_THRESHOLD': str(2 ** 62), 'MODEL_OFFLOAD_THRESHOLD': str(2 ** 62),
+               'LAG_BENCH_STDLIB_JSON': '1'},
+    'threads': {'OFFLOAD_PROCESSES': '0'},
+    'after': {},
+}
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 50), 3),
+        'p95': round(percentile(values, 95), 3),
+        'p99': round(percentile(values, 99), 3),
+        'max': round(values[-1], 3) if values else 0.0,
+    }
+
+
+def serve(port: int):
+    """Run the app with a lag probe in this process (child side of the benchmark)"""
+    import uvicorn
+    from app.main import app
+    from app.utils import offload
+
+    if os.getenv('LAG_BENCH_STDLIB_JSON'):
+        offload.orjson = None
+
+    lags: List[float] = []
+
+    async def probe():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(PROBE_INTERVAL)
+            lags.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+    async def lag_stats():
+        return {'lag_ms': summarize(lags), 'parser': 'orjson' if offload.orjson else 'json'}
+
+    async def lag_reset():
+        lags.clear()
+        return {}
+
+    app.add_api_route('/_lag', lag_stats, methods=['GET'])
+    app.add_api_route('/_lag/reset', lag_reset, methods=['POST'])
+
+    async def main():
+        server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', access_log=False))
+        task = asyncio.create_task(probe())
+        try:
+            await server.serve()
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+
+
+async def run_mode(name: str, moodle_url: str, args) -> Dict[str, Any]:
+    port = free_port()
+    app_url = f"http://127.0.0.1:{port}"
+    env = {'LOG_LEVEL': 'warning', **MODES[name]}
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.event_loop_lag', '--serve', str(port)],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+    try:
+        await wait_ready(f"{app_url}/health")
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+        async with httpx.AsyncClient(base_url=app_url, timeout=60.0, limits=limits) as client:
+            sessions = []
+            for i in range(args.users):
+                response = await client.post('/api/auth/login', json={
+                    'moodle_url': moodle_url, 'username': f"user{i}", 'password': 'secret'})
+                sessions.append(response.json()['session_id'])
+
+            # Warm the small-course caches so small requests stay small
+            for course_id in range(1, 9):
+                await client.get(f"/api/courses/{course_id}/contents", headers={'X-Session-ID': sessions[0]})
+            await client.post('/_lag/reset')
+
+            latencies: Dict[str, List[float]] = {'small': [], 'large': []}
+            errors = 0
+            stop_at = time.monotonic() + args.duration
+
+            async def worker():
+                nonlocal errors
+                while time.monotonic() < stop_at:
+                    headers = {'X-Session-ID': random.choice(sessions)}
+                    if random.random() < args.large_ratio:
+                        kind = 'large'
+                        request = client.get(f"/api/courses/{LARGE_COURSE_ID}/contents",
+                                             params={'refresh': 'true'}, headers=headers)
+                    else:
+                        kind = 'small'
+                        if random.random() < 0.5:
+                            request = client.get('/api/courses/', headers=headers)
+                        else:
+                            request = client.get(f"/api/courses/{random.randint(1, 8)}/contents", headers=headers)
+                    start = time.perf_counter()
+                    response = await request
+                    latencies[kind].append((time.perf_counter() - start) * 1000)
+                    if response.status_code >= 400:
+                        errors += 1
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            stats = (await client.get('/_lag')).json()
+
+        return {
+            'parser': stats['parser'],
+            'lag_ms': stats['lag_ms'],
+            'latency_ms': {kind: summarize(values) for kind, values in latencies.items()},
+            'errors': errors,
+        }
+    finally:
+        app.terminate()
+        try:
+            app.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            app.kill()
+
+
+async def main_async(args) -> Dict[str, Any]:
+    moodle_port = free_port()
+    moodle_url = f"http://127.0.0.1:{moodle_port}"
+    moodle = start_server('benchmarks.fake_moodle:app', moodle_port, {})
+    try:
+        await wait_ready(f"{moodle_url}/")
+        results = {}
+        for name in MODES:
+            print(f"Running {name} for {args.duration}s with concurrency {args.concurrency}...")
+            result = results[name] = await run_mode(name, moodle_url, args)
+            print(f"  parser {result['parser']}: lag p50 {result['lag_ms']['p50']} ms, p99 {result['lag_ms']['p99']} ms, "
+                  f"max {result['lag_ms']['max']} ms; small p99 {result['latency_ms']['small']['p99']} ms, "
+                  f"large p99 {result['latency_ms']['large']['p99']} ms, errors {result['errors']}")
+        return {
+            'meta': {
+                'timestamp': time.time(),
+                'duration_s': args.duration,
+                'concurrency': args.concurrency,
+                'large_ratio': args.large_ratio,
+                'fake_moodle': {key: value for key, value in os.environ.items() if key.startswith('FAKE_MOODLE_')},
+            },
+            'modes': results,
+        }
+    finally:
+        moodle.terminate()
+        try:
+            moodle.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            moodle.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per mode")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent client workers")
+    parser.add_argument('--users', type=int, default=10, help="Distinct benchmark users")
+    parser.add_argument('--large-ratio', type=float, default=0.1, help="Share of requests for the large course")
+    parser.add_argument('--output', default='lag_results.json', help="Where to write the JSON report")
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    report = asyncio.run(main_async(args))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+Fake Moodle server for benchmarks.
+
+Implements the parts of Moodle that MoodleClient talks to:
+
+- ``/login/token.php`` (GET for instance validation, POST for login)
+- ``/webservice/rest/server.php`` for the web-service functions the backend uses
+- ``/webservice/pluginfile.php/...`` file downloads
+
+Behaviour is configured through environment variables so the server can be
+started as a separate uvicorn process:
+
+    FAKE_MOODLE_LATENCY_MS=50 uvicorn benchmarks.fake_moodle:app --port 9100
+
+Course ``LARGE_COURSE_ID`` returns a much larger content tree than the others.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect
+
+LARGE_COURSE_ID = 999
+
+
+@dataclass
+class FakeMoodleConfig:
+    latency_ms: float = 20.0
+    jitter_ms: float = 10.0
+    courses: int = 8
+    sections: int = 10
+    modules: int = 8
+    large_sections: int = 60
+    large_modules: int = 40
+    summary_bytes: int = 400
+    file_bytes: int = 256 * 1024
+    error_rate: float = 0.0
+    seed: int = 1
+
+    @classmethod
+    def from_env(cls) -> "FakeMoodleConfig":
+        defaults = cls()
+        values = {}
+        for name, default in defaults.__dict__.items():
+            raw = os.getenv(f"FAKE_MOODLE_{name.upper()}")
+            if raw is not None:
+                values[name] = type(default)(raw)
+        return cls(**values)
+
+
+def _html(rng: random.Random, size: int) -> str:
+    words = ['lecture', 'notes', 'week', 'reading', 'assignment', 'slides', 'lab', 'exam', 'quiz', 'project']
+    text = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    return f"<p>{' '.join(text)}</p>"
+
+
+def build_course_contents(config: FakeMoodleConfig, course_id: int, site_url: str = 'https://fake.moodle') -> List[Dict]:
+    """Generate a deterministic core_course_get_contents tree for a course
+
+    File URLs point at site_url, so downloads reach this server's pluginfile endpoint.
+    """
+    rng = random.Random(config.seed * 100003 + course_id)
+    large = course_id == LARGE_COURSE_ID
+    section_count = config.large_sections if large else config.sections
+    module_count = config.large_modules if large else config.modules
+    extensions = [('pdf', 'application/pdf'), ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+                  ('pptx', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+                  ('txt', 'text/plain'), ('zip', 'application/zip')]
+
+    sections = []
+    for section_num in range(section_count):
+        modules = []
+        for module_num in range(module_count):
+            module_id = course_id * 100000 + section_num * 1000 + module_num
+            ext, mimetype = rng.choice(extensions)
+            filename = f"material_{section_num}_{module_num}.{ext}"
+            modules.append({
+                'id': module_id,
+                'url': f"https://fake.moodle/mod/resource/view.php?id={module_id}",
+                'name': f"Material {section_num}.{module_num}",
+                'instance': module_id,
+                'description': _html(rng, config.summary_bytes // 2),
+                'visible': 1,
+                'uservisible': True,
+                'visibleoncoursepage': 1,
+                'modicon': 'https://fake.moodle/theme/image.php/boost/resource/1/icon',
+                'modname': 'resource',
+                'modplural': 'Files',
+                'indent': 0,
+                'contents': [{
+                    'type': 'file',
+                    'filename': filename,
+                    'filepath': '/',
+                    'filesize': rng.randint(10_000, 5_000_000),
+                    'fileurl': f"{site_url}/webservice/pluginfile.php/{module_id}/mod_resource/content/1/{filename}",
+                    'timecreated': 1700000000 + module_id % 100000,
+                    'timemodified': 1700000000 + rng.randint(0, 10_000_000),
+                    'sortorder': 1,
+                    'mimetype': mimetype,
+                    'userid': 2,
+                    'author': 'Teacher',
+                    'license': 'allrightsreserved',
+                }],
+            })
+        sections.append({
+            'id': course_id * 1000 + section_num,
+            'name': f"Week {section_num}",
+            'visible': 1,
+            'summary': _html(rng, config.summary_bytes),
+            'summaryformat': 1,
+            'section': section_num,
+            'hiddenbynumsections': 0,
+            'uservisible': True,
+            'modules': modules,
+        })
+    return sections
+
+
+def _course_ids_param(form) -> List[int]:
+    """Read a ``courseids[0]=..&courseids[1]=..`` array parameter"""
+    return [int(value) for key, value in form.multi_items() if key.startswith('courseids[')]
+
+
+def build_activities(config: FakeMoodleConfig, course_id: int, kind: str) -> List[Dict]:
+    """Generate assignments or quizzes spread over the weeks around today"""
+    rng = random.Random(config.seed * 7919 + course_id * 2 + (kind == 'quiz'))
+    today = int(time.time()) // 86400 * 86400
+    activities = []
+    for number in range(config.sections // 2):
+        cmid = course_id * 100000 + 90000 + (500 if kind == 'quiz' else 0) + number
+        due = today + rng.randint(-14, 60) * 86400 + rng.choice([9, 12, 17, 23]) * 3600
+        activities.append({
+            'id': cmid % 1_000_000,
+            'cmid': cmid,
+            'course': course_id,
+            'name': f"{'Quiz' if kind == 'quiz' else 'Assignment'} {number + 1}",
+            'due': due,
+        })
+    return activities
+
+
+def create_app(config: FakeMoodleConfig) -> FastAPI:
+    """Build the fake Moodle ASGI app"""
+    app = FastAPI(title="Fake Moodle")
+    rng = random.Random(config.seed)
+    # Pre-serialised payloads so the fake server is never the bottleneck
+    contents_cache: Dict[int, bytes] = {}
+    file_payload = os.urandom(config.file_bytes)
+    stats = {'requests': 0, 'errors_injected': 0, 'functions': {}}
+
+    def userid_for(username: str) -> int:
+        return zlib.crc32(username.encode()) % 1_000_000 + 1
+
+    async def simulate() -> bool:
+        """Sleep for the configured latency; return True if an error should be injected"""
+        stats['requests'] += 1
+        delay = config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if config.error_rate and rng.random() < config.error_rate:
+            stats['errors_injected'] += 1
+            return True
+        return False
+
+    @app.get("/")
+    async def index():
+        return Response("<html><body class='moodle'>Fake Moodle</body></html>", media_type="text/html")
+
+    @app.get("/login/token.php")
+    async def token_probe():
+        return {'error': 'Web service not specified', 'errorcode': 'missingparam'}
+
+    async def read_form(request: Request):
+        """The request form, or None if the client went away (e.g. a cancelled hedge loser)"""
+        try:
+            return await request.form()
+        except ClientDisconnect:
+            return None
+
+    @app.post("/login/token.php")
+    async def token(request: Request):
+        form = await read_form(request)
+        if form is None:
+            return Response(status_code=499)
+        if await simulate():
+            return JSONResponse(status_code=503, content={'error': 'Injected failure'})
+        username = form.get('username', '')
+        if not username or form.get('password') == 'wrong':
+            return {'error': 'Invalid login, please try again', 'errorcode': 'invalidlogin'}
+        return {'token': f"token-{username}", 'privatetoken': None}
+
+    @app.post("/webservice/rest/server.php")
+    async def rest(request: Request):
+        form = await read_form(request)
+        if form is None:
+            return Response(status_code=499)
+        function = form.get('wsfunction', '')
+        token_value = form.get('wstoken', '')
+        stats['functions'][function] = stats['functions'].get(function, 0) + 1
+
+        if await simulate():
+            if rng.random() < 0.5:
+                return JSONResponse(status_code=503, content={'error': 'Injected failure'})
+            return {'exception': 'moodle_exception', 'errorcode': 'injected', 'message': 'Injected failure'}
+
+        if not token_value.startswith('token-'):
+            return {'exception': 'moodle_exception', 'errorcode': 'invalidtoken', 'message': 'Invalid token'}
+        username = token_value[len('token-'):]
+
+        if function == 'core_webservice_get_site_info':
+            return {
+                'sitename': 'Fake Moodle',
+                'username': username,
+                'fullname': f"Student {username}",
+                'userid': userid_for(username),
+                'siteurl': 'https://fake.moodle',
+                'release': '4.1',
+            }
+
+        if function == 'core_enrol_get_users_courses':
+            return [
+                {
+                    'id': course_id,
+                    'shortname': f"C{course_id}",
+                    'fullname': f"Course {course_id}",
+                    'categoryid': 1,
+                    'summary': _html(random.Random(course_id), config.summary_bytes),
+                    'summaryformat': 1,
+                    'format': 'topics',
+                    'startdate': 1700000000,
+                    'enddate': 1720000000,
+                    'visible': 1,
+                }
+                for course_id in list(range(1, config.courses + 1)) + [LARGE_COURSE_ID]
+            ]
+
+        if function == 'core_course_get_contents':
+            course_id = int(form.get('courseid', 0))
+            if course_id not in contents_cache:
+                site_url = str(request.base_url).rstrip('/')
+                contents_cache[course_id] = json.dumps(build_course_contents(config, course_id, site_url)).encode()
+            return Response(contents_cache[course_id], media_type="application/json")
+
+        if function == 'core_course_get_updates_since':
+            return {'instances': [], 'warnings': []}
+
+        if function == 'core_course_get_courses_by_field':
+            course_id = int(form.get('value', 0))
+            return {'courses': [{'id': course_id, 'fullname': f"Course {course_id}",
+                                 'shortname': f"C{course_id}", 'categoryid': 1}], 'warnings': []}
+
+        if function == 'mod_assign_get_assignments':
+            return {'courses': [
+                {
+                    'id': course_id,
+                    'fullname': f"Course {course_id}",
+                    'shortname': f"C{course_id}",
+                    'assignments': [
+                        {'id': item['id'], 'cmid': item['cmid'], 'course': course_id, 'name': item['name'],
+                         'duedate': item['due'], 'allowsubmissionsfromdate': item['due'] - 14 * 86400,
+                         'cutoffdate': item['due'] + 2 * 86400, 'intro': ''}
+                        for item in build_activities(config, course_id, 'assign')
+                    ],
+                }
+                for course_id in _course_ids_param(form)
+            ], 'warnings': []}
+
+        if function == 'mod_quiz_get_quizzes_by_courses':
+            return {'quizzes': [
+                {'id': item['id'], 'coursemodule': item['cmid'], 'course': course_id, 'name': item['name'],
+                 'timeopen': item['due'] - 7 * 86400, 'timeclose': item['due'], 'timelimit': 3600}
+                for course_id in _course_ids_param(form)
+                for item in build_activities(config, course_id, 'quiz')
+            ], 'warnings': []}
+
+        if function == 'core_calendar_get_action_events_by_timesort':
+            events = sorted(
+                (
+                    {'id': item['cmid'], 'name': f"{item['name']} is due", 'modulename': kind, 'instance': item['id'],
+                     'eventtype': 'due' if kind == 'assign' else 'close', 'timestart': item['due'],
+                     'timesort': item['due'], 'timeduration': 0, 'overdue': False,
+                     'description': _html(random.Random(item['cmid']), config.summary_bytes),
+                     'url': f"https://fake.moodle/mod/{kind}/view.php?id={item['cmid']}",
+                     'course': {'id': course_id, 'fullname': f"Course {course_id}", 'shortname': f"C{course_id}"},
+                     'action': {'name': 'Add submission', 'url': f"https://fake.moodle/mod/{kind}/view.php?id={item['cmid']}",
+                                'itemcount': 1, 'actionable': True}}
+                    for course_id in list(range(1, config.courses + 1)) + [LARGE_COURSE_ID]
+                    for kind in ('assign', 'quiz')
+                    for item in build_activities(config, course_id, kind)
+                ),
+                key=lambda event: (event['timesort'], event['id'])
+            )
+            since = int(form.get('timesortfrom') or 0)
+            until = int(form.get('timesortto') or 0)
+            events = [e for e in events if e['timesort'] >= since and (not until or e['timesort'] <= until)]
+            after = int(form.get('aftereventid') or 0)
+            if after:
+                ids = [e['id'] for e in events]
+                events = events[ids.index(after) + 1:] if after in ids else []
+            events = events[:int(form.get('limitnum') or 20)]
+            return {'events': events, 'firstid': events[0]['id'] if events else 0,
+                    'lastid': events[-1]['id'] if events else 0}
+
+        return {'exception': 'dml_missing_record_exception', 'errorcode': 'invalidrecord',
+                'message': f"Unknown function {function}"}
+
+    @app.get("/webservice/pluginfile.php/{path:path}")
+    async def pluginfile(path: str, token: str = ''):
+        if await simulate():
+            return JSONResponse(status_code=503, content={'error': 'Injected failure'})
+        if not token.startswith('token-'):
+            return JSONResponse(status_code=403, content={'error': 'Invalid token'})
+        return Response(file_payload, media_type="application/octet-stream")
+
+    @app.get("/_stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+app = create_app(FakeMoodleConfig.from_env())
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Load-test driver for the Moodle AI Assistant API.
+
+Starts the fake Moodle server and the real FastAPI app as separate uvicorn
+processes, replays request mixes against the app and writes a JSON report with
+RPS, latency percentiles and peak RSS of the app process per scenario.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.run_benchmark --output bench.json
+    python -m benchmarks.run_benchmark --scenario large_contents --duration 20
+    python -m benchmarks.run_benchmark --output new.json --compare bench.json
+    python -m benchmarks.run_benchmark --scenario mixed --concurrency 512   # past saturation
+
+``parallel_downloads`` submits ``collect_files`` jobs and streams the finished
+archives back, so every operation moves real file bytes through the app's
+pluginfile downloads; the report includes the download throughput. Job files
+go to a temporary UPLOAD_DIR that is removed afterwards.
+
+Goodput counts successful responses that finished within --slo-ms; under
+overload it should stay flat while excess requests are shed with 503.
+
+Fake Moodle behaviour (latency, payload size, error rate) is configured with
+the FAKE_MOODLE_* variables documented in benchmarks/fake_moodle.py.
+
+To benchmark against recorded production traffic instead, record a cassette
+with MOODLE_RECORD (see app/services/cassette.py; it must include a login)
+and replay it, optionally at scaled upstream timing:
+
+    python -m benchmarks.run_benchmark --replay moodle.jsonl.gz --time-scale 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.services.cassette import REPLAY_ORIGIN
+from .fake_moodle import LARGE_COURSE_ID
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# About a fifth of the fake files; each is FAKE_MOODLE_FILE_BYTES long
+DOWNLOAD_FILE_TYPES = ['txt']
+JOB_POLL_INTERVAL = 0.05
+
+# name -> list of (weight, operation)
+SCENARIOS: Dict[str, List[Tuple[int, str]]] = {
+    'login_storm': [(1, 'login')],
+    'course_polling': [(9, 'courses'), (1, 'validate')],
+    'large_contents': [(1, 'large_contents')],
+    'parallel_downloads': [(1, 'download')],
+    'deadlines': [(9, 'deadlines'), (1, 'deadlines_refresh')],
+    'calendar': [(1, 'calendar')],
+    'dashboard': [(1, 'dashboard')],
+    'mixed': [(1, 'login'), (10, 'courses'), (6, 'contents'), (1, 'large_contents'), (2, 'download'), (2, 'validate')],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_path: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', app_path, '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+
+
+async def wait_ready(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def read_proc_status(pid: int, field: str) -> Optional[int]:
+    """Read a kB value (VmRSS, VmHWM) from /proc; None where unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid: int):
+    """Reset VmHWM so each scenario reports its own peak (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Driver:
+    def __init__(self, app_url: str, moodle_url: str, users: int, slo_ms: float = 1000.0):
+        self.app_url = app_url
+        self.moodle_url = moodle_url
+        self.users = users
+        self.slo_ms = slo_ms
+        self.sessions: List[str] = []
+        self.downloaded_bytes = 0
+        self.client: Optional[httpx.AsyncClient] = None
+        self.operations: Dict[str, Callable] = {
+            'login': self.op_login,
+            'courses': self.op_courses,
+            'validate': self.op_validate,
+            'contents': self.op_contents,
+            'large_contents': self.op_large_contents,
+            'download': self.op_download,
+            'deadlines': self.op_deadlines,
+            'deadlines_refresh': self.op_deadlines_refresh,
+            'calendar': self.op_calendar,
+            'dashboard': self.op_dashboard,
+        }
+
+    async def login(self, username: str) -> httpx.Response:
+        return await self.client.post('/api/auth/login', json={
+            'moodle_url': self.moodle_url,
+            'username': username,
+            'password': 'secret',
+        })
+
+    async def setup(self):
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+        self.client = httpx.AsyncClient(base_url=self.app_url, timeout=60.0, limits=limits)
+        for i in range(self.users):
+            response = await self.login(f"user{i}")
+            session_id = response.json().get('session_id')
+            if session_id:
+                self.sessions.append(session_id)
+        if not self.sessions:
+            raise RuntimeError("Could not log in any benchmark user")
+
+    async def close(self):
+        await self.client.aclose()
+
+    def headers(self) -> Dict[str, str]:
+        return {'X-Session-ID': random.choice(self.sessions)}
+
+    async def op_login(self):
+        return await self.login(f"user{random.randrange(self.users)}")
+
+    async def op_courses(self):
+        return await self.client.get('/api/courses/', headers=self.headers())
+
+    async def op_validate(self):
+        return await self.client.get('/api/auth/validate', headers=self.headers())
+
+    async def op_contents(self):
+        return await self.client.get(f"/api/courses/{random.randint(1, 8)}/contents", headers=self.headers())
+
+    async def op_large_contents(self):
+        return await self.client.get(f"/api/courses/{LARGE_COURSE_ID}/contents", headers=self.headers())
+
+    async def op_download(self):
+        """Collect a course's files into an archive and download it"""
+        headers = self.headers()
+        response = await self.client.post('/api/jobs/', headers=headers, json={
+            'kind': 'collect_files',
+            'course_id': random.randint(1, 8),
+            'file_types': DOWNLOAD_FILE_TYPES,
+        })
+        if response.status_code != 202:
+            return response
+        job_id = response.json()['job_id']
+
+        while True:
+            response = await self.client.get(f"/api/jobs/{job_id}", headers=headers)
+            if response.status_code != 200 or response.json()['state'] not in ('queued', 'running'):
+                break
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+        if response.status_code != 200 or response.json()['state'] != 'succeeded':
+            return response
+
+        async with self.client.stream('GET', f"/api/jobs/{job_id}/download", headers=headers) as download:
+            async for chunk in download.aiter_bytes():
+                self.downloaded_bytes += len(chunk)
+        return download
+
+    async def op_deadlines(self):
+        return await self.client.get('/api/courses/deadlines', headers=self.headers())
+
+    async def op_deadlines_refresh(self):
+        return await self.client.get('/api/courses/deadlines', params={'refresh': 'true'}, headers=self.headers())
+
+    async def op_calendar(self):
+        return await self.client.get('/api/calendar/events', params={'page_size': 20}, headers=self.headers())
+
+    async def op_dashboard(self):
+        return await self.client.get('/api/dashboard/', headers=self.headers())
+
+    async def run_scenario(self, name: str, duration: float, concurrency: int) -> Dict[str, Any]:
+        mix = SCENARIOS[name]
+        weights = [weight for weight, _ in mix]
+        ops = [self.operations[op] for _, op in mix]
+        latencies: List[float] = []
+        errors = 0
+        good = 0
+        status_counts: Dict[str, int] = {}
+        self.downloaded_bytes = 0
+        stop_at = time.monotonic() + duration
+
+        async def worker():
+            nonlocal errors, good
+            while time.monotonic() < stop_at:
+                op = random.choices(ops, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = await op()
+                    status = str(response.status_code)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                    errors += 1
+                latency = (time.perf_counter() - start) * 1000
+                latencies.append(latency)
+                if status.startswith('2') and latency <= self.slo_ms:
+                    good += 1
+                status_counts[status] = status_counts.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        result = {
+            'requests': len(latencies),
+            'errors': errors,
+            'status_counts': status_counts,
+            'duration_s': round(elapsed, 3),
+            'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            'goodput_rps': round(good / elapsed, 2) if elapsed else 0.0,
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(latencies[-1], 3) if latencies else 0.0,
+            },
+        }
+        if self.downloaded_bytes:
+            result['downloaded_bytes'] = self.downloaded_bytes
+            result['download_mb_s'] = round(self.downloaded_bytes / elapsed / 1e6, 2) if elapsed else 0.0
+        return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Print per-scenario deltas; return False if any metric regressed past threshold"""
+    ok = True
+    print(f"{'scenario':<20}{'metric':<14}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        metrics = [
+            ('rps', base['rps'], result['rps'], True),
+            ('goodput_rps', base.get('goodput_rps', 0.0), result.get('goodput_rps', 0.0), True),
+            ('p50_ms', base['latency_ms']['p50'], result['latency_ms']['p50'], False),
+            ('p95_ms', base['latency_ms']['p95'], result['latency_ms']['p95'], False),
+            ('p99_ms', base['latency_ms']['p99'], result['latency_ms']['p99'], False),
+            ('peak_rss_kb', base.get('peak_rss_kb') or 0, result.get('peak_rss_kb') or 0, False),
+        ]
+        for metric, old, new, higher_is_better in metrics:
+            change = (new - old) / old if old else 0.0
+            regressed = change < -threshold if higher_is_better else change > threshold
+            ok = ok and not regressed
+            flag = '  REGRESSION' if regressed else ''
+            print(f"{name:<20}{metric:<14}{old:>12.2f}{new:>12.2f}{change:>+10.1%}{flag}")
+    return ok
+
+
+async def main_async(args) -> Dict[str, Any]:
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    upload_dir = tempfile.mkdtemp(prefix='bench-uploads-')
+    app_env = {'LOG_LEVEL': 'warning', 'UPLOAD_DIR': upload_dir}
+
+    if args.replay:
+        moodle = None
+        moodle_url = REPLAY_ORIGIN
+        app_env.update(MOODLE_REPLAY=os.path.abspath(args.replay), MOODLE_REPLAY_TIME_SCALE=str(args.time_scale))
+    else:
+        moodle_port = free_port()
+        moodle_url = f"http://127.0.0.1:{moodle_port}"
+        moodle = start_server('benchmarks.fake_moodle:app', moodle_port, {})
+
+    app = start_server('app.main:app', app_port, app_env)
+    try:
+        if moodle is not None:
+            await wait_ready(f"{moodle_url}/")
+        await wait_ready(f"{app_url}/health")
+
+        driver = Driver(app_url, moodle_url, args.users, args.slo_ms)
+        await driver.setup()
+
+        scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+        results = {}
+        try:
+            for name in scenarios:
+                reset_peak_rss(app.pid)
+                print(f"Running {name} for {args.duration}s with concurrency {args.concurrency}...")
+                result = await driver.run_scenario(name, args.duration, args.concurrency)
+                result['peak_rss_kb'] = read_proc_status(app.pid, 'VmHWM')
+                results[name] = result
+                print(f"  {result['rps']} req/s ({result['goodput_rps']} good), p50 {result['latency_ms']['p50']} ms, "
+                      f"p99 {result['latency_ms']['p99']} ms, errors {result['errors']}"
+                      + (f", {result['download_mb_s']} MB/s downloaded" if 'download_mb_s' in result else ''))
+        finally:
+            await driver.close()
+
+        return {
+            'meta': {
+                'timestamp': time.time(),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'duration_s': args.duration,
+                'concurrency': args.concurrency,
+                'users': args.users,
+                'slo_ms': args.slo_ms,
+                'fake_moodle': {key: value for key, value in os.environ.items() if key.startswith('FAKE_MOODLE_')},
+                'replay': {'cassette': args.replay, 'time_scale': args.time_scale} if args.replay else None,
+            },
+            'scenarios': results,
+        }
+    finally:
+        for process in (app, moodle):
+            if process is None:
+                continue
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default='all', choices=['all', *SCENARIOS])
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent client workers")
+    parser.add_argument('--users', type=int, default=20, help="Distinct benchmark users")
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help="Latency bound for goodput")
+    parser.add_argument('--replay', help="Serve Moodle from a recorded cassette instead of the fake server")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Replay upstream timing multiplier (0 = no delay)")
+    parser.add_argument('--output', default='bench_results.json', help="Where to write the JSON report")
+    parser.add_argument('--compare', help="Baseline report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,36 @@
 #!/usr/bin/env python3
 """
 Run script for Moodle AI Assistant backend
+
+    python run.py               # development: single worker with auto-reload
+    python run.py --production  # production: one worker per core, graceful drain
 """
-import uvicorn
-import os
+import argparse
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+from app.server import build_uvicorn_config, is_production, run_server
+
 if __name__ == "__main__":
-    host = os.getenv('BACKEND_HOST', 'localhost')
-    port = int(os.getenv('BACKEND_PORT', 8000))
-    debug = os.getenv('DEBUG', 'true').lower() == 'true'
-    log_level = os.getenv('LOG_LEVEL', 'info').lower()
-    
+    parser = argparse.ArgumentParser(description="Run the Moodle AI Assistant API")
+    parser.add_argument('--production', action='store_true', help="Multi-worker production mode (or APP_ENV=production)")
+    args = parser.parse_args()
+
+    production = args.production or is_production()
+    config = build_uvicorn_config(production)
+    host = config['host']
+    port = config['port']
+
     print(f"🚀 Starting Moodle AI Assistant API")
     print(f"📍 Server: http://{host}:{port}")
     print(f"📚 Docs: http://{host}:{port}/docs")
-    print(f"🔧 Debug: {debug}")
+    if production:
+        print(f"🏭 Production: {config['workers']} workers, loop={config['loop']}, http={config['http']}")
+    else:
+        print(f"🔧 Debug: {config['reload']}")
     print(f"🌐 Supports ANY university's Moodle instance!")
     print("-" * 50)
-    
-    uvicorn.run(
-        "app.main:app",
-        host=host,
-        port=port,
-        reload=debug,
-        log_level=log_level,
-        access_log=True
-    )
\ No newline at end of file
+
+    run_server(production)
@@ -0,0 +1,116 @@
+import asyncio
+
+from app.middleware import admission
+from app.middleware.admission import BULK, INTERACTIVE, AdmissionController, classify
+
+
+def test_classify():
+    assert classify('/api/courses/') == INTERACTIVE
+    assert classify('/api/courses/5/contents') == INTERACTIVE
+    assert classify('/api/courses/5/download') == BULK
+    assert classify('/api/courses/5/files/3') == BULK
+    assert classify('/api/calendar/events') == BULK
+    assert classify('/api/calendar/deadlines') == INTERACTIVE
+    assert classify('/api/dashboard/') == INTERACTIVE
+    assert classify('/api/auth/login') is None
+    assert classify('/health') is None
+
+
+def test_slow_requests_decrease_the_limit_once_per_round_trip():
+    controller = AdmissionController()
+    start = controller.limit
+    slow = admission.ADMISSION_TARGET_LATENCY * 2
+
+    controller._observe(INTERACTIVE, slow)
+    decreased = controller.limit
+    assert decreased == start * admission.ADMISSION_DECREASE
+
+    # A burst of slow completions within one round trip is one signal
+    controller._observe(INTERACTIVE, slow)
+    assert controller.limit == decreased
+
+
+def test_limit_never_drops_below_minimum():
+    controller = AdmissionController()
+    for _ in range(100):
+        controller.last_decrease = 0.0
+        controller._observe(INTERACTIVE, admission.ADMISSION_TARGET_LATENCY * 2)
+    assert controller.limit == admission.ADMISSION_MIN_LIMIT
+
+
+def test_fast_requests_grow_the_limit_only_while_it_is_in_use():
+    controller = AdmissionController()
+    start = controller.limit
+
+    controller._observe(INTERACTIVE, 0.01)
+    assert controller.limit == start
+
+    controller.inflight = int(start)
+    for _ in range(int(start)):
+        controller._observe(INTERACTIVE, 0.01)
+    assert start + 0.9 < controller.limit <= start + 1
+
+
+def test_bulk_latency_is_not_sampled():
+    controller = AdmissionController()
+    controller._observe(BULK, admission.ADMISSION_TARGET_LATENCY * 10)
+    assert controller.limit == admission.ADMISSION_INITIAL_LIMIT
+    assert controller.latency_ewma == 0.0
+
+
+def test_bulk_requests_use_only_their_share():
+    controller = AdmissionController()
+    controller.limit = 4.0
+    bulk_slots = max(1, int(4 * admission.ADMISSION_BULK_SHARE))
+
+    async def run():
+        for _ in range(bulk_slots):
+            assert await controller.acquire(BULK, 'a')
+        assert not controller._has_slot(BULK)
+        assert controller._has_slot(INTERACTIVE)
+
+    asyncio.run(run())
+
+
+def test_queued_sessions_take_turns():
+    controller = AdmissionController()
+    controller.limit = 1.0
+    order = []
+
+    async def request(session, name):
+        assert await controller.acquire(INTERACTIVE, session)
+        order.append(name)
+
+    async def run():
+        assert await controller.acquire(INTERACTIVE, 'holder')
+        tasks = [asyncio.create_task(request(session, name)) for session, name in
+                 [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('b', 'b2')]]
+        await asyncio.sleep(0)
+        assert controller.queued == 5
+        for _ in range(6):
+            controller.release(INTERACTIVE, 0.0)
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ['a1', 'b1', 'a2', 'b2', 'a3']
+    assert controller.inflight == 0 and controller.queued == 0
+
+
+def test_full_session_queue_is_rejected():
+    controller = AdmissionController()
+    controller.limit = 1.0
+
+    async def run():
+        assert await controller.acquire(INTERACTIVE, 'holder')
+        waiters = [asyncio.create_task(controller.acquire(INTERACTIVE, 'greedy'))
+                   for _ in range(admission.ADMISSION_MAX_QUEUED_PER_SESSION)]
+        await asyncio.sleep(0)
+        assert await controller.acquire(INTERACTIVE, 'greedy') is False
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(run())
+    assert controller.counters['rejected'] == 1
+    assert controller.queued == 0
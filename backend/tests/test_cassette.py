@@ -0,0 +1,112 @@
+import asyncio
+import gzip
+import json
+
+import httpx
+
+from app.services.cassette import (
+    REDACTED, REPLAY_ORIGIN, RecordingTransport, ReplayTransport, Scrubber, load_cassette, pseudonym,
+)
+
+SITE = 'https://moodle.school.edu'
+TOKEN = 'a1b2c3d4e5f6'
+
+
+def test_scrubber_removes_secrets_and_personal_data():
+    scrubber = Scrubber(SITE)
+    scrubber.secrets.add(TOKEN)
+    data = {
+        'token': TOKEN,
+        'fullname': 'Ada Lovelace',
+        'email': 'ada@school.edu',
+        'courses': [{'shortname': 'MATH', 'fullname': 'Mathematics'}],
+        'summary': f"Mail ada@school.edu or see {SITE}/file.pdf?token={TOKEN}&x=1 ({TOKEN})",
+    }
+
+    scrubbed = scrubber.value(data)
+
+    assert scrubbed['token'] == REDACTED
+    assert scrubbed['fullname'] == pseudonym('Ada Lovelace') and len(scrubbed['fullname']) == 12
+    assert scrubbed['email'] != 'ada@school.edu' and len(scrubbed['email']) == len('ada@school.edu')
+    # Course names are not personal
+    assert scrubbed['courses'] == [{'shortname': 'MATH', 'fullname': 'Mathematics'}]
+    assert TOKEN not in scrubbed['summary'] and 'ada@school.edu' not in scrubbed['summary']
+    assert f"{REPLAY_ORIGIN}/file.pdf?token={REDACTED}&x=1" in scrubbed['summary']
+
+
+def _moodle(request: httpx.Request) -> httpx.Response:
+    if request.url.path == '/login/token.php':
+        return httpx.Response(200, json={'token': TOKEN})
+    if request.url.path.startswith('/webservice/pluginfile.php'):
+        return httpx.Response(200, content=b'%PDF' * 1000, headers={'content-type': 'application/pdf'})
+    params = dict(httpx.QueryParams(request.content.decode()))
+    body = gzip.compress(json.dumps([
+        {'id': int(params['courseid']), 'name': 'Week 1', 'summary': 'Ask tutor@school.edu'},
+    ]).encode())
+    return httpx.Response(200, content=body, headers={'content-type': 'application/json', 'content-encoding': 'gzip'})
+
+
+async def _session(transport):
+    async with httpx.AsyncClient(transport=transport) as client:
+        login = await client.get(f"{SITE}/login/token.php", params={'username': 'ada', 'password': 'pw'})
+        contents = []
+        for course_id in (5, 6):
+            response = await client.post(f"{SITE}/webservice/rest/server.php", data={
+                'wstoken': login.json()['token'], 'wsfunction': 'core_course_get_contents', 'courseid': course_id,
+            })
+            contents.append(response.json())
+        async with client.stream('GET', f"{SITE}/webservice/pluginfile.php/1/a.pdf", params={'token': TOKEN}) as file:
+            size = sum([len(chunk) async for chunk in file.aiter_bytes()])
+        return login.json(), contents, size
+
+
+def test_recording_streams_through_and_writes_a_scrubbed_cassette(tmp_path):
+    path = str(tmp_path / 'moodle.jsonl.gz')
+
+    async def record():
+        transport = RecordingTransport(httpx.MockTransport(_moodle), path)
+        try:
+            return await _session(transport)
+        finally:
+            await transport.aclose()
+
+    login, contents, size = asyncio.run(record())
+    # The caller sees the real, decoded responses
+    assert login == {'token': TOKEN}
+    assert contents[0] == [{'id': 5, 'name': 'Week 1', 'summary': 'Ask tutor@school.edu'}]
+    assert size == 4000
+
+    raw = gzip.open(path, 'rt').read()
+    assert TOKEN not in raw and 'tutor@school.edu' not in raw and 'ada' not in raw and SITE not in raw
+    entries = load_cassette(path)
+    assert [entry['path'] for entry in entries] == [
+        '/login/token.php', '/webservice/rest/server.php', '/webservice/rest/server.php',
+        '/webservice/pluginfile.php/1/a.pdf',
+    ]
+    assert entries[1]['params']['wstoken'] == REDACTED and entries[1]['params']['courseid'] == '5'
+    assert (entries[3]['body_encoding'], entries[3]['body']) == ('size', 4000)
+
+
+def test_replay_serves_the_recording(tmp_path):
+    path = str(tmp_path / 'moodle.jsonl.gz')
+
+    async def record():
+        transport = RecordingTransport(httpx.MockTransport(_moodle), path)
+        await _session(transport)
+        await transport.aclose()
+
+    async def replay():
+        transport = ReplayTransport.from_file(path, time_scale=0)
+        login, contents, size = await _session(transport)
+        async with httpx.AsyncClient(transport=transport) as client:
+            missing = await client.post(f"{SITE}/webservice/rest/server.php", data={'wsfunction': 'core_missing'})
+        return transport, login, contents, size, missing.json()
+
+    asyncio.run(record())
+    transport, login, contents, size, missing = asyncio.run(replay())
+
+    assert login['token'].startswith('replay-')
+    assert [sections[0]['id'] for sections in contents] == [5, 6]
+    assert contents[0][0]['summary'] != 'Ask tutor@school.edu'
+    assert size == 4000
+    assert missing['errorcode'] == 'replaymissing' and transport.misses == 1
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import chunk_store
+from app.services.chunk_store import ChunkStore, close_chunk_stores, file_key, get_chunk_store, split_text
+
+
+def test_split_text_respects_size_and_keeps_words():
+    text = "\n\n".join(["short paragraph", "word " * 300, "x" * 2500])
+    chunks = split_text(text, size=100)
+
+    assert all(0 < len(chunk) <= 100 for chunk in chunks)
+    assert chunks[0] == "short paragraph"
+    assert "".join(chunks).replace(" ", "").replace("\n", "") == text.replace(" ", "").replace("\n", "")
+
+
+def test_file_key_ignores_query_string():
+    assert file_key("https://m/pluginfile.php/1/a.pdf?token=x") == file_key("https://m/pluginfile.php/1/a.pdf")
+    assert 0 <= file_key("https://m/b.pdf") < 2 ** 63
+
+
+def test_round_trip_versions_and_compaction(tmp_path):
+    store = ChunkStore(str(tmp_path / "site"))
+    try:
+        assert store.append_document(7, 1, 10, 0, 1, 'module_description', ["first", "second"]) == 2
+        store.append_document(7, 2, 0, 0, 1, 'section_summary', ["summary ü"])
+        store.append_document(8, 1, 10, 0, 1, 'module_description', ["other course"])
+
+        assert store.has_version(7, 1, 10, 0, 'module_description', 1)
+        assert not store.has_version(7, 1, 10, 0, 'module_description', 2)
+        total, chunks = store.chunks(7)
+        assert total == 3
+        assert [chunk['text'] for chunk in chunks] == ["first", "second", "summary ü"]
+        assert chunks[2]['kind'] == 'section_summary' and chunks[2]['module_id'] is None
+
+        # A new version supersedes the old one
+        store.append_document(7, 1, 10, 0, 2, 'module_description', ["rewritten"])
+        total, chunks = store.chunks(7, section_id=1)
+        assert (total, [chunk['text'] for chunk in chunks]) == (1, ["rewritten"])
+        assert store.chunks(7, include_superseded=True)[0] == 4
+
+        # Paging and the visibility filter
+        total, page = store.chunks(7, offset=1, limit=1)
+        assert total == 2 and [chunk['text'] for chunk in page] == ["rewritten"]
+        assert store.chunks(7, where=lambda section_id, module_id: module_id is None)[0] == 1
+
+        assert store.compact() == 2
+        assert store.stats()['superseded'] == 0
+        assert [chunk['text'] for chunk in store.chunks(7)[1]] == ["summary ü", "rewritten"]
+        assert [chunk['text'] for chunk in store.chunks(8)[1]] == ["other course"]
+    finally:
+        store.close()
+
+
+def test_second_handle_sees_appends_and_compaction(tmp_path):
+    directory = str(tmp_path / "site")
+    writer, reader = ChunkStore(directory), ChunkStore(directory)
+    try:
+        writer.append_document(1, 1, 1, 0, 1, 'file', ["v1"])
+        assert reader.chunks(1)[0] == 1
+        writer.append_document(1, 1, 1, 0, 2, 'file', ["v2"])
+        writer.compact()
+        assert [chunk['text'] for chunk in reader.chunks(1)[1]] == ["v2"]
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_concurrent_opens_share_one_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, 'CHUNK_STORE_DIR', str(tmp_path))
+    monkeypatch.setattr(chunk_store, 'CHUNK_STORES', {})
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            stores = list(pool.map(get_chunk_store, ['https://m.example'] * 32))
+        assert len({id(store) for store in stores}) == 1
+        assert list(chunk_store.CHUNK_STORES) == ['https://m.example']
+    finally:
+        close_chunk_stores()
+    assert chunk_store.CHUNK_STORES == {}
@@ -0,0 +1,72 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from app.services import deadlines
+from app.services.deadlines import get_deadlines
+
+
+class FakeClient:
+    base_url = 'https://m.example'
+
+    def __init__(self, courses=None, courses_error=None, quizzes_error=None):
+        self.courses = courses if courses is not None else [{'id': 1, 'fullname': 'Maths'}, {'id': 2, 'fullname': 'Art'}]
+        self.courses_error = courses_error
+        self.quizzes_error = quizzes_error
+        self.calls = 0
+
+    async def get_user_courses(self, userid=None, raise_errors=False):
+        self.calls += 1
+        if self.courses_error:
+            if raise_errors:
+                raise self.courses_error
+            return []
+        return self.courses
+
+    async def get_assignments(self, course_ids):
+        return {'courses': [{'id': 1, 'assignments': [
+            {'id': 7, 'cmid': 70, 'course': 1, 'name': 'Essay', 'duedate': 300},
+            {'id': 8, 'cmid': 80, 'course': 1, 'name': 'No due date', 'duedate': 0},
+        ]}]}
+
+    async def get_quizzes(self, course_ids):
+        if self.quizzes_error:
+            raise self.quizzes_error
+        return {'quizzes': [{'id': 9, 'coursemodule': 90, 'course': 2, 'name': 'Quiz', 'timeclose': 200}]}
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    monkeypatch.setattr(deadlines, 'DEADLINES_CACHE', OrderedDict())
+    return deadlines.DEADLINES_CACHE
+
+
+def test_timeline_is_merged_sorted_and_cached(cache):
+    client = FakeClient()
+    timeline = asyncio.run(get_deadlines(client, 's1'))
+    assert [(item['name'], item['course_name']) for item in timeline.items] == [('Quiz', 'Art'), ('Essay', 'Maths')]
+    assert timeline.select(since=250) == timeline.items[1:]
+    assert asyncio.run(get_deadlines(client, 's1')) is timeline and client.calls == 1
+
+
+def test_no_courses_is_a_cached_empty_timeline(cache):
+    client = FakeClient(courses=[])
+    timeline = asyncio.run(get_deadlines(client, 's1'))
+    assert timeline.items == [] and timeline.warnings == []
+    assert cache['s1'] is timeline
+
+
+def test_failed_course_lookup_is_an_error(cache):
+    client = FakeClient(courses_error=RuntimeError("upstream down"))
+    with pytest.raises(RuntimeError):
+        asyncio.run(get_deadlines(client, 's1'))
+    assert 's1' not in cache
+
+
+def test_missing_source_is_reported_and_not_cached(cache):
+    client = FakeClient(quizzes_error=RuntimeError("quiz plugin off"))
+    timeline = asyncio.run(get_deadlines(client, 's1'))
+    assert [item['name'] for item in timeline.items] == ['Essay']
+    assert timeline.warnings == ['quizzes unavailable']
+    assert 's1' not in cache
@@ -0,0 +1,125 @@
+import itertools
+import random
+
+import pytest
+
+from app.services.file_index import FileEntry, FileIndex
+
+
+def _contents(seed=7, sections=4, modules=5):
+    rng = random.Random(seed)
+    names = ['notes.pdf', 'Slides.PPTX', 'data.csv', 'README', '.htaccess', 'archive.tar.gz', 'scan.PDF']
+    mimetypes = ['application/pdf', 'text/csv', 'application/octet-stream']
+    return [
+        {
+            'id': s,
+            'name': f"Week {s}",
+            'modules': [
+                {
+                    'id': s * 100 + m,
+                    'name': f"Module {m}",
+                    'contents': [
+                        {
+                            'type': rng.choice(['file', 'file', 'url']),
+                            'filename': rng.choice(names),
+                            'fileurl': f"https://moodle/{s}/{m}/{c}",
+                            'filesize': rng.randint(0, 10_000),
+                            'mimetype': rng.choice(mimetypes),
+                            'timemodified': rng.randint(1_700_000_000, 1_700_100_000),
+                        }
+                        for c in range(rng.randint(0, 3))
+                    ],
+                }
+                for m in range(modules)
+            ],
+        }
+        for s in range(sections)
+    ]
+
+
+def test_only_file_contents_are_indexed():
+    contents = _contents()
+    index = FileIndex.from_contents(contents)
+    expected = sum(
+        1 for section in contents for module in section['modules']
+        for content in module['contents'] if content['type'] == 'file'
+    )
+    assert len(index) == expected
+    assert [entry.position for entry in index.entries] == list(range(expected))
+
+
+@pytest.mark.parametrize('filename, extension', [
+    ('notes.pdf', 'pdf'),
+    ('scan.PDF', 'pdf'),
+    ('archive.tar.gz', 'gz'),
+    ('README', ''),
+    ('.htaccess', ''),
+])
+def test_extension(filename, extension):
+    entry = FileEntry(0, {'filename': filename}, {}, {})
+    assert entry.extension == extension
+
+
+def _brute_force(index, extensions=None, mimetypes=None, section_id=None, module_id=None,
+                 min_size=None, max_size=None, modified_since=None):
+    extensions = {ext.lower().lstrip('.') for ext in extensions} if extensions is not None else None
+    return [
+        entry for entry in index.entries
+        if (extensions is None or entry.extension in extensions)
+        and (not mimetypes or entry.mimetype in mimetypes)
+        and (section_id is None or entry.section_id == section_id)
+        and (module_id is None or entry.module_id == module_id)
+        and (min_size is None or entry.filesize >= min_size)
+        and (max_size is None or entry.filesize <= max_size)
+        and (modified_since is None or entry.timemodified >= modified_since)
+    ]
+
+
+FILTERS = [
+    {},
+    {'extensions': ['pdf']},
+    {'extensions': ['.PDF', 'csv']},
+    {'mimetypes': ['text/csv']},
+    {'section_id': 2},
+    {'module_id': 101},
+    {'min_size': 2000, 'max_size': 6000},
+    {'modified_since': 1_700_050_000},
+    {'extensions': ['pdf'], 'min_size': 5000, 'section_id': 1},
+]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('sort', ['position', 'filename', 'filesize', 'timemodified'])
+def test_query_matches_brute_force(filters, sort):
+    index = FileIndex.from_contents(_contents())
+    expected = sorted(_brute_force(index, **filters), key=lambda entry: getattr(entry, sort))
+
+    results = index.query(sort=sort, **filters)
+
+    # Ties in the sort key may come back in any order
+    assert sorted(entry.position for entry in results) == sorted(entry.position for entry in expected)
+    assert [getattr(entry, sort) for entry in results] == [getattr(entry, sort) for entry in expected]
+
+
+def test_descending_and_limit():
+    index = FileIndex.from_contents(_contents())
+    sizes = [entry.filesize for entry in index.query(sort='filesize', descending=True, limit=3)]
+    assert sizes == sorted((entry.filesize for entry in index.entries), reverse=True)[:3]
+
+
+def test_unknown_sort_key():
+    with pytest.raises(ValueError):
+        FileIndex([]).query(sort='size')
+
+
+def test_stored_rows_round_trip_and_sort_with_missing_filenames():
+    index = FileIndex.from_contents(_contents())
+    rows = [entry.to_dict() for entry in index.entries]
+    rows[0]['filename'] = None
+    restored = FileIndex([FileEntry.from_dict(position, row) for position, row in enumerate(rows)])
+
+    names = [entry.filename for entry in restored.query(sort='filename')]
+    assert names[0] == ''
+    assert names == sorted(names)
+    for a, b in itertools.islice(zip(index.entries[1:], restored.entries[1:]), 10):
+        assert a.to_dict() == b.to_dict()
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.services import jobs
+from app.services.jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobLimitError, JobManager
+
+
+async def _sleep(job):
+    for step in range(job.params.get('steps', 50)):
+        job.report(step, job.params.get('steps', 50))
+        await asyncio.sleep(0.01)
+    return {'slept': True}
+
+
+async def _fail(job):
+    raise RuntimeError("boom")
+
+
+async def _write_file(job):
+    os.makedirs(job.workdir, exist_ok=True)
+    job.result_path = os.path.join(job.workdir, 'result.txt')
+    with open(job.result_path, 'w') as f:
+        f.write('done')
+    return {}
+
+
+@pytest.fixture(autouse=True)
+def job_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setattr(jobs, 'JOB_SYNC_INTERVAL', 0.02)
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_sleep', _sleep)
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_fail', _fail)
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_file', _write_file)
+    return tmp_path
+
+
+@pytest.fixture
+def sqlite_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_STORE', 'sqlite')
+    monkeypatch.setattr(jobs, 'JOB_DB_PATH', str(tmp_path / 'jobs.db'))
+
+
+async def _wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def _run(test):
+    async def main():
+        manager = JobManager(workers=2)
+        await manager.start()
+        try:
+            await test(manager)
+        finally:
+            await manager.stop()
+    asyncio.run(main())
+
+
+def test_jobs_run_to_completion_or_failure():
+    async def test(manager):
+        ok = await manager.submit('test_sleep', 's1', None, {'steps': 5})
+        bad = await manager.submit('test_fail', 's1', None, {})
+        await _wait_for(lambda: ok.state == SUCCEEDED and bad.state == FAILED)
+        assert ok.result == {'slept': True} and ok.progress == 100.0
+        assert bad.error == "boom"
+        assert [job.job_id for job in await manager.list('s1')] == [ok.job_id, bad.job_id]
+        assert await manager.list('s2') == []
+        assert await manager.get(ok.job_id, 's2') is None
+
+    _run(test)
+
+
+def test_cancel_queued_and_running_jobs():
+    async def test(manager):
+        # Two may run per session; the third waits in the queue
+        running = [await manager.submit('test_sleep', 's1', None, {}) for _ in range(2)]
+        queued = await manager.submit('test_sleep', 's1', None, {})
+        await _wait_for(lambda: all(job.state == RUNNING for job in running))
+        assert queued.state == QUEUED
+
+        assert await manager.cancel(queued)
+        assert queued.state == CANCELLED
+        assert await manager.cancel(running[0])
+        await _wait_for(lambda: running[0].state == CANCELLED)
+        await _wait_for(lambda: running[1].state == SUCCEEDED)
+        assert not await manager.cancel(running[1])
+
+    _run(test)
+
+
+def test_queue_limit_per_session(monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_QUEUED_PER_SESSION', 2)
+
+    async def test(manager):
+        running = [await manager.submit('test_sleep', 's1', None, {}) for _ in range(2)]
+        await _wait_for(lambda: all(job.state == RUNNING for job in running))
+        for _ in range(2):
+            await manager.submit('test_sleep', 's1', None, {})
+        with pytest.raises(JobLimitError):
+            await manager.submit('test_sleep', 's1', None, {})
+        # Other sessions are unaffected
+        await manager.submit('test_sleep', 's2', None, {})
+
+    _run(test)
+
+
+def test_finished_jobs_and_files_expire(monkeypatch):
+    async def test(manager):
+        job = await manager.submit('test_file', 's1', None, {})
+        await _wait_for(lambda: job.state == SUCCEEDED)
+        assert os.path.exists(job.result_path)
+
+        await manager.prune()
+        assert await manager.get(job.job_id, 's1') is job
+
+        monkeypatch.setattr(jobs, 'JOB_RESULT_TTL', 0.0)
+        await manager.prune()
+        assert await manager.get(job.job_id, 's1') is None
+        assert not os.path.exists(job.workdir)
+
+    _run(test)
+
+
+def test_failed_jobs_leave_no_files():
+    async def test(manager):
+        job = await manager.submit('test_fail', 's1', None, {})
+        await _wait_for(lambda: job.state == FAILED)
+        assert job.result_path is None and not os.path.exists(job.workdir)
+
+    _run(test)
+
+
+def test_shared_store_between_workers(sqlite_store, monkeypatch):
+    async def main():
+        a, b = JobManager(workers=2), JobManager(workers=2)
+        await a.start()
+        await b.start()
+        try:
+            done = await a.submit('test_file', 's1', None, {})
+            slow = await a.submit('test_sleep', 's1', None, {'steps': 500})
+            await _wait_for(lambda: done.state == SUCCEEDED and slow.state == RUNNING)
+            await asyncio.sleep(0.1)
+
+            # The other worker sees state, progress and the shared result file
+            seen = await b.get(done.job_id, 's1')
+            assert seen.state == SUCCEEDED and os.path.exists(seen.result_path)
+            assert (await b.get(slow.job_id, 's1')).progress > 0
+            assert await b.get(slow.job_id, 's2') is None
+            assert {job.job_id for job in await b.list('s1')} == {done.job_id, slow.job_id}
+
+            # A cancel request reaches the worker running the job
+            assert await b.cancel(await b.get(slow.job_id, 's1'))
+            await _wait_for(lambda: slow.state == CANCELLED)
+
+            # Unfinished jobs of a worker that stopped reporting are failed by the others
+            lost = await a.submit('test_sleep', 's1', None, {'steps': 500})
+            await _wait_for(lambda: lost.state == RUNNING)
+            a.sync_task.cancel()
+            monkeypatch.setattr(jobs, 'JOB_LOST_AFTER', 0.1)
+
+            async def failed():
+                return (await b.get(lost.job_id, 's1')).state == FAILED
+            deadline = time.monotonic() + 3
+            while not await failed():
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.02)
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(main())
+
+
+def test_stop_cancels_unfinished_jobs():
+    async def main():
+        manager = JobManager(workers=1)
+        await manager.start()
+        running = await manager.submit('test_sleep', 's1', None, {'steps': 500})
+        queued = await manager.submit('test_sleep', 's1', None, {})
+        await _wait_for(lambda: running.state == RUNNING)
+        await manager.stop()
+        assert running.state == CANCELLED and queued.state == CANCELLED
+
+    asyncio.run(main())
+
+
+def test_ending_a_session_drops_its_jobs():
+    async def test(manager):
+        done = await manager.submit('test_file', 's1', None, {})
+        running = await manager.submit('test_sleep', 's1', None, {'steps': 500})
+        other = await manager.submit('test_file', 's2', None, {})
+        await _wait_for(lambda: done.state == SUCCEEDED and running.state == RUNNING and other.state == SUCCEEDED)
+
+        await manager.drop_session('s1')
+        assert await manager.get(done.job_id, 's1') is None
+        assert not os.path.exists(done.workdir)
+        await _wait_for(lambda: running.state == CANCELLED)
+        assert await manager.get(other.job_id, 's2') is other
+
+    _run(test)
@@ -0,0 +1,157 @@
+import copy
+import random
+
+import pytest
+
+from app.utils.json_patch import diff, escape
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def _resolve(doc, path):
+    """Parent container and last token of a JSON pointer"""
+    tokens = [_unescape(token) for token in path.split('/')[1:]]
+    parent = doc
+    for token in tokens[:-1]:
+        parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+    return parent, tokens[-1]
+
+
+def apply(doc, ops):
+    """Minimal RFC 6902 applier for the operations diff() emits"""
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        if op['path'] == '':
+            assert op['op'] == 'replace'
+            doc = copy.deepcopy(op['value'])
+            continue
+        parent, token = _resolve(doc, op['path'])
+        if op['op'] == 'move':
+            source, source_token = _resolve(doc, op['from'])
+            value = source.pop(int(source_token)) if isinstance(source, list) else source.pop(source_token)
+            parent, token = _resolve(doc, op['path'])
+            op = {'op': 'add', 'path': op['path'], 'value': value}
+        if isinstance(parent, list):
+            index = int(token)
+            if op['op'] == 'add':
+                parent.insert(index, copy.deepcopy(op['value']))
+            elif op['op'] == 'remove':
+                del parent[index]
+            else:
+                parent[index] = copy.deepcopy(op['value'])
+        elif op['op'] == 'remove':
+            del parent[token]
+        else:
+            parent[token] = copy.deepcopy(op['value'])
+    return doc
+
+
+def _course(sections=3, modules=4):
+    return [
+        {
+            'id': s,
+            'name': f"Week {s}",
+            'summary': f"<p>Section {s}</p>",
+            'modules': [
+                {
+                    'id': s * 100 + m,
+                    'name': f"Module {m}",
+                    'visible': 1,
+                    'contents': [{'filename': f"file{m}.pdf", 'timemodified': 1700000000 + m}],
+                }
+                for m in range(modules)
+            ],
+        }
+        for s in range(sections)
+    ]
+
+
+def test_equal_documents_produce_no_operations():
+    assert diff(_course(), _course()) == []
+
+
+@pytest.mark.parametrize('old, new', [
+    ({'a': 1}, {'a': 2}),
+    ({'a': 1, 'b': 2}, {'a': 1}),
+    ({'a': 1}, {'a': 1, 'c': [1, 2]}),
+    ({'a/b': 1, 'm~n': 2}, {'a/b': 3, 'x~/y': 4}),
+    ([1, 2, 3, 4], [1, 9, 3, 4]),
+    ([1, 2, 3, 4], [1, 4]),
+    ([1, 2], [0, 1, 2, 3]),
+    ([], [{'k': 1}]),
+    ({'a': [1, 2]}, {'a': 'text'}),
+    ('old', 'new'),
+])
+def test_round_trip(old, new):
+    assert apply(old, diff(old, new)) == new
+
+
+def test_escape():
+    assert escape('a/b~c') == 'a~1b~0c'
+    assert diff({'a/b': 1}, {'a/b': 2}) == [{'op': 'replace', 'path': '/a~1b', 'value': 2}]
+
+
+def test_inserted_module_is_one_add():
+    old = _course()
+    new = copy.deepcopy(old)
+    new[1]['modules'].insert(0, {'id': 999, 'name': 'New', 'contents': []})
+
+    ops = diff(old, new)
+
+    assert ops == [{'op': 'add', 'path': '/1/modules/0', 'value': new[1]['modules'][0]}]
+    assert apply(old, ops) == new
+
+
+def test_reordered_sections_are_moves():
+    old = _course()
+    new = [old[2], old[0], old[1]]
+
+    ops = diff(old, new)
+
+    assert {op['op'] for op in ops} == {'move'}
+    assert apply(old, ops) == new
+
+
+def test_removed_and_edited_modules():
+    old = _course()
+    new = copy.deepcopy(old)
+    del new[0]['modules'][1]
+    del new[0]['modules'][2]
+    new[2]['modules'][0]['name'] = 'Renamed'
+
+    assert apply(old, diff(old, new)) == new
+
+
+def _mutate(course, rng):
+    course = copy.deepcopy(course)
+    for _ in range(rng.randint(1, 6)):
+        section = rng.choice(course)
+        modules = section['modules']
+        action = rng.choice(('insert', 'remove', 'rename', 'swap', 'summary', 'file'))
+        if action == 'insert':
+            modules.insert(rng.randint(0, len(modules)), {'id': rng.randint(10000, 99999), 'name': 'added'})
+        elif action == 'remove' and modules:
+            modules.pop(rng.randrange(len(modules)))
+        elif action == 'rename' and modules:
+            rng.choice(modules)['name'] = f"renamed {rng.random()}"
+        elif action == 'swap' and len(modules) > 1:
+            i, j = rng.sample(range(len(modules)), 2)
+            modules[i], modules[j] = modules[j], modules[i]
+        elif action == 'summary':
+            section['summary'] = None
+        elif action == 'file' and modules and modules[0].get('contents'):
+            modules[0]['contents'].append({'filename': 'extra.txt', 'timemodified': 1})
+    if rng.random() < 0.3:
+        rng.shuffle(course)
+    return course
+
+
+def test_randomized_round_trips():
+    rng = random.Random(42)
+    for _ in range(300):
+        old = _course(rng.randint(1, 5), rng.randint(0, 6))
+        old = _mutate(old, rng)
+        new = _mutate(old, rng)
+        assert apply(old, diff(old, new)) == new
@@ -0,0 +1,138 @@
+import asyncio
+from collections import OrderedDict
+
+import httpx
+import pytest
+
+from app.services import moodle_client
+from app.services.moodle_client import HedgeBudget, LatencyTracker, MoodleClient, encode_params
+
+
+def test_encode_params_flattens_lists_and_dicts():
+    assert encode_params({
+        'courseids': [3, 5],
+        'options': [{'name': 'excludecontents', 'value': True}, {'name': 'limit', 'value': 0}],
+    }) == {
+        'courseids[0]': '3',
+        'courseids[1]': '5',
+        'options[0][name]': 'excludecontents',
+        'options[0][value]': '1',
+        'options[1][name]': 'limit',
+        'options[1][value]': '0',
+    }
+
+
+def test_encode_params_scalars_and_none():
+    assert encode_params({'userid': 7, 'field': 'id', 'visible': False, 'missing': None}) == {
+        'userid': '7', 'field': 'id', 'visible': '0',
+    }
+    assert encode_params({'events': {'courseids': (1,), 'eventids': []}}) == {'events[courseids][0]': '1'}
+    assert encode_params({}) == {}
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(moodle_client, 'HEDGE_ENABLED', True)
+    monkeypatch.setattr(moodle_client, 'HEDGE_MIN_DELAY', 0.01)
+    monkeypatch.setattr(moodle_client, '_latency_trackers', OrderedDict())
+    monkeypatch.setattr(moodle_client, '_hedge_budget', HedgeBudget())
+    monkeypatch.setattr(moodle_client, '_hedge_counters', dict.fromkeys(moodle_client._hedge_counters, 0))
+    return moodle_client._hedge_counters
+
+
+def _warm(function, latency=0.01):
+    tracker = moodle_client._latency_tracker('https://m.example', function)
+    for _ in range(moodle_client.HEDGE_MIN_SAMPLES):
+        tracker.observe(latency)
+
+
+def _post(function, delays):
+    """POST through _post; the nth upstream attempt answers after delays[n] seconds (negative: fails)"""
+    attempts = []
+
+    async def handler(request):
+        delay = delays[len(attempts)]
+        attempts.append(delay)
+        number = len(attempts)
+        await asyncio.sleep(abs(delay))
+        if delay < 0:
+            return httpx.Response(503)
+        return httpx.Response(200, json={'attempt': number})
+
+    async def run():
+        client = MoodleClient('https://m.example', 'token')
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            response = await client._post(http, function, {'wsfunction': function})
+        return response.json()
+
+    return asyncio.run(run()), attempts
+
+
+def test_latency_tracker_p95():
+    tracker = LatencyTracker()
+    for latency in range(moodle_client.HEDGE_MIN_SAMPLES - 1):
+        tracker.observe(latency)
+    assert tracker.p95() is None
+    tracker.observe(19)
+    assert tracker.p95() == 18
+
+    # Cached between refreshes, recomputed every 10 samples
+    for _ in range(9):
+        tracker.observe(1000)
+    assert tracker.p95() == 18
+    tracker.observe(1000)
+    assert tracker.p95() == 1000
+
+
+def test_hedge_budget(monkeypatch):
+    monkeypatch.setattr(moodle_client, 'HEDGE_BUDGET_BURST', 2)
+    monkeypatch.setattr(moodle_client, 'HEDGE_BUDGET_RATIO', 0.5)
+    budget = HedgeBudget()
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    budget.earn()
+    assert not budget.try_spend()
+    budget.earn()
+    assert budget.try_spend()
+    for _ in range(10):
+        budget.earn()
+    assert budget.tokens == 2
+
+
+def test_slow_read_is_hedged_and_backup_wins(hedging):
+    _warm('core_course_get_contents')
+    result, attempts = _post('core_course_get_contents', [0.5, 0.0])
+    assert result == {'attempt': 2} and len(attempts) == 2
+    assert hedging['hedged'] == 1 and hedging['backup_won'] == 1
+
+
+def test_no_hedge_without_history_for_writes_or_when_fast(hedging):
+    result, attempts = _post('core_course_get_contents', [0.05])
+    assert len(attempts) == 1
+
+    _warm('core_course_get_contents')
+    _warm('mod_assign_save_submission')
+    _, attempts = _post('mod_assign_save_submission', [0.1])
+    assert len(attempts) == 1
+    _, attempts = _post('core_course_get_contents', [0.0])
+    assert len(attempts) == 1
+    assert hedging['hedged'] == 0
+
+
+def test_hedges_stop_when_the_budget_is_spent(hedging, monkeypatch):
+    monkeypatch.setattr(moodle_client, '_hedge_budget', HedgeBudget())
+    moodle_client._hedge_budget.tokens = 0.0
+    _warm('core_course_get_contents')
+    result, attempts = _post('core_course_get_contents', [0.1])
+    assert result == {'attempt': 1} and len(attempts) == 1
+    assert hedging['budget_denied'] == 1
+
+
+def test_failed_attempt_waits_for_the_other(hedging):
+    _warm('core_course_get_contents')
+    # The primary fails after the backup has started; the backup's answer is used
+    result, attempts = _post('core_course_get_contents', [-0.1, 0.2])
+    assert result == {'attempt': 2} and hedging['backup_won'] == 1
+
+    with pytest.raises(httpx.HTTPStatusError):
+        _post('core_course_get_contents', [-0.1, -0.2])
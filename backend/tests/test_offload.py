@@ -0,0 +1,40 @@
+import asyncio
+import os
+import threading
+
+from app.utils import offload
+from app.utils.offload import decode_json, run_sized, start_process_pool, stop_process_pool
+
+
+def test_small_work_runs_inline_and_large_work_in_a_thread():
+    async def run():
+        inline = await run_sized(10, 100, threading.get_ident)
+        offloaded = await run_sized(100, 100, threading.get_ident)
+        # Without a running pool, process work falls back to a thread
+        fallback = await run_sized(100, 100, os.getpid, process=True)
+        return inline, offloaded, fallback
+
+    inline, offloaded, fallback = asyncio.run(run())
+    assert inline == threading.get_ident()
+    assert offloaded != threading.get_ident()
+    assert fallback == os.getpid()
+
+
+def test_process_work_runs_in_the_pool(monkeypatch):
+    monkeypatch.setattr(offload, 'OFFLOAD_PROCESSES', 1)
+
+    async def run():
+        await start_process_pool('json')
+        try:
+            return await run_sized(100, 100, os.getpid, process=True)
+        finally:
+            await stop_process_pool()
+
+    assert asyncio.run(run()) != os.getpid()
+    assert offload._process_pool is None
+
+
+def test_decode_json(monkeypatch):
+    monkeypatch.setattr(offload, 'JSON_OFFLOAD_THRESHOLD', 8)
+    assert asyncio.run(decode_json(b'[1]')) == [1]
+    assert asyncio.run(decode_json(b'{"a": [1, 2, 3]}')) == {'a': [1, 2, 3]}
@@ -0,0 +1,91 @@
+import pytest
+from fastapi import HTTPException
+
+from app.utils.projection import (
+    decode_cursor, encode_cursor, paginate_sections, parse_fields, project, wants_field,
+)
+
+
+def _sections(module_counts):
+    return [
+        {'id': s, 'name': f"Week {s}", 'modules': [{'id': s * 100 + m} for m in range(count)]}
+        for s, count in enumerate(module_counts)
+    ]
+
+
+def test_parse_fields():
+    assert parse_fields(None) == (None, None)
+    assert parse_fields('id,name,modules.id') == ({'id': True, 'name': True, 'modules': {'id': True}}, None)
+    assert parse_fields('-summary,-modules.description') == (
+        None, {'summary': True, 'modules': {'description': True}}
+    )
+    # A whole field wins over a nested path below it
+    assert parse_fields('modules,modules.id') == ({'modules': True}, None)
+
+
+def test_project_include_and_exclude():
+    section = {'id': 1, 'name': 'A', 'summary': '<p/>', 'modules': [{'id': 2, 'name': 'M', 'description': 'd'}]}
+
+    include, exclude = parse_fields('id,modules.name')
+    assert project([section], include, exclude) == [{'id': 1, 'modules': [{'name': 'M'}]}]
+
+    include, exclude = parse_fields('-summary,-modules.description')
+    assert project(section, include, exclude) == {'id': 1, 'name': 'A', 'modules': [{'id': 2, 'name': 'M'}]}
+
+    assert wants_field(*parse_fields('-modules'), 'modules') is False
+    assert wants_field(*parse_fields('id'), 'modules') is False
+    assert wants_field(None, None, 'modules') is True
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(3, 17)) == (3, 17)
+    assert decode_cursor(None) == (0, 0)
+
+
+@pytest.mark.parametrize('cursor', ['garbage!', encode_cursor(-1, 0), 'MTo'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+def _collect(sections, limit, with_modules):
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = paginate_sections(sections, cursor, limit, with_modules)
+        pages.append(page)
+        if cursor is None:
+            return pages
+        assert len(pages) <= 100
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 5, 100])
+def test_paginated_modules_cover_the_course_once(limit):
+    sections = _sections([3, 0, 5, 1, 4])
+    pages = _collect(sections, limit, with_modules=True)
+
+    seen = [module['id'] for page in pages for _, modules in page for module in modules]
+    assert seen == [module['id'] for section in sections for module in section['modules']]
+    for page in pages:
+        # Each module counts once, an empty section counts as one item
+        assert sum(max(len(modules), 1) for _, modules in page) <= limit
+    # Every section appears at least once, in order
+    section_ids = [section['id'] for page in pages for section, _ in page]
+    assert sorted(set(section_ids)) == [section['id'] for section in sections]
+    assert section_ids == sorted(section_ids)
+
+
+def test_paginated_sections_without_modules():
+    sections = _sections([1, 2, 3, 4, 5])
+    pages = _collect(sections, 2, with_modules=False)
+
+    assert [[section['id'] for section, _ in page] for page in pages] == [[0, 1], [2, 3], [4]]
+    assert all(modules == [] for page in pages for _, modules in page)
+
+
+def test_no_limit_returns_everything():
+    sections = _sections([2, 2])
+    page, cursor = paginate_sections(sections, None, None, with_modules=True)
+    assert cursor is None
+    assert [len(modules) for _, modules in page] == [2, 2]
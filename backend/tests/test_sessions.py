@@ -0,0 +1,104 @@
+import asyncio
+from collections import OrderedDict
+from datetime import timedelta
+
+import pytest
+
+from app.services import calendar, dashboard, deadlines
+from app.utils import helpers
+from app.utils.helpers import (
+    cleanup_expired_sessions, create_user_session, delete_user_session, get_active_sessions_count,
+    get_user_session,
+)
+
+SITE = 'https://moodle.example'
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.setenv('SESSION_STORE', request.param)
+    monkeypatch.setenv('SESSION_DB_PATH', str(tmp_path / 'sessions.db'))
+    monkeypatch.setattr(helpers, 'USER_SESSIONS', OrderedDict())
+    monkeypatch.setattr(helpers, 'USER_SESSION_INDEX', {})
+    monkeypatch.setattr(helpers, '_session_store', None)
+    ended = []
+    monkeypatch.setattr(helpers, 'SESSION_END_HOOKS', [ended.append])
+    yield ended
+    if helpers._session_store is not None and hasattr(helpers._session_store, 'conn'):
+        helpers._session_store.conn.close()
+
+
+def _login(userid, token='token'):
+    return asyncio.run(create_user_session(SITE, token, {'userid': userid, 'username': f"user{userid}"}))
+
+
+def test_each_login_gets_its_own_session(store):
+    first, second = _login(1), _login(1)
+    assert first != second
+    assert asyncio.run(delete_user_session(first))
+    # Logging out one device leaves the other signed in
+    assert asyncio.run(get_user_session(second))['user_info']['userid'] == 1
+    assert store == [first]
+
+
+def test_reuse_is_opt_in(store, monkeypatch):
+    monkeypatch.setattr(helpers, 'SESSION_REUSE', True)
+    first = _login(1)
+    assert _login(1) == first
+    assert _login(1, token='other') != first
+
+
+def test_per_user_limit_evicts_least_recently_used(store, monkeypatch):
+    monkeypatch.setattr(helpers, 'MAX_SESSIONS_PER_USER', 2)
+    first, second = _login(1), _login(1)
+    other_user = _login(2)
+    third = _login(1)
+
+    assert asyncio.run(get_user_session(first)) is None
+    assert all(asyncio.run(get_user_session(s)) for s in (second, third, other_user))
+    assert store == [first]
+
+
+def test_global_limit_evicts_least_recently_used(store, monkeypatch):
+    monkeypatch.setattr(helpers, 'MAX_SESSIONS', 2)
+    first, second = _login(1), _login(2)
+    _login(3)
+    assert asyncio.run(get_active_sessions_count()) == 2
+    assert asyncio.run(get_user_session(first)) is None
+    assert asyncio.run(get_user_session(second)) is not None
+    assert store == [first]
+
+
+def test_expired_sessions_end(store, monkeypatch):
+    first, second = _login(1), _login(2)
+    monkeypatch.setattr(helpers, 'SESSION_LIFETIME', timedelta(seconds=-1))
+
+    assert asyncio.run(get_user_session(first)) is None
+    assert asyncio.run(cleanup_expired_sessions()) == 1
+    assert asyncio.run(get_active_sessions_count()) == 0
+    assert sorted(store) == sorted([first, second])
+
+
+def test_ending_a_session_drops_its_cached_state(monkeypatch):
+    monkeypatch.setattr(helpers, 'USER_SESSIONS', OrderedDict())
+    monkeypatch.setattr(helpers, 'USER_SESSION_INDEX', {})
+    monkeypatch.setattr(helpers, '_session_store', None)
+    session_id = _login(1)
+    monkeypatch.setitem(dashboard.DASHBOARD_CACHE, session_id, object())
+    monkeypatch.setitem(deadlines.DEADLINES_CACHE, session_id, object())
+    monkeypatch.setitem(calendar.CALENDAR_CACHE, session_id, OrderedDict())
+
+    assert asyncio.run(delete_user_session(session_id))
+    assert session_id not in dashboard.DASHBOARD_CACHE
+    assert session_id not in deadlines.DEADLINES_CACHE
+    assert session_id not in calendar.CALENDAR_CACHE
+
+
+def test_failing_hook_does_not_stop_the_others(store):
+    async def broken(session_id):
+        raise RuntimeError("boom")
+    helpers.SESSION_END_HOOKS.insert(0, broken)
+
+    session_id = _login(1)
+    assert asyncio.run(delete_user_session(session_id))
+    assert store == [session_id]
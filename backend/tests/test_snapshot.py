@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.services import course_cache, snapshot
+from app.services.course_cache import get_course_entry
+from app.services.file_index import FileIndex
+from app.services.snapshot import CourseSnapshot, export_snapshot, register_snapshot_seeds, snapshot_filename
+
+CONTENTS = [
+    {
+        'id': 10 + s,
+        'name': f"Week {s}",
+        'summary': '<p>Intro</p>',
+        'modules': [{
+            'id': 100 * s + 1,
+            'name': 'Slides',
+            'description': '<b>Read</b> first',
+            'contents': [{'type': 'file', 'filename': f"w{s}.pdf", 'fileurl': f"https://m/{s}.pdf",
+                          'filesize': 10, 'mimetype': 'application/pdf', 'timemodified': 1}],
+        }],
+    }
+    for s in range(3)
+]
+
+
+class FakeClient:
+    base_url = 'https://m.example'
+    token = 'token'
+
+    def __init__(self):
+        self.calls = 0
+
+    async def get_course_contents(self, course_id):
+        self.calls += 1
+        return CONTENTS
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    monkeypatch.setattr(course_cache, 'COURSE_CACHE', type(course_cache.COURSE_CACHE)())
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_SEEDS', {})
+    monkeypatch.setattr(course_cache, 'SNAPSHOT_SEEDS', snapshot.SNAPSHOT_SEEDS)
+
+
+def _export(directory, include_text=False):
+    path = os.path.join(directory, snapshot_filename(FakeClient.base_url, 7, FakeClient.token))
+    export_snapshot(path, FakeClient.base_url, 7, FakeClient.token, CONTENTS,
+                    FileIndex.from_contents(CONTENTS), include_text)
+    return path
+
+
+def test_round_trip(tmp_path):
+    saved = CourseSnapshot(_export(str(tmp_path), include_text=True))
+    assert saved.contents() == CONTENTS
+    assert [entry.to_dict() for entry in saved.file_index().entries] == \
+        [entry.to_dict() for entry in FileIndex.from_contents(CONTENTS).entries]
+    assert {'section_id': 10, 'module_id': 1, 'kind': 'module_description', 'text': 'Read first'} in saved.texts()
+
+
+def test_seed_answers_the_first_request_once(tmp_path):
+    _export(str(tmp_path))
+    assert register_snapshot_seeds(str(tmp_path)) == 1
+    client = FakeClient()
+
+    async def run():
+        entry = await get_course_entry(client, 7)
+        assert entry.contents == CONTENTS and len(entry.file_index) == 3
+        assert entry.is_fresh() and client.calls == 0
+        # The seed is consumed; once the entry goes stale, Moodle is asked
+        course_cache.COURSE_CACHE.clear()
+        await get_course_entry(client, 7)
+        assert client.calls == 1
+
+    asyncio.run(run())
+
+
+def test_stale_seed_is_served_and_refreshed(tmp_path, monkeypatch):
+    _export(str(tmp_path))
+    register_snapshot_seeds(str(tmp_path))
+    monkeypatch.setattr(course_cache, 'COURSE_CACHE_TTL', 0.0)
+    client = FakeClient()
+
+    async def run():
+        entry = await get_course_entry(client, 7)
+        assert entry.contents == CONTENTS and not entry.is_fresh()
+        deadline = time.monotonic() + 3
+        while client.calls == 0:
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+
+def test_old_snapshots_are_pruned(tmp_path):
+    path = _export(str(tmp_path))
+    old = time.time() - snapshot.SNAPSHOT_MAX_AGE - 10
+    os.utime(path, (old, old))
+    assert register_snapshot_seeds(str(tmp_path)) == 0
+    assert not os.path.exists(path)